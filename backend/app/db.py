@@ -1,19 +1,49 @@
+import asyncio
 import os
 import certifi
 from motor.motor_asyncio import AsyncIOMotorClient
 from pydantic_settings import BaseSettings
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, List
+from pymongo.errors import BulkWriteError, ConnectionFailure
 
 class Settings(BaseSettings):
     MONGO_URI: str = ""
     DB_NAME: str = ""
+    MONGO_MAX_POOL_SIZE: int = 100
+    MONGO_MIN_POOL_SIZE: int = 10
+    # Short timeouts so a down database costs milliseconds, not seconds, per call
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = 500
+    MONGO_PING_TIMEOUT_SECONDS: float = 1.0
+    MONGO_HEALTH_CHECK_SECONDS: float = 5.0
 
     DEXCOM_CLIENT_ID: str = ""
     DEXCOM_CLIENT_SECRET: str = ""
     DEXCOM_REDIRECT_URI: str = ""
+    # Overrides the Dexcom API host, e.g. http://localhost:8100 for tools/mock_dexcom.py
+    DEXCOM_BASE_URL: str = ""
+    # Outbound Dexcom traffic (quota is per client ID)
+    DEXCOM_RATE_LIMIT_PER_HOUR: int = 60000
+    DEXCOM_RATE_BURST: int = 50
+    DEXCOM_MAX_RETRIES: int = 4
+    DEXCOM_BREAKER_THRESHOLD: int = 10
+    DEXCOM_BREAKER_RESET_SECONDS: int = 30
 
     OPENAI_API_KEY: str = ""
+
+    # Per-user glucose history (exports, synced readings, snapshots)
+    GLUCOSE_DATA_DIR: str = ""
+    GLUCOSE_MAX_SHARDS: int = 256
+    DEXCOM_BACKFILL_CONCURRENCY: int = 4
+    GLUCOSE_WRITE_BATCH_SIZE: int = 5000
+
+    # Proactive Dexcom token refresh
+    TOKEN_REFRESH_MARGIN_SECONDS: int = 600
+    TOKEN_REFRESH_JITTER_SECONDS: int = 60
+    TOKEN_REFRESH_CONCURRENCY: int = 4
+
+    # Cached /chat/glucose-insights responses
+    INSIGHTS_CACHE_TTL_SECONDS: int = 86400
     
     class Config:
         env_file = ".env"
@@ -28,42 +58,141 @@ db = None
 users_collection = None
 tokens_collection = None
 glucose_collection = None
+sync_state_collection = None
+insights_cache_collection = None
 
 # In-memory fallback storage for when MongoDB is not available
 fallback_tokens = {}
+fallback_sync_state = {}
+
+# Background task that pings MongoDB and flips between Mongo and fallback mode
+_health_task = None
+_migrated = False
+
+def _database_error(e: Exception):
+    """Log a failed DB call; connection errors switch to fallback mode until the next healthy ping"""
+    global mongo_available
+    print(f"Database error: {e}")
+    if isinstance(e, ConnectionFailure) and mongo_available:
+        mongo_available = False
+        print("⚠️ MongoDB unreachable, using fallback storage until it recovers")
 
-def init_mongodb():
-    """Initialize MongoDB connection if available"""
-    global mongo_available, client, db, users_collection, tokens_collection, glucose_collection
+async def _ping() -> bool:
+    try:
+        await asyncio.wait_for(client.admin.command('ping'), timeout=settings.MONGO_PING_TIMEOUT_SECONDS)
+        return True
+    except Exception:
+        return False
+
+async def init_mongodb():
+    """Connect to MongoDB and verify it with an awaited ping (called from the app lifespan)
+    
+    The client and collections are kept even if the first ping fails, so the
+    health monitor can switch to MongoDB as soon as it becomes reachable.
+    """
+    global mongo_available, client, db, users_collection, tokens_collection, glucose_collection, sync_state_collection, \
+        insights_cache_collection
+    
+    if not settings.MONGO_URI:
+        print("MONGO_URI not set - running in fallback mode without database persistence")
+        return
     
     try:
         client = AsyncIOMotorClient(
             settings.MONGO_URI, 
-            serverSelectionTimeoutMS=5000,
+            serverSelectionTimeoutMS=settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+            minPoolSize=settings.MONGO_MIN_POOL_SIZE,
             tls=True,
             tlsCAFile=certifi.where(),
             tlsAllowInvalidCertificates=True
         )
         db = client[settings.DB_NAME]
-        # Test connection with short timeout
-        client.admin.command('ping')
-        mongo_available = True
         users_collection = db.users
         tokens_collection = db.tokens
         glucose_collection = db.glucose
-        print("MongoDB connection successful")
+        sync_state_collection = db.sync_state
+        insights_cache_collection = db.insights_cache
     except Exception as e:
         print(f"MongoDB connection failed: {e}")
         print("Running in fallback mode without database persistence")
-        mongo_available = False
         client = None
-        db = None
-        users_collection = None
-        tokens_collection = None
-        glucose_collection = None
+        return
+    
+    mongo_available = await _ping()
+    if mongo_available:
+        print("MongoDB connection successful")
+    else:
+        print("MongoDB ping failed - running in fallback mode until it becomes reachable")
+
+async def _monitor_health():
+    global mongo_available
+    while True:
+        await asyncio.sleep(settings.MONGO_HEALTH_CHECK_SECONDS)
+        healthy = await _ping()
+        if healthy and not mongo_available:
+            mongo_available = True
+            print("✅ MongoDB reachable again, leaving fallback mode")
+            if not _migrated:
+                await run_migrations()
+        elif not healthy and mongo_available:
+            mongo_available = False
+            print("⚠️ MongoDB health check failed, using fallback storage")
 
-# Initialize MongoDB (will fail gracefully if not available)
-init_mongodb()
+async def start_health_monitor():
+    """Start the background MongoDB health check (no-op without a client)"""
+    global _health_task
+    if client is not None and _health_task is None:
+        _health_task = asyncio.create_task(_monitor_health())
+
+async def close_mongodb():
+    global _health_task, mongo_available
+    if _health_task is not None:
+        _health_task.cancel()
+        try:
+            await _health_task
+        except asyncio.CancelledError:
+            pass
+        _health_task = None
+    if client is not None:
+        client.close()
+    mongo_available = False
+
+GLUCOSE_TIMESERIES_OPTIONS = {"timeField": "ts", "metaField": "user_id", "granularity": "minutes"}
+
+async def run_migrations():
+    """Idempotently create collections and indexes (called at startup)
+    
+    glucose becomes a time-series collection bucketed per user, so window
+    reads scan compressed buckets through the (user_id, ts) index. tokens and
+    sync_state get unique user_id indexes for their per-user lookups, and
+    cached insights expire through a TTL index.
+    """
+    global _migrated
+    if not mongo_available or db is None:
+        return
+    
+    try:
+        cursor = await db.list_collections(filter={"name": "glucose"})
+        existing = {info["name"]: info for info in await cursor.to_list(length=None)}
+        if "glucose" not in existing:
+            await db.create_collection("glucose", timeseries=GLUCOSE_TIMESERIES_OPTIONS)
+            print("Created time-series collection: glucose")
+        elif existing["glucose"].get("type") != "timeseries":
+            # Converting in place isn't possible; copying the data is a manual step
+            print("⚠️ glucose is a regular collection; drop or rename it to migrate to a time-series collection")
+        await glucose_collection.create_index([("user_id", 1), ("ts", 1)])
+        
+        await tokens_collection.create_index("user_id", unique=True)
+        await sync_state_collection.create_index("user_id", unique=True)
+        await insights_cache_collection.create_index(
+            [("user_id", 1), ("analysis_type", 1), ("time_range", 1)], unique=True
+        )
+        await insights_cache_collection.create_index("expires_at", expireAfterSeconds=0)
+        _migrated = True
+        print("MongoDB schema and indexes up to date")
+    except Exception as e:
+        print(f"MongoDB migration failed: {e}")
 
 async def get_user_tokens(user_id: str):
     """Get user's Dexcom tokens from database or fallback storage"""
@@ -71,7 +200,7 @@ async def get_user_tokens(user_id: str):
         try:
             return await tokens_collection.find_one({"user_id": user_id})
         except Exception as e:
-            print(f"Database error: {e}")
+            _database_error(e)
             return fallback_tokens.get(user_id)
     else:
         return fallback_tokens.get(user_id)
@@ -96,12 +225,14 @@ async def save_user_tokens(user_id: str, access_token: str, refresh_token: str,
                 upsert=True
             )
         except Exception as e:
-            print(f"Database error: {e}")
+            _database_error(e)
             # Fallback to in-memory storage
             fallback_tokens[user_id] = token_data
     else:
         # Use in-memory storage
         fallback_tokens[user_id] = token_data
+    
+    return token_data
 
 async def is_token_valid(user_id: str) -> bool:
     """Check if user's access token is still valid"""
@@ -117,13 +248,27 @@ async def get_valid_access_token(user_id: str) -> Optional[str]:
     if not token_doc:
         return None
     
-    if await is_token_valid(user_id):
+    if token_doc.get("expires_at", datetime.min) > datetime.utcnow():
         return token_doc["access_token"]
     
     # Token expired, need to refresh
     print(f"🔄 Access token expired for user {user_id}, attempting refresh...")
     return None  # Will be handled by the service layer
 
+async def get_token_expiries() -> List[dict]:
+    """user_id and expires_at of every stored token (for the refresh scheduler)"""
+    if mongo_available and tokens_collection is not None:
+        try:
+            cursor = tokens_collection.find({}, {"_id": 0, "user_id": 1, "expires_at": 1})
+            return await cursor.to_list(length=None)
+        except Exception as e:
+            _database_error(e)
+    
+    return [
+        {"user_id": user_id, "expires_at": token_doc.get("expires_at")}
+        for user_id, token_doc in fallback_tokens.items()
+    ]
+
 async def delete_user_tokens(user_id: str) -> bool:
     """Delete user's tokens from database or fallback storage"""
     if mongo_available and tokens_collection is not None:
@@ -131,7 +276,7 @@ async def delete_user_tokens(user_id: str) -> bool:
             result = await tokens_collection.delete_one({"user_id": user_id})
             return result.deleted_count > 0
         except Exception as e:
-            print(f"Database error: {e}")
+            _database_error(e)
             # Fallback to in-memory storage
             if user_id in fallback_tokens:
                 del fallback_tokens[user_id]
@@ -143,3 +288,156 @@ async def delete_user_tokens(user_id: str) -> bool:
             del fallback_tokens[user_id]
             return True
         return False
+
+async def get_sync_state(user_id: str) -> Optional[dict]:
+    """Get user's Dexcom sync high-water mark from database or fallback storage"""
+    if mongo_available and sync_state_collection is not None:
+        try:
+            return await sync_state_collection.find_one({"user_id": user_id})
+        except Exception as e:
+            _database_error(e)
+            return fallback_sync_state.get(user_id)
+    else:
+        return fallback_sync_state.get(user_id)
+
+async def save_sync_state(user_id: str, last_ts: int):
+    """Advance user's Dexcom sync high-water mark (epoch seconds of the newest stored EGV)
+    
+    The mark only moves forward, so concurrent syncs and backfills can't rewind it.
+    """
+    if mongo_available and sync_state_collection is not None:
+        try:
+            await sync_state_collection.update_one(
+                {"user_id": user_id},
+                {"$max": {"last_ts": last_ts}, "$set": {"updated_at": datetime.utcnow()}},
+                upsert=True
+            )
+            return
+        except Exception as e:
+            _database_error(e)
+    
+    state = fallback_sync_state.setdefault(user_id, {"user_id": user_id})
+    state["last_ts"] = max(last_ts, state.get("last_ts", last_ts))
+    state["updated_at"] = datetime.utcnow()
+
+async def save_backfill_plan(user_id: str, plan: dict):
+    """Record a new historical backfill plan for the user (replacing any previous one)"""
+    if mongo_available and sync_state_collection is not None:
+        try:
+            await sync_state_collection.update_one(
+                {"user_id": user_id},
+                {"$set": {"backfill": plan}},
+                upsert=True
+            )
+            return
+        except Exception as e:
+            _database_error(e)
+    
+    fallback_sync_state.setdefault(user_id, {"user_id": user_id})["backfill"] = plan
+
+async def mark_backfill_chunk_done(user_id: str, chunk_index: int, completed: bool = False):
+    """Record one finished backfill chunk so an interrupted backfill can resume"""
+    update = {"$addToSet": {"backfill.done": chunk_index}}
+    if completed:
+        update["$set"] = {"backfill.completed_at": datetime.utcnow()}
+    if mongo_available and sync_state_collection is not None:
+        try:
+            await sync_state_collection.update_one({"user_id": user_id}, update)
+            return
+        except Exception as e:
+            _database_error(e)
+    
+    plan = fallback_sync_state.get(user_id, {}).get("backfill")
+    if plan is not None:
+        if chunk_index not in plan["done"]:
+            plan["done"].append(chunk_index)
+        if completed:
+            plan["completed_at"] = datetime.utcnow()
+
+async def get_cached_insight(user_id: str, analysis_type: str, time_range: str) -> Optional[dict]:
+    """Latest unexpired cached insight for the request, whatever data it was generated from
+    
+    Without MongoDB there is nothing to read; the service's in-memory tier covers fallback mode.
+    """
+    if mongo_available and insights_cache_collection is not None:
+        try:
+            return await insights_cache_collection.find_one(
+                {
+                    "user_id": user_id,
+                    "analysis_type": analysis_type,
+                    "time_range": time_range,
+                    # The TTL monitor only runs once a minute
+                    "expires_at": {"$gt": datetime.utcnow()}
+                },
+                {"_id": 0}
+            )
+        except Exception as e:
+            _database_error(e)
+    return None
+
+async def save_cached_insight(entry: dict):
+    """Store a generated insight, replacing the previous one for the same request"""
+    if mongo_available and insights_cache_collection is not None:
+        try:
+            doc = dict(entry, expires_at=datetime.utcnow() + timedelta(seconds=settings.INSIGHTS_CACHE_TTL_SECONDS))
+            await insights_cache_collection.replace_one(
+                {"user_id": entry["user_id"], "analysis_type": entry["analysis_type"], "time_range": entry["time_range"]},
+                doc,
+                upsert=True
+            )
+        except Exception as e:
+            _database_error(e)
+
+async def save_glucose_readings(user_id: str, readings: List[dict]) -> int:
+    """Insert synced readings, skipping (user_id, ts) pairs already stored; returns how many were new
+    
+    One query finds the timestamps already stored in the batch's time span,
+    then the rest go out as unordered insert_many calls of
+    GLUCOSE_WRITE_BATCH_SIZE documents. The time-series collection can't
+    have a unique index, so this check is the only dedupe: callers must not
+    save overlapping batches for one user concurrently. Without MongoDB the
+    readings are only kept in the local glucose store.
+    """
+    if not readings or not mongo_available or glucose_collection is None:
+        return 0
+    
+    try:
+        span = {"$gte": min(r["ts"] for r in readings), "$lte": max(r["ts"] for r in readings)}
+        cursor = glucose_collection.find({"user_id": user_id, "ts": span}, {"_id": 0, "ts": 1})
+        stored = {doc["ts"] for doc in await cursor.to_list(length=None)}
+        
+        documents, seen = [], set()
+        for reading in readings:
+            if reading["ts"] in stored or reading["ts"] in seen:
+                continue
+            seen.add(reading["ts"])
+            documents.append({**reading, "user_id": user_id})
+        
+        inserted = 0
+        batch_size = max(1, settings.GLUCOSE_WRITE_BATCH_SIZE)
+        for i in range(0, len(documents), batch_size):
+            try:
+                result = await glucose_collection.insert_many(documents[i:i + batch_size], ordered=False)
+                inserted += len(result.inserted_ids)
+            except BulkWriteError as e:
+                # A rejected document doesn't stop the rest of an unordered batch
+                inserted += e.details.get("nInserted", 0)
+        return inserted
+    except Exception as e:
+        _database_error(e)
+        return 0
+
+async def get_glucose_readings(user_id: str, since: Optional[datetime] = None) -> List[dict]:
+    """Load a user's stored readings, oldest first"""
+    if not mongo_available or glucose_collection is None:
+        return []
+    
+    query = {"user_id": user_id}
+    if since is not None:
+        query["ts"] = {"$gte": since}
+    try:
+        cursor = glucose_collection.find(query, {"_id": 0, "ts": 1, "local_ts": 1, "mgdl": 1}).sort("ts", 1)
+        return await cursor.to_list(length=None)
+    except Exception as e:
+        _database_error(e)
+        return []
@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
@@ -7,8 +8,24 @@ import os
 load_dotenv()
 
 from app.routers import health, auth, dexcom, glucose, chat
+from app.db import init_mongodb, run_migrations, start_health_monitor, close_mongodb
+from app.services.dexcom_service import dexcom_service
+from app.services.token_refresh_scheduler import token_refresh_scheduler
 
-app = FastAPI(title="Diabetes Tracker API", version="0.1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_mongodb()
+    await run_migrations()
+    await start_health_monitor()
+    # Shared outbound connection pools live as long as the app
+    await dexcom_service.start()
+    await token_refresh_scheduler.start()
+    yield
+    await token_refresh_scheduler.close()
+    await dexcom_service.close()
+    await close_mongodb()
+
+app = FastAPI(title="Diabetes Tracker API", version="0.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -1,7 +1,10 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from app.services.chat_service import chat_service
-from typing import Optional
+from app.services.insights_service import glucose_insights_service, ANALYSIS_PROMPTS, TIME_RANGE_HOURS
+from typing import Optional, Dict, Any
+import json
 
 router = APIRouter()
 
@@ -31,6 +34,8 @@ class GlucoseInsightResponse(BaseModel):
     model: Optional[str] = None
     usage: Optional[dict] = None
     error: Optional[str] = None
+    cached: Optional[bool] = False
+    stale: Optional[bool] = False
 
 @router.post("/chat", response_model=ChatResponse)
 async def chat_with_ai(request: ChatRequest):
@@ -51,33 +56,59 @@ async def chat_with_ai(request: ChatRequest):
             detail=f"Failed to process chat request: {str(e)}"
         )
 
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """One server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Send a message to the AI chat and stream the response as server-sent events
+
+    Events: 'start', 'delta' ({'text'} to append), 'replace' ({'text'} to
+    show instead of everything so far), then 'done' or 'error'.
+    """
+    async def events():
+        async for event, data in chat_service.stream_chat_response(
+            message=request.message,
+            context=request.context,
+            user_id=request.user_id
+        ):
+            yield format_sse(event, data)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/chat/glucose-insights", response_model=GlucoseInsightResponse)
 async def get_glucose_insights(request: GlucoseInsightRequest):
-    """Get AI-powered insights and analysis of glucose data"""
+    """Get AI-powered insights and analysis of glucose data
+    
+    Served from cache while the window's readings are unchanged; when they
+    have changed, the previous insight comes back marked stale while a new
+    one is generated in the background.
+    """
+    if request.analysis_type not in ANALYSIS_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"Invalid analysis_type. Must be one of: {list(ANALYSIS_PROMPTS)}")
+    if request.time_range not in TIME_RANGE_HOURS:
+        raise HTTPException(status_code=400, detail=f"Invalid time_range. Must be one of: {list(TIME_RANGE_HOURS)}")
+    
     try:
-        # Create a specific prompt for glucose analysis
-        analysis_prompts = {
-            "general": "Provide a comprehensive analysis of my glucose data including trends, patterns, and overall health insights.",
-            "trends": "Analyze the trends in my glucose data over time. What patterns do you see?",
-            "patterns": "What patterns can you identify in my glucose readings? Are there consistent highs or lows at certain times?",
-            "recommendations": "Based on my glucose data, what lifestyle recommendations or monitoring suggestions do you have?"
-        }
-        
-        prompt = analysis_prompts.get(request.analysis_type, analysis_prompts["general"])
-        
-        # Get response from OpenAI with glucose context
-        result = await chat_service.get_chat_response(
-            message=prompt,
-            context=f"Please analyze my glucose data for the last {request.time_range}",
+        result = await glucose_insights_service.get_insights(
+            analysis_type=request.analysis_type,
+            time_range=request.time_range,
             user_id=request.user_id
         )
         
         if result["success"]:
             return GlucoseInsightResponse(
                 success=True,
-                insights=result["response"],
+                insights=result["insights"],
                 model=result["model"],
-                usage=result["usage"]
+                usage=result["usage"],
+                cached=result["cached"],
+                stale=result["stale"]
             )
         else:
             return GlucoseInsightResponse(
@@ -1,7 +1,9 @@
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.responses import RedirectResponse
 from app.services.dexcom_service import dexcom_service
-from app.db import settings, get_user_tokens, save_user_tokens, is_token_valid, delete_user_tokens
+from app.services.sync_service import glucose_sync_service
+from app.services.token_refresh_scheduler import token_refresh_scheduler
+from app.db import settings, get_user_tokens, save_user_tokens, is_token_valid, delete_user_tokens, get_sync_state
 import secrets
 from typing import Optional
 
@@ -71,7 +73,10 @@ async def dexcom_callback(code: str, state: str):
         
         print(f"💾 Storing tokens in database...")
         # Store tokens in database
-        await save_user_tokens(user_id, access_token, refresh_token, expires_in)
+        token_doc = await save_user_tokens(user_id, access_token, refresh_token, expires_in)
+        dexcom_service.invalidate_token(user_id)
+        token_refresh_scheduler.track(user_id, token_doc["expires_at"])
+        glucose_sync_service.schedule_backfill(user_id)
         
         print(f"✅ Successfully stored tokens for user: {user_id}")
         
@@ -115,11 +120,37 @@ async def dexcom_status(user_id: str):
             'message': f'Error checking status: {str(e)}'
         }
 
+@router.get('/backfill/{user_id}')
+async def dexcom_backfill_status(user_id: str):
+    """Progress of the user's historical Dexcom backfill"""
+    state = await get_sync_state(user_id)
+    plan = state.get('backfill') if state else None
+    if not plan:
+        if glucose_sync_service.is_backfilling(user_id):
+            return {'status': 'running', 'message': 'Planning backfill'}
+        return {'status': 'not_started', 'message': 'No backfill recorded for this user'}
+    
+    if plan.get('completed_at'):
+        status = 'completed'
+    elif glucose_sync_service.is_backfilling(user_id):
+        status = 'running'
+    else:
+        status = 'interrupted'
+    return {
+        'status': status,
+        'chunks_done': len(plan['done']),
+        'chunks_total': plan['chunks'],
+        'started_at': plan.get('started_at'),
+        'completed_at': plan.get('completed_at')
+    }
+
 @router.post('/disconnect/{user_id}')
 async def dexcom_disconnect(user_id: str):
     """Disconnect user from Dexcom (remove tokens)"""
     try:
         result = await delete_user_tokens(user_id)
+        dexcom_service.invalidate_token(user_id)
+        token_refresh_scheduler.forget(user_id)
         
         if result:
             return {'status': 'success', 'message': 'Successfully disconnected from Dexcom'}
@@ -239,7 +270,10 @@ async def exchange_token(request: dict):
         
         # Always use the original user_id from the OAuth state
         print(f"✅ Storing tokens for user: {original_user_id}")
-        await save_user_tokens(original_user_id, access_token, refresh_token, expires_in)
+        token_doc = await save_user_tokens(original_user_id, access_token, refresh_token, expires_in)
+        dexcom_service.invalidate_token(original_user_id)
+        token_refresh_scheduler.track(original_user_id, token_doc["expires_at"])
+        glucose_sync_service.schedule_backfill(original_user_id)
         print(f"✅ Tokens stored for user: {original_user_id}")
         
         return {
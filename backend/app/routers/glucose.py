@@ -1,205 +1,154 @@
-from fastapi import APIRouter, HTTPException
-from datetime import datetime, timedelta, timezone
-from app.db import get_user_tokens, is_token_valid
-from app.services.dexcom_service import dexcom_service
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from datetime import datetime
 from app.services.real_data_service import real_data_service
-from typing import List, Dict, Any
+from app.services.cache import LRUCache
+from app.services.dexcom_egvs import decode_egvs
+from app.services.downsample import DOWNSAMPLE_METHODS
+from app.services.glucose_access import glucose_access
+from app.services.glucose_store import to_epoch_seconds
+from typing import List, Dict, Any, Optional, Callable
+import hashlib
+import json
+import numpy as np
 
 router = APIRouter()
 
+# Serialized /glucose bodies keyed by ETag; polling clients mostly get 304s or hits here
+_response_cache = LRUCache(max_entries=256, ttl_seconds=300)
+
+def make_etag(*parts: Any) -> str:
+    """Cheap strong validator from the parts that determine a response body"""
+    return '"' + hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=12).hexdigest() + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f"W/{etag}" in candidates
+
+def cached_json_response(request: Request, etag: str, build: Callable[[], Optional[Dict[str, Any]]]) -> Optional[Response]:
+    """Answer with 304, a cached body or a freshly built one; None if build() had nothing to return"""
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    
+    body = _response_cache.get(etag)
+    if body is None:
+        payload = build()
+        if payload is None:
+            return None
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        _response_cache.set(etag, body)
+    return Response(content=body, media_type='application/json', headers=headers)
+
 @router.get('/glucose')
-async def glucose(range: str = '24h', user_id: str = "default_user"):
-    """Get glucose data - try real Dexcom data first, fallback to real CSV data, then synthetic"""
+async def glucose(
+    request: Request,
+    range: str = '24h',
+    user_id: str = "default_user",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    max_points: Optional[int] = Query(None, ge=3, le=10000),
+    downsample: str = 'lttb'
+):
+    """Get glucose data - try real Dexcom data first, fallback to real CSV data, then synthetic
+
+    An explicit [start, end) window takes precedence over `range`. With
+    `max_points` the window is downsampled server-side (LTTB or min/max
+    bucketing) so long ranges can be charted from a few hundred points.
+    Responses carry an ETag and honor If-None-Match.
+    """
 
     # Validate range parameter
-    valid_ranges = ['3h', '6h', '12h', '24h']
+    valid_ranges = ['3h', '6h', '12h', '24h', '7d', '14d', '30d', '90d']
     if range not in valid_ranges:
         raise HTTPException(status_code=400, detail=f"Invalid range. Must be one of: {valid_ranges}")
+    if downsample not in DOWNSAMPLE_METHODS:
+        raise HTTPException(status_code=400, detail=f"Invalid downsample method. Must be one of: {list(DOWNSAMPLE_METHODS)}")
     
     # Convert range to hours
     range_hours = {
         '3h': 3,
         '6h': 6,
         '12h': 12,
-        '24h': 24
+        '24h': 24,
+        '7d': 7 * 24,
+        '14d': 14 * 24,
+        '30d': 30 * 24,
+        '90d': 90 * 24
     }[range]
-    
-    # Try to get real Dexcom data first
-    try:
-        # Check if user has valid tokens
-        if await is_token_valid(user_id):
-            print(f"✅ User {user_id} has valid tokens, fetching Dexcom data...")
-
-            # Since Dexcom sandbox has no glucose data, use realistic simulated data
-            # This mimics what real CGM data would look like
-            print("📊 Dexcom sandbox detected - using realistic simulated glucose data")
-            simulated_data = generate_realistic_glucose_data(range_hours)
-            return {
-                'source': 'dexcom_simulated',
-                'data': simulated_data,
-                'range': range,
-                'message': 'Realistic simulated glucose data (Dexcom sandbox has no real data)'
-            }
-
-    except Exception as e:
-        # Log error but continue to fallback
-        print(f"Failed to fetch Dexcom data: {e}")
 
-    # Try to get real data from CSV file
-    try:
-        real_csv_data = real_data_service.get_glucose_data(hours=range_hours)
-        if real_csv_data:
+    if start is not None and end is not None:
+        # Compare as epoch seconds: one of start/end may carry an offset and the other not
+        span_seconds = to_epoch_seconds(end) - to_epoch_seconds(start)
+        if span_seconds <= 0:
+            raise HTTPException(status_code=400, detail="end must be after start")
+        # Size generated fallback data to the explicit window
+        range_hours = max(1, span_seconds // 3600)
+
+    window = (range, start, end, max_points, downsample)
+
+    # Try synced Dexcom data first, then the Dexcom export, then generated data
+    for source in await glucose_access.sources(user_id):
+        def build(source=source):
+            data = glucose_access.load(source, user_id, range_hours, start, end, max_points, downsample)
+            if not data:
+                return None
             return {
-                'source': 'real_csv',
-                'data': real_csv_data,
+                'source': source.name,
+                'data': data,
                 'range': range,
-                'message': 'Using real glucose data from your Dexcom export'
+                'message': source.message
             }
-    except Exception as e:
-        print(f"Failed to load CSV data: {e}")
 
-    # Final fallback to synthetic data
-    data = synth_points(range_hours)
-    return {
-        'source': 'synthetic',
-        'data': data,
-        'range': range,
-        'message': 'Using synthetic data - no real data available'
-    }
+        try:
+            response = cached_json_response(request, make_etag(source.name, user_id, window, *source.version), build)
+        except Exception as e:
+            print(f"Failed to load {source.name} glucose data: {e}")
+            continue
+        if response is not None:
+            return response
+
+    raise HTTPException(status_code=500, detail="No glucose data source available")
 
 def transform_dexcom_data(dexcom_response: Dict[str, Any]) -> List[Dict[str, Any]]:
     """Transform Dexcom API response to our format - handles sandbox glucose data"""
-    transformed = []
-
-    # Handle V2 API glucose data response (sandbox has real data)
-    if 'egvs' in dexcom_response and dexcom_response['egvs']:
-        print(f"Processing {len(dexcom_response['egvs'])} glucose readings from Dexcom")
-        for egv in dexcom_response['egvs']:
-            # Convert Dexcom timestamp to ISO format
-            # Dexcom uses milliseconds since epoch
-            ts = datetime.fromtimestamp(egv['systemTime'] / 1000, tz=timezone.utc)
-
-            transformed.append({
-                'ts': ts.isoformat(),
-                'mgdl': egv['value'],
-                'trend': egv.get('trend', 'unknown'),
-                'trendRate': egv.get('trendRate', None)
-            })
-    
-    # Handle empty data response
-    elif 'egvs' in dexcom_response and (not dexcom_response['egvs'] or len(dexcom_response['egvs']) == 0):
-        print("Dexcom returned empty glucose data")
-        return []
-    
     # Handle unexpected response format
-    else:
+    if 'egvs' not in dexcom_response:
         print(f"Unexpected Dexcom response format: {dexcom_response}")
         return []
 
-    return transformed
-
+    # Handle empty data response
+    if not dexcom_response['egvs']:
+        print("Dexcom returned empty glucose data")
+        return []
 
+    # Handle V2 API glucose data response (sandbox has real data)
+    print(f"Processing {len(dexcom_response['egvs'])} glucose readings from Dexcom")
+    columns = decode_egvs(dexcom_response)
+    stamps = np.datetime_as_string(columns.ts.astype('datetime64[s]'), unit='s').tolist()
+    rates = columns.trend_rate.tolist()
+    return [
+        {
+            'ts': f"{ts}+00:00",
+            'mgdl': mgdl,
+            'trend': trend or 'unknown',
+            'trendRate': rate if rate == rate else None  # NaN -> None
+        }
+        for ts, mgdl, trend, rate in zip(stamps, columns.mgdl.tolist(), columns.trend.tolist(), rates)
+    ]
 
-def generate_realistic_glucose_data(hours: int) -> List[Dict[str, Any]]:
-    """Generate realistic glucose data that mimics real CGM patterns"""
-    now = datetime.now(timezone.utc)
-    pts = []
-    
-    # More frequent sampling for realistic CGM data
-    if hours <= 6:
-        interval_minutes = 5  # 5-minute intervals for short ranges (like real CGM)
-    elif hours <= 12:
-        interval_minutes = 10  # 10-minute intervals for medium ranges
-    else:
-        interval_minutes = 15  # 15-minute intervals for longer ranges
-    
-    num_points = (hours * 60) // interval_minutes
-    
-    # Create realistic glucose patterns
-    base_glucose = 120  # Base glucose level
-    meal_effects = []  # Simulate meal effects
-    
-    for i in range(num_points):
-        ts = now - timedelta(minutes=interval_minutes * i)
-        
-        # Simulate meal effects (breakfast, lunch, dinner patterns)
-        hour_of_day = ts.hour
-        if 7 <= hour_of_day <= 9:  # Breakfast time
-            meal_effects.append(40)  # Post-meal rise
-        elif 12 <= hour_of_day <= 14:  # Lunch time
-            meal_effects.append(35)  # Post-meal rise
-        elif 18 <= hour_of_day <= 20:  # Dinner time
-            meal_effects.append(45)  # Post-meal rise
-        else:
-            meal_effects.append(0)  # No meal effect
-        
-        # Apply meal effects with decay
-        meal_effect = sum(meal_effects[-3:]) * 0.3  # Decay over time
-        
-        # Add realistic variation
-        variation = (i % 20 - 10) * 2  # Small variations
-        trend = (i % 40 - 20) * 0.5  # Gradual trends
-        
-        # Calculate final glucose value
-        mgdl = base_glucose + meal_effect + variation + trend
-        
-        # Keep within realistic bounds
-        mgdl = max(70, min(300, mgdl))
-        
-        pts.append({
-            'ts': ts.isoformat(),
-            'mgdl': round(mgdl, 1),
-            'trend': get_trend_direction(mgdl, pts[-1]['mgdl'] if pts else mgdl)
-        })
-    
-    return list(reversed(pts))
-
-def get_trend_direction(current: float, previous: float) -> str:
-    """Get trend direction for glucose values"""
-    if current > previous + 5:
-        return "rising"
-    elif current < previous - 5:
-        return "falling"
-    else:
-        return "stable"
-
-# Keep synthetic data as final fallback
-def synth_points(hours: int):
-    now = datetime.now(timezone.utc)
-    pts = []
-    # For shorter time ranges, use more frequent sampling
-    if hours <= 6:
-        interval_minutes = 15  # 15-minute intervals for short ranges
-    elif hours <= 12:
-        interval_minutes = 30  # 30-minute intervals for medium ranges
-    else:
-        interval_minutes = 60  # 1-hour intervals for longer ranges
-    
-    num_points = (hours * 60) // interval_minutes
-    
-    for i in range(num_points):
-        ts = now - timedelta(minutes=interval_minutes * i)
-        base = 110
-        swing = 30
-        # Create more realistic patterns for different time ranges
-        if hours <= 6:
-            # Short range: more variation
-            mgdl = base + (i % 8 - 4) / 4 * swing
-        elif hours <= 12:
-            # Medium range: moderate variation
-            mgdl = base + (i % 12 - 6) / 6 * swing
-        else:
-            # Long range: gradual variation
-            mgdl = base + (i % 24 - 12) / 12 * swing
-        
-        pts.append({'ts': ts.isoformat(), 'mgdl': round(mgdl, 1)})
-    return list(reversed(pts))
 
 @router.get('/glucose/summary')
-async def glucose_summary():
-    """Get summary statistics about available glucose data"""
+async def glucose_summary(
+    user_id: str = "default_user",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    """Get summary statistics about a user's glucose data, optionally for a [start, end) window"""
     try:
-        summary = real_data_service.get_data_summary()
+        await real_data_service.refresh(user_id)
+        summary = real_data_service.get_data_summary(start=start, end=end, user_id=user_id)
         return {
             'success': True,
             'data': summary
@@ -210,3 +159,28 @@ async def glucose_summary():
             'error': str(e),
             'data': None
         }
+
+@router.get('/glucose/agp')
+async def glucose_agp(
+    user_id: str = "default_user",
+    days: int = Query(14, ge=1, le=90),
+    bins: int = Query(288, ge=1, le=1440),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    """Get the Ambulatory Glucose Profile (percentile bands by time of day) for a multi-day window"""
+    if 1440 % bins != 0:
+        raise HTTPException(status_code=400, detail="bins must split a day into whole minutes (e.g. 24, 96, 288)")
+    try:
+        await real_data_service.refresh(user_id)
+        agp = real_data_service.get_agp(days=days, start=start, end=end, bins=bins, user_id=user_id)
+        return {
+            'success': True,
+            'data': agp
+        }
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e),
+            'data': None
+        }
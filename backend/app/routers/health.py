@@ -1,7 +1,8 @@
 from fastapi import APIRouter
+from app import db
 
 router = APIRouter()
 
 @router.get('/health')
 async def health():
-    return {'status': 'ok'}
+    return {'status': 'ok', 'database': 'mongodb' if db.mongo_available else 'fallback'}
@@ -0,0 +1,63 @@
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """Small in-process LRU cache with optional TTL, memory cap and version tags
+
+    An entry stored with a version is only returned to callers asking for the
+    same version, so callers can key on their request and pass the current
+    data version to get invalidation for free when new data arrives. With
+    max_bytes, least recently used entries are also evicted once the values'
+    total size goes over the cap.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: Optional[float] = None,
+                 max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable, version: Any = None) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, entry_version, expires_at, _ = entry
+        if entry_version != version or (expires_at is not None and expires_at < time.monotonic()):
+            self.pop(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, version: Any = None):
+        # Shallow size: right for str/bytes bodies, a lower bound for containers
+        size = sys.getsizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Would evict everything else and still not fit
+            self.pop(key)
+            return
+        self.pop(key)
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else None
+        self._entries[key] = (value, version, expires_at, size)
+        self.total_bytes += size
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None and self.total_bytes > self.max_bytes
+        ):
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= evicted[3]
+
+    def pop(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[3]
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -1,27 +1,82 @@
 import openai
 import os
-import re
-import httpx
-from typing import Dict, Any, List
+from typing import Dict, Any, List, AsyncIterator, Tuple
 from datetime import datetime, timedelta
 
+from app.services.cache import LRUCache
+from app.services.glucose_access import glucose_access
+from app.services.response_postprocess import MarkdownCleaner, clean_markdown, contains_dangerous_content, dangerous_scan_start
+
+# Cleaned text kept back while streaming, so a dangerous phrase is caught
+# before any of it is sent; longer than any match of the dangerous patterns.
+STREAM_HOLD_BACK_CHARS = 80
+
+SAFE_ALTERNATIVE_RESPONSE = """I apologize, but I cannot provide specific medical advice or recommendations about medications or insulin dosing. 
+
+Instead, I can help you understand your glucose data patterns and provide general educational information about diabetes management.
+
+For any medical decisions, medication changes, or treatment plans, please consult your healthcare provider directly. They are the only ones qualified to give you personalized medical advice.
+
+What specific aspect of your glucose data would you like me to help you understand or analyze?"""
+
+ERROR_RESPONSE = "I'm sorry, I'm having trouble processing your request right now. Please try again later."
+
+
+class StreamingResponseFilter:
+    """Markdown cleanup and the safety check applied to a completion as it streams
+
+    feed() takes raw model deltas and returns the cleaned text that can be
+    sent now. Cleanup output is final as soon as it is produced, so the
+    streamed text is exactly what the non-streaming path returns, and the
+    safety check only rescans the last few words of it. The last `hold_back`
+    characters wait for finish(), and nothing more is sent once the text so
+    far looks dangerous; if the finished text is dangerous, finish() replaces
+    the response with the safe alternative.
+    """
+
+    def __init__(self, hold_back: int = STREAM_HOLD_BACK_CHARS):
+        self.hold_back = hold_back
+        self.cleaner = MarkdownCleaner()
+        self.text = ""
+        self.sent = 0
+        self.scan_from = 0
+        self.holding = False
+
+    def feed(self, delta: str) -> str:
+        cleaned = self.cleaner.feed(delta)
+        if not cleaned:
+            return ""
+        self.text += cleaned
+        if self.holding:
+            return ""
+        if contains_dangerous_content(self.text, self.scan_from):
+            # Later tokens can't be trusted to make this safe; finish() decides
+            self.holding = True
+            return ""
+        self.scan_from = dangerous_scan_start(self.text)
+        ready = len(self.text) - self.hold_back
+        if ready <= self.sent:
+            return ""
+        chunk = self.text[self.sent:ready]
+        self.sent = ready
+        return chunk
+
+    def finish(self) -> Tuple[str, str]:
+        """The last event to send: ('delta', rest of the text) or ('replace', safe alternative)"""
+        self.text += self.cleaner.finish()
+        # A match seen while streaming may have been undone by later text, so recheck all of it
+        if contains_dangerous_content(self.text, 0 if self.holding else self.scan_from):
+            return "replace", SAFE_ALTERNATIVE_RESPONSE
+        return "delta", self.text[self.sent:]
+
+
 class ChatService:
     def __init__(self):
         self.client = None
         self._initialized = False
         
-        # Define dangerous medical advice patterns to filter out
-        self.dangerous_patterns = [
-            r'\b(?:take|give|inject|administer|use)\s+\d+\s*(?:units?|iu|iu\'s)\s+insulin\b',
-            r'\b(?:increase|decrease|adjust|change|modify)\s+(?:your\s+)?insulin\s+(?:dose|dosage|amount)\b',
-            r'\b(?:stop|start|discontinue|begin)\s+(?:taking|using)\s+(?:insulin|medication|medicine)\b',
-            r'\b(?:you\s+should|you\s+must|you\s+need\s+to)\s+(?:take|give|inject)\s+insulin\b',
-            r'\b(?:prescribe|prescription)\s+(?:of\s+)?(?:insulin|medication)\b',
-            r'\b(?:emergency|urgent|immediate|right\s+now)\s+(?:insulin|medication|treatment)\b'
-        ]
-        
-        # Compile regex patterns for efficiency
-        self.dangerous_regex = [re.compile(pattern, re.IGNORECASE) for pattern in self.dangerous_patterns]
+        # Rendered glucose context per (user, hours, versions of the sources that produced it)
+        self._context_cache = LRUCache(max_entries=1024, max_bytes=4 * 1024 * 1024)
     
     def _ensure_initialized(self):
         """Initialize the OpenAI client if not already done"""
@@ -31,56 +86,9 @@ class ChatService:
             if not api_key:
                 raise ValueError("OPENAI_API_KEY environment variable is required")
             
-            self.client = openai.OpenAI(api_key=api_key)
+            self.client = openai.AsyncOpenAI(api_key=api_key)
             self._initialized = True
     
-    def _check_for_dangerous_content(self, text: str) -> bool:
-        """Check if the text contains dangerous medical advice patterns"""
-        text_lower = text.lower()
-        
-        # Check for dangerous patterns
-        for pattern in self.dangerous_regex:
-            if pattern.search(text):
-                return True
-        
-        # Additional safety checks
-        dangerous_phrases = [
-            "take insulin", "give insulin", "inject insulin", "insulin dose",
-            "prescription", "you should take insulin", "you must take insulin", "you need to take insulin"
-        ]
-        
-        return any(phrase in text_lower for phrase in dangerous_phrases)
-    
-    def _clean_markdown_formatting(self, text: str) -> str:
-        """Clean up markdown formatting for professional appearance"""
-        # Remove bold formatting (**text** -> text)
-        text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
-        
-        # Remove italic formatting (*text* -> text)
-        text = re.sub(r'\*(.*?)\*', r'\1', text)
-        
-        # Remove header formatting (# ## ### -> clean text) - more thorough
-        text = re.sub(r'^#{1,6}\s+', '', text, flags=re.MULTILINE)
-        text = re.sub(r'\n\s*#{1,6}\s+', '\n', text, flags=re.MULTILINE)
-        
-        # Remove code formatting (`text` -> text)
-        text = re.sub(r'`(.*?)`', r'\1', text)
-        
-        # Remove link formatting ([text](url) -> text)
-        text = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', text)
-        
-        # Clean up extra whitespace and ensure proper formatting
-        text = re.sub(r'\n\s*\n\s*\n', '\n\n', text)
-        text = re.sub(r'\n\s*-\s*', '\n- ', text)
-        
-        # Ensure proper spacing after header removal
-        text = re.sub(r'\n\s*\n', '\n\n', text)
-        
-        # Clean up any remaining markdown artifacts
-        text = re.sub(r'^\s*#{1,6}\s*$', '', text, flags=re.MULTILINE)
-        
-        return text.strip()
-
     def _add_safety_disclaimer(self, response: str) -> str:
         """Add safety disclaimers to AI responses"""
         safety_disclaimer = """
@@ -97,50 +105,49 @@ IMPORTANT SAFETY REMINDER:
     async def _get_glucose_context(self, hours: int = 24, user_id: str = "default_user") -> str:
         """Get recent glucose data context for the AI"""
         try:
-            # Convert hours to range string
-            range_str = f"{hours}h"
+            # The rendered block only changes when the data it came from does. Entries are
+            # keyed on the versions of the source that served the window and of the
+            # sources ahead of it, so the always-present generated fallback (whose version
+            # moves every 5 minutes) doesn't invalidate context built from real readings.
+            candidates = await glucose_access.sources(user_id)
+            versions = [(source.name, source.version) for source in candidates]
+            for served in range(1, len(versions) + 1):
+                cached = self._context_cache.get((user_id, hours, tuple(versions[:served])))
+                if cached is not None:
+                    return cached
             
-            # Call the glucose endpoint to get data the same way frontend does
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"http://localhost:8000/glucose",
-                    params={"range": range_str, "user_id": user_id}
-                )
-                
-                if response.status_code != 200:
-                    return f"Error fetching glucose data: HTTP {response.status_code}"
-                
-                glucose_response = response.json()
-                glucose_data = glucose_response.get('data', [])
-                source = glucose_response.get('source', 'unknown')
-                
-                if not glucose_data:
-                    return "No recent glucose data available."
-                
-                # Calculate key metrics
-                glucose_values = [point['mgdl'] for point in glucose_data]
-                avg_glucose = sum(glucose_values) / len(glucose_values)
-                min_glucose = min(glucose_values)
-                max_glucose = max(glucose_values)
-                
-                # Get time range
-                start_time = glucose_data[0]['ts']
-                end_time = glucose_data[-1]['ts']
-                
-                # Count readings in different ranges
-                low_count = len([g for g in glucose_values if g < 70])
-                normal_count = len([g for g in glucose_values if 70 <= g <= 180])
-                high_count = len([g for g in glucose_values if g > 180])
-                
-                # Format times nicely
-                start_formatted = datetime.fromisoformat(start_time.replace('Z', '+00:00')).strftime('%m/%d %H:%M')
-                end_formatted = datetime.fromisoformat(end_time.replace('Z', '+00:00')).strftime('%m/%d %H:%M')
-                
-                context = f"""
+            # Stats for the same window /glucose would serve, read in-process; stored
+            # sources answer from their prefix sums without building point dicts
+            window = await glucose_access.get_window_stats(user_id, hours, candidates=candidates)
+            stats = window['stats']
+            source = window['source']
+            
+            if not stats:
+                return "No recent glucose data available."
+            served = [name for name, _ in versions].index(source) + 1
+            
+            avg_glucose = stats['mean']
+            min_glucose = stats['min']
+            max_glucose = stats['max']
+            
+            # Get time range
+            start_time = window['start']
+            end_time = window['end']
+            
+            # Count readings in different ranges
+            low_count = stats['low']
+            normal_count = stats['normal']
+            high_count = stats['high']
+            
+            # Format times nicely
+            start_formatted = datetime.fromisoformat(start_time.replace('Z', '+00:00')).strftime('%m/%d %H:%M')
+            end_formatted = datetime.fromisoformat(end_time.replace('Z', '+00:00')).strftime('%m/%d %H:%M')
+            
+            context = f"""
 Recent Glucose Data (Last {hours} hours):
 - Data Source: {source}
 - Time Range: {start_formatted} to {end_formatted}
-- Total Readings: {len(glucose_data)}
+- Total Readings: {stats['count']}
 - Average: {avg_glucose:.1f} mg/dL
 - Range: {min_glucose} - {max_glucose} mg/dL
 - Low readings (<70 mg/dL): {low_count}
@@ -149,12 +156,13 @@ Recent Glucose Data (Last {hours} hours):
 
 Latest Readings:
 """
-                # Add last 5 readings for context
-                for point in glucose_data[-5:]:
-                    time_formatted = datetime.fromisoformat(point['ts'].replace('Z', '+00:00')).strftime('%H:%M')
-                    context += f"- {time_formatted}: {point['mgdl']} mg/dL\n"
-                
-                return context
+            # Add last 5 readings for context
+            for point in window['latest']:
+                time_formatted = datetime.fromisoformat(point['ts'].replace('Z', '+00:00')).strftime('%H:%M')
+                context += f"- {time_formatted}: {point['mgdl']} mg/dL\n"
+            
+            self._context_cache.set((user_id, hours, tuple(versions[:served])), context)
+            return context
                 
         except Exception as e:
             return f"Error loading glucose data: {str(e)}"
@@ -171,21 +179,19 @@ Latest Readings:
         message_lower = message.lower()
         return any(keyword in message_lower for keyword in health_keywords)
     
-    async def get_chat_response(self, message: str, context: str = "", user_id: str = "default_user") -> Dict[str, Any]:
-        """Get a response from OpenAI based on the user's message with glucose context if relevant"""
-        try:
-            self._ensure_initialized()
-            
-            # Determine if we should include glucose context
-            include_glucose = self._should_include_glucose_context(message)
-            glucose_context = ""
-            
-            if include_glucose:
-                # Get 24 hours of glucose data for context
-                glucose_context = await self._get_glucose_context(hours=24, user_id=user_id)
-            
-            # Create a comprehensive system prompt with balanced safety measures
-            system_prompt = """You are a helpful AI assistant specialized in diabetes management and glucose monitoring. 
+    async def _build_messages(self, message: str, context: str, user_id: str,
+                              context_hours: int = 24) -> Tuple[List[Dict[str, str]], bool]:
+        """Chat messages for the completion and whether glucose context was included"""
+        # Determine if we should include glucose context
+        include_glucose = self._should_include_glucose_context(message)
+        glucose_context = ""
+        
+        if include_glucose:
+            # Get the last context_hours (24 by default) of glucose data for context
+            glucose_context = await self._get_glucose_context(hours=context_hours, user_id=user_id)
+        
+        # Create a comprehensive system prompt with balanced safety measures
+        system_prompt = """You are a helpful AI assistant specialized in diabetes management and glucose monitoring. 
             You have access to the user's actual glucose data and can provide personalized insights and recommendations.
             
             🚨 IMPORTANT SAFETY RULES:
@@ -224,19 +230,29 @@ Latest Readings:
             
             Remember: You are an EDUCATIONAL TOOL that helps users understand their glucose data, not a medical professional."""
             
-            # Build the full context
-            full_context = system_prompt
-            if glucose_context:
-                full_context += f"\n\nUSER'S GLUCOSE DATA:\n{glucose_context}"
-            if context:
-                full_context += f"\n\nADDITIONAL CONTEXT:\n{context}"
+        # Build the full context
+        full_context = system_prompt
+        if glucose_context:
+            full_context += f"\n\nUSER'S GLUCOSE DATA:\n{glucose_context}"
+        if context:
+            full_context += f"\n\nADDITIONAL CONTEXT:\n{context}"
+        
+        messages = [
+            {"role": "system", "content": full_context},
+            {"role": "user", "content": message}
+        ]
+        return messages, include_glucose
+    
+    async def get_chat_response(self, message: str, context: str = "", user_id: str = "default_user",
+                                context_hours: int = 24) -> Dict[str, Any]:
+        """Get a response from OpenAI based on the user's message with glucose context if relevant"""
+        try:
+            self._ensure_initialized()
+            messages, include_glucose = await self._build_messages(message, context, user_id, context_hours)
             
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": full_context},
-                    {"role": "user", "content": message}
-                ],
+                messages=messages,
                 max_tokens=800,
                 temperature=0.5  # Balanced temperature for helpful but safe responses
             )
@@ -244,18 +260,12 @@ Latest Readings:
             ai_response = response.choices[0].message.content
             
             # Clean up markdown formatting for professional appearance
-            ai_response = self._clean_markdown_formatting(ai_response)
+            ai_response = clean_markdown(ai_response)
             
             # Safety check: only block the most dangerous content
-            if self._check_for_dangerous_content(ai_response):
+            if contains_dangerous_content(ai_response):
                 # Replace dangerous response with safe alternative
-                ai_response = """I apologize, but I cannot provide specific medical advice or recommendations about medications or insulin dosing. 
-
-Instead, I can help you understand your glucose data patterns and provide general educational information about diabetes management.
-
-For any medical decisions, medication changes, or treatment plans, please consult your healthcare provider directly. They are the only ones qualified to give you personalized medical advice.
-
-What specific aspect of your glucose data would you like me to help you understand or analyze?"""
+                ai_response = SAFE_ALTERNATIVE_RESPONSE
             
             # Only add safety disclaimer occasionally, not every time
             # This prevents repetitive warnings while maintaining safety awareness
@@ -277,9 +287,59 @@ What specific aspect of your glucose data would you like me to help you understa
             return {
                 "success": False,
                 "error": str(e),
-                "response": "I'm sorry, I'm having trouble processing your request right now. Please try again later.",
+                "response": ERROR_RESPONSE,
                 "glucose_context_included": False,
                 "safety_checked": False
             }
 
+    async def stream_chat_response(self, message: str, context: str = "",
+                                   user_id: str = "default_user") -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Stream a response as (event, data) pairs
+
+        Sends 'start', then 'delta' chunks of cleaned text, then possibly a
+        'replace' carrying the safe alternative to the whole response, then
+        'done'. Failures end the stream with 'error'.
+        """
+        try:
+            self._ensure_initialized()
+            messages, include_glucose = await self._build_messages(message, context, user_id)
+
+            stream = await self.client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                max_tokens=800,
+                temperature=0.5,  # Balanced temperature for helpful but safe responses
+                stream=True
+            )
+        except Exception as e:
+            yield "error", {"error": str(e), "response": ERROR_RESPONSE}
+            return
+
+        yield "start", {"glucose_context_included": include_glucose}
+
+        text_filter = StreamingResponseFilter()
+        model = None
+        try:
+            async for chunk in stream:
+                model = chunk.model
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                text = text_filter.feed(chunk.choices[0].delta.content)
+                if text:
+                    yield "delta", {"text": text}
+        except Exception as e:
+            yield "error", {"error": str(e), "response": ERROR_RESPONSE}
+            return
+        finally:
+            await stream.response.aclose()
+
+        event, text = text_filter.finish()
+        if text:
+            yield event, {"text": text}
+        yield "done", {
+            "model": model,
+            "glucose_context_included": include_glucose,
+            "safety_checked": True
+        }
+
 chat_service = ChatService()
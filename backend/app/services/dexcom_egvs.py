@@ -0,0 +1,87 @@
+import re
+from typing import Any, Dict, List, NamedTuple
+
+import numpy as np
+
+from app.services.glucose_store import parse_timestamps
+
+# A UTC offset at the end of a v3 displayTime ("Z", "-05:00", "+0200")
+_UTC_OFFSET = re.compile(r"(?:Z|[+-]\d{2}:?\d{2})$")
+
+
+class EgvColumns(NamedTuple):
+    """Decoded Dexcom EGVs, sorted by time with one reading per systemTime"""
+    ts: np.ndarray          # int64 epoch seconds (UTC), for request windows and the high-water mark
+    local_ts: np.ndarray    # int64 wall-clock seconds from displayTime, the axis the glucose store uses
+    mgdl: np.ndarray        # uint16
+    trend: np.ndarray       # object array of Dexcom trend names (None when missing)
+    trend_rate: np.ndarray  # float64 mg/dL/min, NaN when missing
+
+
+def empty_egv_columns() -> EgvColumns:
+    return EgvColumns(
+        np.empty(0, dtype=np.int64),
+        np.empty(0, dtype=np.int64),
+        np.empty(0, dtype=np.uint16),
+        np.empty(0, dtype=object),
+        np.empty(0, dtype=np.float64),
+    )
+
+
+def decode_egvs(dexcom_response: Dict[str, Any]) -> EgvColumns:
+    """Decode an egvs payload straight into column arrays
+
+    systemTime may be epoch milliseconds or an ISO string (v2 sends naive
+    UTC, v3 appends "Z"); both are converted in one vectorized pass each.
+    displayTime is the receiver's wall-clock time (v3 adds its UTC offset,
+    which is dropped), the same convention as Clarity exports, so both
+    sources share one time-of-day axis; rows without a usable displayTime
+    fall back to systemTime. EGVs without an integer value (e.g. out-of-range "High"/"Low" rows) or
+    with an unparseable time are dropped, as are repeated systemTimes.
+    """
+    egvs: List[Dict[str, Any]] = dexcom_response.get("egvs") or []
+    n = len(egvs)
+    if not n:
+        return empty_egv_columns()
+
+    times = [egv.get("systemTime") for egv in egvs]
+    values = [egv.get("value") for egv in egvs]
+
+    valid = np.fromiter((type(value) is int for value in values), dtype=bool, count=n)
+    numeric = np.fromiter((isinstance(t, (int, float)) and not isinstance(t, bool) for t in times), dtype=bool, count=n)
+    textual = np.fromiter((isinstance(t, str) for t in times), dtype=bool, count=n)
+    valid &= numeric | textual
+
+    ts = np.zeros(n, dtype=np.int64)
+    if numeric.any():
+        ts[numeric] = np.asarray([times[i] for i in np.flatnonzero(numeric).tolist()], dtype=np.float64) // 1000
+    if textual.any():
+        rows = np.flatnonzero(textual)
+        parsed, parsed_ok = parse_timestamps([times[i] for i in rows.tolist()])
+        ts[rows] = parsed
+        valid[rows] &= parsed_ok
+
+    local_ts = ts.copy()
+    displayed = np.flatnonzero(np.fromiter((isinstance(egv.get("displayTime"), str) for egv in egvs), dtype=bool, count=n))
+    if len(displayed):
+        parsed, parsed_ok = parse_timestamps([_UTC_OFFSET.sub("", egvs[i]["displayTime"]) for i in displayed.tolist()])
+        local_ts[displayed[parsed_ok]] = parsed[parsed_ok]
+
+    keep = np.flatnonzero(valid)
+    if not len(keep):
+        return empty_egv_columns()
+    ts, local_ts = ts[keep], local_ts[keep]
+    mgdl = np.asarray([values[i] for i in keep.tolist()], dtype=np.int64)
+    trend = np.asarray([egvs[i].get("trend") for i in keep.tolist()], dtype=object)
+    trend_rate = np.asarray([egvs[i].get("trendRate") for i in keep.tolist()], dtype=object)
+    trend_rate = np.where(np.equal(trend_rate, None), np.nan, trend_rate).astype(np.float64)
+
+    # Sort and drop repeated systemTimes (chunk boundaries, retried pages)
+    ts, first = np.unique(ts, return_index=True)
+    return EgvColumns(
+        ts,
+        local_ts[first],
+        np.clip(mgdl[first], 0, np.iinfo(np.uint16).max).astype(np.uint16),
+        trend[first],
+        trend_rate[first],
+    )
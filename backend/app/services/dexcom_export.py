@@ -0,0 +1,130 @@
+import codecs
+import json
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from app.services.glucose_store import parse_timestamps
+
+# Columns we keep from the Clarity export; everything else is dropped while streaming
+EVENT_TYPE_FIELD = "Event Type"
+TIMESTAMP_FIELD = "Timestamp (YYYY-MM-DDThh:mm:ss)"
+GLUCOSE_FIELD = "Glucose Value (mg/dL)"
+
+CHUNK_SIZE = 1 << 20
+BATCH_SIZE = 65536
+# Bytes before the resume offset that must be unchanged for an append-only reload
+TAIL_FINGERPRINT_SIZE = 64
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+
+
+class ExportCursor:
+    """Byte position just past the last complete row parsed from the export"""
+
+    def __init__(self, offset: int = 0):
+        self.offset = offset
+
+
+def iter_export_rows(path: Path, cursor: ExportCursor, chunk_size: int = CHUNK_SIZE) -> Iterator[dict]:
+    """Stream row objects out of a JSON array export starting at cursor.offset
+
+    Only one chunk plus one partially read row is held in memory at a time.
+    A trailing incomplete row (e.g. a file still being written) is left
+    unparsed and cursor.offset stays before it.
+    """
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    buf_offset = cursor.offset  # byte offset of buf[0]
+
+    with open(path, "rb") as f:
+        f.seek(cursor.offset)
+        eof = False
+        pos = 0
+        row_end = 0  # end of the last complete row within buf
+        while True:
+            # Skip array punctuation between rows
+            while pos < len(buf) and (buf[pos] in _WHITESPACE or buf[pos] in "[,"):
+                pos += 1
+
+            if pos < len(buf) and buf[pos] == "]":
+                break
+
+            row = None
+            if pos < len(buf):
+                try:
+                    row, end = _decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    row = None
+
+            if row is not None:
+                pos = row_end = end
+                yield row
+                continue
+
+            if eof:
+                break
+
+            # Need more input: drop everything already consumed and read the next chunk
+            if row_end:
+                buf_offset += len(buf[:row_end].encode("utf-8"))
+                cursor.offset = buf_offset
+                buf = buf[row_end:]
+                pos -= row_end
+                row_end = 0
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf += utf8.decode(chunk, final=eof)
+
+    cursor.offset = buf_offset + len(buf[:row_end].encode("utf-8"))
+
+
+def load_egv_columns(path: Path, cursor: ExportCursor, batch_size: int = BATCH_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """Read EGV rows from the export into (epoch-second, mg/dL) columns
+
+    Rows are converted to arrays in fixed-size batches so the Python objects
+    alive at any moment are bounded by batch_size, not by the export size.
+    """
+    ts_parts: List[np.ndarray] = []
+    mgdl_parts: List[np.ndarray] = []
+    timestamps: List[str] = []
+    values: List[int] = []
+
+    def flush():
+        seconds, valid = parse_timestamps(timestamps)
+        if not valid.all():
+            print(f"Skipped {int((~valid).sum())} entries with unparseable timestamps")
+        ts_parts.append(seconds[valid])
+        mgdl_parts.append(np.asarray(values, dtype=np.uint16)[valid])
+        timestamps.clear()
+        values.clear()
+
+    for entry in iter_export_rows(path, cursor):
+        if entry.get(EVENT_TYPE_FIELD) != "EGV":
+            continue
+        timestamp_str = entry.get(TIMESTAMP_FIELD)
+        glucose_value = entry.get(GLUCOSE_FIELD)
+        if not timestamp_str or not glucose_value:
+            continue
+        try:
+            values.append(int(glucose_value))
+        except (ValueError, TypeError) as e:
+            print(f"Error parsing entry {entry.get('Index')}: {e}")
+            continue
+        timestamps.append(timestamp_str)
+        if len(values) >= batch_size:
+            flush()
+
+    if values or not ts_parts:
+        flush()
+    return np.concatenate(ts_parts), np.concatenate(mgdl_parts)
+
+
+def read_tail_fingerprint(path: Path, offset: int) -> bytes:
+    """Read the bytes just before offset, used to detect in-place rewrites"""
+    start = max(0, offset - TAIL_FINGERPRINT_SIZE)
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(offset - start)
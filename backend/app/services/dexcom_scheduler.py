@@ -0,0 +1,199 @@
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+import httpx
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class DexcomUnavailableError(Exception):
+    """Raised without calling Dexcom while the circuit breaker is open"""
+
+
+class TokenBucket:
+    """Async token bucket: `rate` requests per second with bursts up to `capacity`
+
+    Waiters are served in arrival order. pause() stops all issuing until a
+    deadline, which is how a Retry-After from one response throttles every
+    caller sharing the quota.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; lets one probe through every `reset_seconds`"""
+
+    def __init__(self, threshold: int, reset_seconds: float):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if not self._probing and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self._probing = True  # half-open: a single trial request
+            return True
+        return False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            print("✅ Dexcom circuit breaker closed")
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def release_probe(self):
+        """Let another call probe after one ended without a verdict on Dexcom (e.g. it was cancelled)"""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or (self.opened_at is None and self.failures >= self.threshold):
+            if self.opened_at is None:
+                print(f"⚠️ Dexcom circuit breaker opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class DexcomRequestScheduler:
+    """Single gate for outbound Dexcom traffic
+
+    Every request takes a token from its client ID's bucket, so concurrent
+    syncs share the app-wide quota instead of tripping it. 429s pause the
+    bucket for Retry-After and are retried; 5xx and transport errors are
+    retried with exponential backoff and full jitter. Consecutive failures
+    open a circuit breaker that fails fast until a probe succeeds.
+    """
+
+    def __init__(self, rate_per_second: float, burst: float, max_retries: int = 4,
+                 backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 breaker_threshold: int = 10, breaker_reset_seconds: float = 30.0):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset_seconds = breaker_reset_seconds
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def bucket(self, client_id: str) -> TokenBucket:
+        if client_id not in self._buckets:
+            self._buckets[client_id] = TokenBucket(self.rate_per_second, self.burst)
+        return self._buckets[client_id]
+
+    def breaker(self, client_id: str) -> CircuitBreaker:
+        if client_id not in self._breakers:
+            self._breakers[client_id] = CircuitBreaker(self.breaker_threshold, self.breaker_reset_seconds)
+        return self._breakers[client_id]
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def send(self, client: httpx.AsyncClient, client_id: str, method: str, url: str,
+                   idempotent: bool = True, **kwargs) -> httpx.Response:
+        """Send a request through the limiter, retrying throttled and transient failures
+
+        Non-idempotent requests (OAuth code exchange, token refresh) are only
+        retried when Dexcom can't have acted on them: 429s and failed connects.
+        The last response is returned once retries run out; callers still
+        raise_for_status().
+        """
+        bucket = self.bucket(client_id)
+        breaker = self.breaker(client_id)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise DexcomUnavailableError("Dexcom API circuit breaker is open")
+            probing = breaker.is_open
+
+            try:
+                await bucket.acquire()
+                response = await client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                breaker.record_failure()
+                retryable = idempotent or isinstance(e, httpx.ConnectError)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                print(f"⚠️ Dexcom {method} {url} failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            except Exception:
+                breaker.record_failure()
+                raise
+            except BaseException:
+                # Cancelled before Dexcom answered: no verdict, but a probe must not stay in flight forever
+                if probing:
+                    breaker.release_probe()
+                raise
+            else:
+                if response.status_code == 429:
+                    # Throttling is Dexcom working as intended, not an outage
+                    breaker.record_success()
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    delay = retry_after if retry_after is not None else self._backoff(attempt)
+                    bucket.pause(delay)
+                    if attempt >= self.max_retries:
+                        return response
+                    print(f"⚠️ Dexcom rate limit hit, pausing requests for {delay:.1f}s")
+                elif response.status_code >= 500:
+                    breaker.record_failure()
+                    if not idempotent or response.status_code not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+                        return response
+                    delay = self._backoff(attempt)
+                    print(f"⚠️ Dexcom {method} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+                else:
+                    breaker.record_success()
+                    return response
+
+            attempt += 1
+            await asyncio.sleep(delay)
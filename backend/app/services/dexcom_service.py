@@ -1,13 +1,66 @@
+import asyncio
 import httpx
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from app.db import settings
+from app.services.dexcom_scheduler import DexcomRequestScheduler
+
+try:
+    import h2  # noqa: F401 - enables HTTP/2 in httpx when installed
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 class DexcomService:
     def __init__(self):
         self.sandbox_base_url = "https://sandbox-api.dexcom.com"
         self.production_base_url = "https://api.dexcom.com"
-        self.base_url = self.sandbox_base_url  # Using sandbox for development
+        self.base_url = settings.DEXCOM_BASE_URL or self.sandbox_base_url  # Using sandbox for development
+        self._client: Optional[httpx.AsyncClient] = None
+        self.scheduler = DexcomRequestScheduler(
+            rate_per_second=settings.DEXCOM_RATE_LIMIT_PER_HOUR / 3600,
+            burst=settings.DEXCOM_RATE_BURST,
+            max_retries=settings.DEXCOM_MAX_RETRIES,
+            breaker_threshold=settings.DEXCOM_BREAKER_THRESHOLD,
+            breaker_reset_seconds=settings.DEXCOM_BREAKER_RESET_SECONDS
+        )
+        # user_id -> token document, served until its expires_at
+        self._token_cache: Dict[str, Dict[str, Any]] = {}
+        # user_id -> in-flight load/refresh shared by concurrent callers
+        self._refreshes: Dict[str, asyncio.Future] = {}
+    
+    async def start(self):
+        """Open the shared connection pool (called from the app lifespan)"""
+        if self._client is None:
+            self._client = self._create_client()
+            print(f"Dexcom HTTP client started (HTTP/2: {HTTP2_AVAILABLE})")
+    
+    async def close(self):
+        """Close the shared connection pool"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    def _create_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0),
+            timeout=httpx.Timeout(15.0, connect=5.0)
+        )
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Long-lived client reused by every Dexcom call so connections stay warm"""
+        if self._client is None:
+            # Outside the app lifespan (scripts, shells) create the pool on first use
+            self._client = self._create_client()
+        return self._client
+    
+    async def _request(self, method: str, path: str, idempotent: bool = True, **kwargs) -> httpx.Response:
+        """Every Dexcom call goes through the shared rate limiter / retry / breaker"""
+        return await self.scheduler.send(
+            self.client, settings.DEXCOM_CLIENT_ID, method, f"{self.base_url}{path}", idempotent=idempotent, **kwargs
+        )
         
     def get_authorization_url(self, state: Optional[str] = None) -> str:
         """Generate the OAuth authorization URL for Dexcom login"""
@@ -47,24 +100,24 @@ class DexcomService:
         print(f"Token endpoint: {self.base_url}/v2/oauth2/token")
         
         try:
-            async with httpx.AsyncClient() as client:
-                print(f"🔄 Making POST request to Dexcom token endpoint...")
-                response = await client.post(
-                    f"{self.base_url}/v2/oauth2/token",
-                    content=form_string,
-                    headers={'Content-Type': 'application/x-www-form-urlencoded'}
-                )
-                print(f"✅ Response received - Status: {response.status_code}")
-                print(f"Response headers: {dict(response.headers)}")
-                
-                if response.status_code != 200:
-                    print(f"❌ Error response: {response.text}")
-                    response.raise_for_status()
-                
-                token_data = response.json()
-                print(f"✅ Token exchange successful - Keys: {list(token_data.keys())}")
-                return token_data
-                
+            print(f"🔄 Making POST request to Dexcom token endpoint...")
+            response = await self._request(
+                "POST", "/v2/oauth2/token",
+                idempotent=False,
+                content=form_string,
+                headers={'Content-Type': 'application/x-www-form-urlencoded'}
+            )
+            print(f"✅ Response received - Status: {response.status_code}")
+            print(f"Response headers: {dict(response.headers)}")
+            
+            if response.status_code != 200:
+                print(f"❌ Error response: {response.text}")
+                response.raise_for_status()
+            
+            token_data = response.json()
+            print(f"✅ Token exchange successful - Keys: {list(token_data.keys())}")
+            return token_data
+            
         except Exception as e:
             print(f"❌ Token exchange failed: {type(e).__name__}: {str(e)}")
             raise
@@ -89,35 +142,34 @@ class DexcomService:
         print(f"Form data: {form_data}")
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/v2/oauth2/token",
-                    content=form_string,
-                    headers={'Content-Type': 'application/x-www-form-urlencoded'}
-                )
-                print(f"✅ Refresh response received - Status: {response.status_code}")
-                
-                if response.status_code != 200:
-                    print(f"❌ Refresh error response: {response.text}")
-                    response.raise_for_status()
-                
-                token_data = response.json()
-                print(f"✅ Token refresh successful - Keys: {list(token_data.keys())}")
-                return token_data
-                
+            response = await self._request(
+                "POST", "/v2/oauth2/token",
+                idempotent=False,
+                content=form_string,
+                headers={'Content-Type': 'application/x-www-form-urlencoded'}
+            )
+            print(f"✅ Refresh response received - Status: {response.status_code}")
+            
+            if response.status_code != 200:
+                print(f"❌ Refresh error response: {response.text}")
+                response.raise_for_status()
+            
+            token_data = response.json()
+            print(f"✅ Token refresh successful - Keys: {list(token_data.keys())}")
+            return token_data
+            
         except Exception as e:
             print(f"❌ Token refresh failed: {type(e).__name__}: {str(e)}")
             raise
     
     async def get_data_range(self, access_token: str) -> Dict[str, Any]:
         """Get user's data range from Dexcom API V2 - to check available data"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/v2/users/self/dataRange",
-                headers={'Authorization': f'Bearer {access_token}'}
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self._request(
+            "GET", "/v2/users/self/dataRange",
+            headers={'Authorization': f'Bearer {access_token}'}
+        )
+        response.raise_for_status()
+        return response.json()
 
 
 
@@ -136,47 +188,100 @@ class DexcomService:
             
         print(f"Fetching Dexcom V2 glucose data from {start_date} to {end_date}")
             
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/v2/users/self/egvs",
-                params={
-                    'startDate': start_date,
-                    'endDate': end_date
-                },
-                headers={'Authorization': f'Bearer {access_token}'}
-            )
-            print(f"Dexcom V2 egvs response status: {response.status_code}")
-            if response.status_code != 200:
-                print(f"Dexcom V2 egvs error: {response.text}")
-            response.raise_for_status()
-            return response.json()
+        response = await self._request(
+            "GET", "/v2/users/self/egvs",
+            params={
+                'startDate': start_date,
+                'endDate': end_date
+            },
+            headers={'Authorization': f'Bearer {access_token}'}
+        )
+        print(f"Dexcom V2 egvs response status: {response.status_code}")
+        if response.status_code != 200:
+            print(f"Dexcom V2 egvs error: {response.text}")
+        response.raise_for_status()
+        return response.json()
     
     async def get_user_info(self, access_token: str) -> Dict[str, Any]:
         """Get user information from Dexcom API V2 - sandbox compatible"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/v2/users/self",
-                headers={'Authorization': f'Bearer {access_token}'}
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self._request(
+            "GET", "/v2/users/self",
+            headers={'Authorization': f'Bearer {access_token}'}
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def _cached_token(self, user_id: str) -> Optional[str]:
+        token_doc = self._token_cache.get(user_id)
+        if token_doc and token_doc.get("expires_at", datetime.min) > datetime.utcnow():
+            return token_doc["access_token"]
+        return None
+    
+    def invalidate_token(self, user_id: str):
+        """Drop a user's cached token after it is replaced or deleted elsewhere"""
+        self._token_cache.pop(user_id, None)
+    
+    async def has_valid_token(self, user_id: str) -> bool:
+        """Whether the user has an unexpired access token, served from memory when possible"""
+        if self._cached_token(user_id):
+            return True
+        from app.db import get_user_tokens
+        
+        token_doc = await get_user_tokens(user_id)
+        if token_doc and token_doc.get("expires_at", datetime.min) > datetime.utcnow():
+            self._token_cache[user_id] = token_doc
+            return True
+        return False
 
     async def get_valid_access_token(self, user_id: str) -> Optional[str]:
-        """Get a valid access token for the user, automatically refreshing if expired"""
-        from app.db import get_user_tokens, save_user_tokens, is_token_valid
+        """Get a valid access token for the user, automatically refreshing if expired
+        
+        Valid tokens are served from an in-process cache until they expire.
+        Concurrent callers for an expired token share a single refresh.
+        """
+        access_token = self._cached_token(user_id)
+        if access_token:
+            return access_token
+        return await self._shared_refresh(user_id, datetime.utcnow())
+    
+    async def refresh_if_expiring(self, user_id: str, refresh_before: datetime) -> Optional[datetime]:
+        """Refresh the user's token if it expires before refresh_before; returns its (new) expiry
+        
+        Used by the background refresh scheduler so requests never wait on a refresh.
+        """
+        if not await self._shared_refresh(user_id, refresh_before):
+            return None
+        token_doc = self._token_cache.get(user_id)
+        return token_doc.get("expires_at") if token_doc else None
+    
+    async def _shared_refresh(self, user_id: str, refresh_before: datetime) -> Optional[str]:
+        # Join a refresh already in flight rather than racing it
+        pending = self._refreshes.get(user_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        
+        refresh = asyncio.ensure_future(self._load_or_refresh_token(user_id, refresh_before))
+        self._refreshes[user_id] = refresh
+        # Unregister when the refresh itself finishes, not when a waiter stops waiting:
+        # a cancelled caller must not let the next one start a second refresh
+        refresh.add_done_callback(lambda _: self._refreshes.pop(user_id, None))
+        return await asyncio.shield(refresh)
+    
+    async def _load_or_refresh_token(self, user_id: str, refresh_before: datetime) -> Optional[str]:
+        from app.db import get_user_tokens, save_user_tokens
         
         token_doc = await get_user_tokens(user_id)
         if not token_doc:
             print(f"❌ No tokens found for user: {user_id}")
             return None
         
-        # Check if current token is still valid
-        if await is_token_valid(user_id):
-            print(f"✅ Access token still valid for user: {user_id}")
+        # Check if current token is still valid (another worker may have refreshed it)
+        if token_doc.get("expires_at", datetime.min) > refresh_before:
+            self._token_cache[user_id] = token_doc
             return token_doc["access_token"]
         
-        # Token expired, attempt to refresh
-        print(f"🔄 Access token expired for user {user_id}, attempting refresh...")
+        # Token expired (or about to), attempt to refresh
+        print(f"🔄 Access token expiring for user {user_id}, attempting refresh...")
         try:
             refresh_token = token_doc.get("refresh_token")
             if not refresh_token:
@@ -192,13 +297,17 @@ class DexcomService:
             new_expires_in = refresh_response['expires_in']
             
             # Store the new tokens
-            await save_user_tokens(user_id, new_access_token, new_refresh_token, new_expires_in)
+            self._token_cache[user_id] = await save_user_tokens(user_id, new_access_token, new_refresh_token, new_expires_in)
             print(f"✅ Successfully refreshed tokens for user: {user_id}")
             
             return new_access_token
             
         except Exception as e:
             print(f"❌ Failed to refresh token for user {user_id}: {str(e)}")
+            # An early refresh failing still leaves the current token usable
+            if token_doc.get("expires_at", datetime.min) > datetime.utcnow():
+                self._token_cache[user_id] = token_doc
+                return token_doc["access_token"]
             return None
 
 dexcom_service = DexcomService()
@@ -0,0 +1,78 @@
+from typing import List, Dict, Any
+
+import numpy as np
+
+DOWNSAMPLE_METHODS = ("lttb", "minmax")
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: pick `threshold` indices that preserve the curve's shape
+
+    The first and last points are always kept; every bucket in between
+    contributes the point forming the largest triangle with the previously
+    selected point and the average of the next bucket.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    # threshold - 2 buckets over [1, n - 1); the last point is its own final bucket
+    edges = np.append(np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64), n)
+
+    # Averages of every bucket via prefix sums, so each one is O(1)
+    cx = np.concatenate(([0.0], np.cumsum(x)))
+    cy = np.concatenate(([0.0], np.cumsum(y)))
+    sizes = edges[1:] - edges[:-1]
+    avg_x = (cx[edges[1:]] - cx[edges[:-1]]) / sizes
+    avg_y = (cy[edges[1:]] - cy[edges[:-1]]) / sizes
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        bx, by = x[lo:hi], y[lo:hi]
+        area = np.abs((x[a] - avg_x[i + 1]) * (by - y[a]) - (x[a] - bx) * (avg_y[i + 1] - y[a]))
+        a = lo + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(y: np.ndarray, threshold: int) -> np.ndarray:
+    """Keep the lowest and highest reading of each bucket (threshold // 2 buckets)
+
+    Cheaper than LTTB and guarantees hypo/hyper extremes are never dropped.
+    """
+    n = len(y)
+    buckets = threshold // 2
+    if threshold >= n or buckets < 1:
+        return np.arange(n)
+
+    edges = np.floor(np.linspace(0, n, buckets + 1)).astype(np.int64)
+    selected = []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        if hi <= lo:
+            continue
+        bucket = y[lo:hi]
+        selected.append(lo + int(bucket.argmin()))
+        selected.append(lo + int(bucket.argmax()))
+    return np.unique(np.asarray(selected, dtype=np.int64))
+
+
+def downsample_indices(x: np.ndarray, y: np.ndarray, max_points: int, method: str = "lttb") -> np.ndarray:
+    """Indices of at most max_points readings chosen with the given method"""
+    if method == "minmax":
+        return minmax_indices(y, max_points)
+    return lttb_indices(x, y, max_points)
+
+
+def downsample_points(points: List[Dict[str, Any]], max_points: int, method: str = "lttb") -> List[Dict[str, Any]]:
+    """Downsample an evenly spaced list of glucose points"""
+    if len(points) <= max_points:
+        return points
+    y = np.asarray([point["mgdl"] for point in points], dtype=np.float64)
+    indices = downsample_indices(np.arange(len(points)), y, max_points, method)
+    return [points[i] for i in indices.tolist()]
@@ -0,0 +1,152 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from app.services.dexcom_service import dexcom_service
+from app.services.downsample import downsample_points
+from app.services.glucose_aggregates import summarize_values
+from app.services.glucose_simulation import generate_realistic_glucose_data, synth_points
+from app.services.real_data_service import real_data_service
+from app.services.sync_service import glucose_sync_service
+
+# CGM readings arrive every 5 minutes, so generated data only changes on that boundary
+READING_INTERVAL_SECONDS = 300
+
+
+def latest_reading_time() -> datetime:
+    """Current time floored to the CGM reading interval"""
+    now = int(datetime.now(timezone.utc).timestamp())
+    return datetime.fromtimestamp(now - now % READING_INTERVAL_SECONDS, tz=timezone.utc)
+
+
+class GlucoseSource(NamedTuple):
+    """One place a user's readings can come from, in fallback order"""
+    name: str        # 'dexcom', 'dexcom_simulated', 'real_csv' or 'synthetic'
+    message: str
+    version: Tuple   # changes whenever the source's data does (used in ETags and caches)
+
+
+class GlucoseAccess:
+    """In-process access to a user's glucose readings, shared by the /glucose router and chat
+
+    sources() picks the candidate sources for a user (synced Dexcom data,
+    the Dexcom export, or generated data), load() reads a window from one
+    of them and window_stats() summarizes one, so callers never go through
+    HTTP to get readings.
+    """
+
+    async def sources(self, user_id: str) -> List[GlucoseSource]:
+        """Candidate sources for the user, best first; the last one always has data"""
+        # Pick up a changed export (off the event loop) before anything reads the user's series
+        await real_data_service.refresh(user_id)
+        try:
+            if await dexcom_service.has_valid_token(user_id):
+                # Readings are served from local storage; new EGVs are pulled in the background
+                glucose_sync_service.schedule_sync(user_id)
+                candidates = []
+                if real_data_service.has_synced_readings(user_id):
+                    candidates.append(GlucoseSource(
+                        'dexcom', 'Using glucose data synced from Dexcom', real_data_service.get_data_version(user_id)
+                    ))
+                candidates.append(GlucoseSource(
+                    'dexcom_simulated', 'Realistic simulated glucose data (Dexcom sandbox has no real data)',
+                    (latest_reading_time(),)
+                ))
+                return candidates
+        except Exception as e:
+            # Log error but continue to fallback
+            print(f"Failed to fetch Dexcom data: {e}")
+
+        candidates = []
+        try:
+            version, latest_ts = real_data_service.get_data_version(user_id)
+            if latest_ts is not None:
+                candidates.append(GlucoseSource(
+                    'real_csv', 'Using real glucose data from your Dexcom export', (version, latest_ts)
+                ))
+        except Exception as e:
+            print(f"Failed to load CSV data: {e}")
+        candidates.append(GlucoseSource(
+            'synthetic', 'Using synthetic data - no real data available', (latest_reading_time(),)
+        ))
+        return candidates
+
+    def load(self, source: GlucoseSource, user_id: str, hours: int, start: Optional[datetime] = None,
+             end: Optional[datetime] = None, max_points: Optional[int] = None,
+             method: str = 'lttb') -> List[Dict[str, Any]]:
+        """Readings from one source for the last `hours` (or [start, end)); may be empty for stored sources"""
+        if source.name in ('dexcom', 'real_csv'):
+            return real_data_service.get_glucose_data(
+                hours=hours, start=start, end=end, user_id=user_id, max_points=max_points, method=method
+            )
+
+        if source.name == 'dexcom_simulated':
+            # Since Dexcom sandbox has no glucose data, use realistic simulated data
+            print("📊 Dexcom sandbox detected - using realistic simulated glucose data")
+            generate = generate_realistic_glucose_data
+        else:
+            generate = synth_points
+        now = source.version[0]
+        if max_points is not None:
+            # Generate at CGM resolution and let the downsampler pick the points
+            return downsample_points(generate(hours, interval_minutes=5, now=now), max_points, method)
+        return generate(hours, now=now)
+
+    def window_stats(self, source: GlucoseSource, user_id: str, hours: int,
+                     latest: int = 5) -> Optional[Dict[str, Any]]:
+        """Stats for the last `hours` from one source: {'stats', 'start', 'end', 'latest'}, or None if empty
+
+        Stored sources answer from the series' prefix sums; only generated
+        data is materialized and summarized.
+        """
+        if source.name in ('dexcom', 'real_csv'):
+            return real_data_service.get_window_stats(hours=hours, user_id=user_id, latest=latest)
+
+        data = self.load(source, user_id, hours)
+        if not data:
+            return None
+        return {
+            'stats': summarize_values([point['mgdl'] for point in data]),
+            'start': data[0]['ts'],
+            'end': data[-1]['ts'],
+            'latest': data[-latest:]
+        }
+
+    async def get_window_stats(self, user_id: str, hours: int, latest: int = 5,
+                               candidates: Optional[List[GlucoseSource]] = None) -> Dict[str, Any]:
+        """window_stats() from the best source that has readings, plus 'source', 'message' and 'version'
+
+        Falls back like get_window(); 'stats' is None when no source has data.
+        """
+        if candidates is None:
+            candidates = await self.sources(user_id)
+        for source in candidates:
+            try:
+                summary = self.window_stats(source, user_id, hours, latest)
+            except Exception as e:
+                print(f"Failed to load {source.name} glucose data: {e}")
+                continue
+            if summary:
+                return {'source': source.name, 'message': source.message, 'version': source.version, **summary}
+        return {'source': 'none', 'message': 'No glucose data available', 'version': (), 'stats': None}
+
+    async def get_window(self, user_id: str, hours: int, start: Optional[datetime] = None,
+                         end: Optional[datetime] = None, max_points: Optional[int] = None,
+                         method: str = 'lttb', candidates: Optional[List[GlucoseSource]] = None) -> Dict[str, Any]:
+        """Readings from the best source that has any: {'source', 'message', 'version', 'data'}
+
+        Pass `candidates` when the caller already looked up sources().
+        """
+        if candidates is None:
+            candidates = await self.sources(user_id)
+        for source in candidates:
+            try:
+                data = self.load(source, user_id, hours, start, end, max_points, method)
+            except Exception as e:
+                print(f"Failed to load {source.name} glucose data: {e}")
+                continue
+            if data:
+                return {'source': source.name, 'message': source.message, 'version': source.version, 'data': data}
+        return {'source': 'none', 'message': 'No glucose data available', 'version': (), 'data': []}
+
+
+glucose_access = GlucoseAccess()
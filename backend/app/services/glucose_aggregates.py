@@ -0,0 +1,86 @@
+from typing import Dict, Any, Sequence
+
+import numpy as np
+
+# Clinical range bands used across dashboards and chat (mg/dL)
+LOW_THRESHOLD = 70
+HIGH_THRESHOLD = 180
+
+_EMPTY_STATS = {"count": 0, "mean": 0, "sd": 0, "min": 0, "max": 0, "low": 0, "normal": 0, "high": 0}
+
+
+class GlucoseAggregates:
+    """Constant-time window statistics over a sorted glucose column
+
+    Prefix sums of values, squares and per-band counts give count/mean/SD and
+    time-in-range for any [lo, hi) slice; sparse tables give min/max.
+    """
+
+    def __init__(self, mgdl: np.ndarray):
+        values = mgdl.astype(np.int64)
+        self._sum = np.concatenate(([0], np.cumsum(values)))
+        self._sum_sq = np.concatenate(([0], np.cumsum(values * values)))
+        self._low = np.concatenate(([0], np.cumsum(values < LOW_THRESHOLD)))
+        self._high = np.concatenate(([0], np.cumsum(values > HIGH_THRESHOLD)))
+
+        # Level k holds the min/max of each run of 2**k readings
+        self._min_table = [mgdl]
+        self._max_table = [mgdl]
+        width = 1
+        while width * 2 <= len(mgdl):
+            prev_min, prev_max = self._min_table[-1], self._max_table[-1]
+            self._min_table.append(np.minimum(prev_min[:-width], prev_min[width:]))
+            self._max_table.append(np.maximum(prev_max[:-width], prev_max[width:]))
+            width *= 2
+
+    def _range_extrema(self, lo: int, hi: int):
+        level = (hi - lo).bit_length() - 1
+        right = hi - (1 << level)
+        low = min(self._min_table[level][lo], self._min_table[level][right])
+        high = max(self._max_table[level][lo], self._max_table[level][right])
+        return int(low), int(high)
+
+    def stats(self, lo: int, hi: int) -> Dict[str, Any]:
+        """Statistics for readings [lo, hi); `count` is 0 for an empty window"""
+        count = hi - lo
+        if count <= 0:
+            return dict(_EMPTY_STATS)
+
+        total = int(self._sum[hi] - self._sum[lo])
+        total_sq = int(self._sum_sq[hi] - self._sum_sq[lo])
+        mean = total / count
+        # Exact integer arithmetic avoids cancellation in E[x^2] - E[x]^2
+        variance = (count * total_sq - total * total) / (count * count)
+        low = int(self._low[hi] - self._low[lo])
+        high = int(self._high[hi] - self._high[lo])
+        min_value, max_value = self._range_extrema(lo, hi)
+        return {
+            "count": count,
+            "mean": mean,
+            "sd": variance ** 0.5,
+            "min": min_value,
+            "max": max_value,
+            "low": low,
+            "normal": count - low - high,
+            "high": high,
+        }
+
+
+def summarize_values(values: Sequence[float]) -> Dict[str, Any]:
+    """Same statistics as GlucoseAggregates.stats for an ad-hoc list of readings"""
+    if not len(values):
+        return dict(_EMPTY_STATS)
+    arr = np.asarray(values, dtype=np.float64)
+    low = int((arr < LOW_THRESHOLD).sum())
+    high = int((arr > HIGH_THRESHOLD).sum())
+    return {
+        "count": len(arr),
+        "mean": float(arr.mean()),
+        "sd": float(arr.std()),
+        # Return the original readings so ints and floats render as given
+        "min": values[int(arr.argmin())],
+        "max": values[int(arr.argmax())],
+        "low": low,
+        "normal": len(arr) - low - high,
+        "high": high,
+    }
@@ -0,0 +1,99 @@
+import hashlib
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from app.services.glucose_store import GlucoseSeries
+
+# Snapshot layout: fixed header, then ts (int64[n]), rate (float32[n]),
+# mgdl (uint16[n]), source (uint8[n]), trend (uint8[n])
+SNAPSHOT_MAGIC = b"GLCSNAP1"
+SNAPSHOT_VERSION = 3
+_BYTES_PER_READING = 8 + 4 + 2 + 1 + 1
+_HEADER = struct.Struct("<8sIQQq32sQH64s")
+_DATA_OFFSET = 192  # header padded so the int64 column is 64-byte aligned
+
+
+class Snapshot(NamedTuple):
+    """Parsed glucose columns plus the source file state they were built from"""
+    series: GlucoseSeries
+    source_size: int
+    source_mtime_ns: int
+    source_hash: bytes
+    cursor_offset: int
+    tail: bytes
+
+
+def snapshot_path(source: Path) -> Path:
+    """Snapshots live next to the export they were built from"""
+    return source.with_name(source.name + ".snap")
+
+
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> bytes:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def save_snapshot(path: Path, snapshot: Snapshot) -> None:
+    """Write a snapshot atomically so concurrent readers never see a partial file"""
+    series = snapshot.series
+    header = _HEADER.pack(
+        SNAPSHOT_MAGIC,
+        SNAPSHOT_VERSION,
+        len(series),
+        snapshot.source_size,
+        snapshot.source_mtime_ns,
+        snapshot.source_hash,
+        snapshot.cursor_offset,
+        len(snapshot.tail),
+        snapshot.tail,
+    )
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(header.ljust(_DATA_OFFSET, b"\0"))
+        f.write(np.ascontiguousarray(series.ts, dtype="<i8").tobytes())
+        f.write(np.ascontiguousarray(series.rate, dtype="<f4").tobytes())
+        f.write(np.ascontiguousarray(series.mgdl, dtype="<u2").tobytes())
+        f.write(np.ascontiguousarray(series.source, dtype="u1").tobytes())
+        f.write(np.ascontiguousarray(series.trend, dtype="u1").tobytes())
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path: Path) -> Optional[Snapshot]:
+    """Memory-map a snapshot; the returned columns are read-only views of the page cache"""
+    try:
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    if len(mm) < _DATA_OFFSET:
+        return None
+    (magic, version, count, size, mtime_ns, source_hash,
+     cursor_offset, tail_len, tail) = _HEADER.unpack_from(mm, 0)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        return None
+    if len(mm) != _DATA_OFFSET + count * _BYTES_PER_READING:
+        print(f"Ignoring truncated glucose snapshot: {path}")
+        return None
+
+    ts = np.frombuffer(mm, dtype="<i8", count=count, offset=_DATA_OFFSET)
+    rate = np.frombuffer(mm, dtype="<f4", count=count, offset=_DATA_OFFSET + 8 * count)
+    mgdl = np.frombuffer(mm, dtype="<u2", count=count, offset=_DATA_OFFSET + 12 * count)
+    source = np.frombuffer(mm, dtype="u1", count=count, offset=_DATA_OFFSET + 14 * count)
+    trend = np.frombuffer(mm, dtype="u1", count=count, offset=_DATA_OFFSET + 15 * count)
+    return Snapshot(
+        series=GlucoseSeries(ts, mgdl, source, rate=rate, trend=trend),
+        source_size=size,
+        source_mtime_ns=mtime_ns,
+        source_hash=source_hash,
+        cursor_offset=cursor_offset,
+        tail=tail[:tail_len],
+    )
@@ -0,0 +1,205 @@
+import itertools
+import warnings
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+import numpy as np
+
+from app.services.glucose_aggregates import GlucoseAggregates
+from app.services.glucose_trends import TREND_NAMES, compute_trends
+
+# Compact per-reading source codes (stored as uint8 alongside the readings)
+SOURCE_NAMES = ("real_dexcom", "dexcom")
+SOURCE_CODES = {name: code for code, name in enumerate(SOURCE_NAMES)}
+# Every series object gets a unique version so derived results can be cached against it
+_series_versions = itertools.count(1)
+
+
+def parse_timestamps(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Parse ISO timestamps to epoch seconds, returning (seconds, valid_mask)
+
+    Naive timestamps are treated as wall-clock UTC so they round-trip unchanged.
+    """
+    try:
+        # Fast path: one vectorized parse for plain "YYYY-MM-DDThh:mm:ss" exports.
+        # NumPy converts explicit UTC offsets itself but warns that it does.
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            parsed = np.array(values, dtype="datetime64[s]")
+        # None, '' and 'NaT' come back as NaT instead of raising; retry those one by one
+        valid = ~np.isnat(parsed)
+        seconds = np.where(valid, parsed.astype(np.int64), 0)
+        retry = np.flatnonzero(~valid).tolist()
+    except (ValueError, TypeError):
+        seconds = np.zeros(len(values), dtype=np.int64)
+        valid = np.zeros(len(values), dtype=bool)
+        retry = range(len(values))
+
+    for i in retry:
+        value = values[i]
+        try:
+            ts = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except (ValueError, TypeError, AttributeError):
+            continue
+        seconds[i] = to_epoch_seconds(ts)
+        valid[i] = True
+    return seconds, valid
+
+
+def to_epoch_seconds(ts: datetime) -> int:
+    """Convert a datetime to epoch seconds using the same convention as parse_timestamps"""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return int((ts - datetime(1970, 1, 1)).total_seconds())
+
+
+class GlucoseSeries:
+    """Time-sorted glucose readings stored as NumPy columns
+
+    ts:     int64 wall-clock seconds: the reading's local time counted as if it
+            were UTC (Clarity exports and Dexcom displayTime both use it)
+    mgdl:   uint16 glucose values
+    source: uint8 codes into SOURCE_NAMES
+    rate:   float32 mg/dL per minute (NaN when not computable)
+    trend:  uint8 codes into TREND_NAMES
+
+    rate/trend are derived from ts/mgdl once per series, either passed in
+    (e.g. from a snapshot) or computed on first use.
+    """
+
+    def __init__(self, ts: np.ndarray, mgdl: np.ndarray, source: np.ndarray,
+                 rate: Optional[np.ndarray] = None, trend: Optional[np.ndarray] = None):
+        self.ts = ts
+        self.mgdl = mgdl
+        self.source = source
+        self._rate = rate
+        self._trend = trend
+        self._aggregates: Optional[GlucoseAggregates] = None
+        self.version = next(_series_versions)
+
+    @classmethod
+    def empty(cls) -> "GlucoseSeries":
+        return cls(
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.uint16),
+            np.empty(0, dtype=np.uint8),
+        )
+
+    @classmethod
+    def from_columns(cls, ts: Iterable[int], mgdl: Iterable[int], source: str) -> "GlucoseSeries":
+        """Build a sorted series from unsorted timestamp/value columns"""
+        ts_arr = np.asarray(ts, dtype=np.int64)
+        mgdl_arr = np.asarray(mgdl, dtype=np.uint16)
+        order = np.argsort(ts_arr, kind="stable")
+        return cls(
+            ts_arr[order],
+            mgdl_arr[order],
+            np.full(len(ts_arr), SOURCE_CODES[source], dtype=np.uint8),
+        )
+
+    def extend(self, ts: np.ndarray, mgdl: np.ndarray, source: str) -> "GlucoseSeries":
+        """Return a new series with extra readings merged in, keeping ts sorted"""
+        ts = np.asarray(ts, dtype=np.int64)
+        codes = np.full(len(ts), SOURCE_CODES[source], dtype=np.uint8)
+        return self.merge(GlucoseSeries(ts, np.asarray(mgdl, dtype=np.uint16), codes))
+
+    def merge(self, other: "GlucoseSeries") -> "GlucoseSeries":
+        """Return a new series containing the readings of both, keeping ts sorted"""
+        if not len(other):
+            return self
+        if not len(self):
+            return other
+        other_ts, other_mgdl, other_source = other.ts, other.mgdl, other.source
+        if np.any(np.diff(other_ts) < 0):
+            order = np.argsort(other_ts, kind="stable")
+            other_ts, other_mgdl, other_source = other_ts[order], other_mgdl[order], other_source[order]
+        # Appended data is usually newer than everything we hold
+        if other_ts[0] >= self.ts[-1]:
+            return GlucoseSeries(
+                np.concatenate([self.ts, other_ts]),
+                np.concatenate([self.mgdl, other_mgdl]),
+                np.concatenate([self.source, other_source]),
+            )
+        # Otherwise (e.g. a backfill chunk older than what we hold) insert it into
+        # place in one linear pass instead of re-sorting everything; ties keep ours first
+        positions = np.searchsorted(self.ts, other_ts, side="right")
+        return GlucoseSeries(
+            np.insert(self.ts, positions, other_ts),
+            np.insert(self.mgdl, positions, other_mgdl),
+            np.insert(self.source, positions, other_source),
+        )
+
+    def take(self, indices: np.ndarray) -> "GlucoseSeries":
+        """Return a series holding only the readings at the given sorted indices
+
+        Trends are carried over from the full series rather than recomputed
+        on the (sparser) subset.
+        """
+        return GlucoseSeries(
+            self.ts[indices], self.mgdl[indices], self.source[indices],
+            rate=self.rate[indices], trend=self.trend[indices],
+        )
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def _ensure_trends(self):
+        if self._rate is None or self._trend is None:
+            self._rate, self._trend = compute_trends(self.ts, self.mgdl)
+
+    @property
+    def rate(self) -> np.ndarray:
+        self._ensure_trends()
+        return self._rate
+
+    @property
+    def trend(self) -> np.ndarray:
+        self._ensure_trends()
+        return self._trend
+
+    @property
+    def aggregates(self) -> GlucoseAggregates:
+        """Prefix-sum/sparse-table statistics, built once per series"""
+        if self._aggregates is None:
+            self._aggregates = GlucoseAggregates(self.mgdl)
+        return self._aggregates
+
+    def stats(self, lo: int = 0, hi: Optional[int] = None) -> Dict[str, Any]:
+        """O(1) count/mean/SD/min/max/time-in-range for readings [lo, hi)"""
+        return self.aggregates.stats(lo, len(self) if hi is None else hi)
+
+    @property
+    def latest_ts(self) -> Optional[int]:
+        return int(self.ts[-1]) if len(self.ts) else None
+
+    def window(self, start: Optional[int] = None, end: Optional[int] = None) -> Tuple[int, int]:
+        """Return the [lo, hi) index bounds of readings with start <= ts < end
+
+        Uses a binary search over the sorted timestamp column, so the cost is
+        O(log n) regardless of how much history is loaded.
+        """
+        lo = 0 if start is None else int(np.searchsorted(self.ts, start, side="left"))
+        hi = len(self.ts) if end is None else int(np.searchsorted(self.ts, end, side="left"))
+        return lo, max(lo, hi)
+
+    def format_timestamps(self, start: int = 0, stop: Optional[int] = None) -> List[str]:
+        """Render a slice of timestamps as naive ISO strings in the readings' local time"""
+        return np.datetime_as_string(self.ts[start:stop].astype("datetime64[s]"), unit="s").tolist()
+
+    def to_points(self, start: int = 0, stop: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Materialize a slice of the series as API glucose points"""
+        stamps = self.format_timestamps(start, stop)
+        values = self.mgdl[start:stop].tolist()
+        sources = self.source[start:stop].tolist()
+        trends = self.trend[start:stop].tolist()
+        rates = np.round(self.rate[start:stop].astype(np.float64), 2).tolist()
+        return [
+            {
+                "ts": ts,
+                "mgdl": mgdl,
+                "trend": TREND_NAMES[trend],
+                "trendRate": rate if rate == rate else None,  # NaN -> None
+                "source": SOURCE_NAMES[code],
+            }
+            for ts, mgdl, trend, rate, code in zip(stamps, values, trends, rates, sources)
+        ]
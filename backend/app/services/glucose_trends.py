@@ -0,0 +1,45 @@
+from typing import Tuple
+
+import numpy as np
+
+# Dexcom-style trend arrows, indexed by the uint8 codes stored with the columns
+TREND_NAMES = (
+    "notComputable",
+    "doubleDown",
+    "singleDown",
+    "fortyFiveDown",
+    "flat",
+    "fortyFiveUp",
+    "singleUp",
+    "doubleUp",
+)
+# Arrow boundaries in mg/dL per minute (flat is -1..1, double arrows beyond +/-3)
+_RATE_BINS = np.array([-3.0, -2.0, -1.0, 1.0, 2.0, 3.0])
+
+# Rate of change is measured against the oldest reading in this trailing window
+TREND_WINDOW_SECONDS = 15 * 60
+# Shorter spans (duplicate or back-to-back readings) are too noisy to report
+MIN_SPAN_SECONDS = 4 * 60
+
+
+def compute_trends(ts: np.ndarray, mgdl: np.ndarray, window_seconds: int = TREND_WINDOW_SECONDS) -> Tuple[np.ndarray, np.ndarray]:
+    """Rate of change (mg/dL/min, float32) and trend codes (uint8) for every reading
+
+    ts must be sorted. Each reading is compared with the oldest reading no
+    more than window_seconds before it, in one vectorized pass; readings with
+    no usable history get NaN and "notComputable".
+    """
+    if not len(ts):
+        return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.uint8)
+
+    start = np.searchsorted(ts, ts - window_seconds, side="left")
+    span = (ts - ts[start]).astype(np.float64)
+    delta = mgdl.astype(np.float64) - mgdl[start].astype(np.float64)
+
+    rate = np.full(len(ts), np.nan)
+    usable = span >= MIN_SPAN_SECONDS
+    rate[usable] = delta[usable] / (span[usable] / 60.0)
+
+    codes = np.zeros(len(ts), dtype=np.uint8)
+    codes[usable] = np.digitize(rate[usable], _RATE_BINS) + 1
+    return rate.astype(np.float32), codes
@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from app.db import settings, get_cached_insight, save_cached_insight
+from app.services.cache import LRUCache
+from app.services.chat_service import chat_service
+from app.services.glucose_access import glucose_access
+
+ANALYSIS_PROMPTS = {
+    "general": "Provide a comprehensive analysis of my glucose data including trends, patterns, and overall health insights.",
+    "trends": "Analyze the trends in my glucose data over time. What patterns do you see?",
+    "patterns": "What patterns can you identify in my glucose readings? Are there consistent highs or lows at certain times?",
+    "recommendations": "Based on my glucose data, what lifestyle recommendations or monitoring suggestions do you have?"
+}
+
+TIME_RANGE_HOURS = {"3h": 3, "6h": 6, "12h": 12, "24h": 24}
+
+
+class GlucoseInsightsService:
+    """AI insights for /chat/glucose-insights, cached against the data they describe
+
+    Insights are keyed on (user, analysis_type, time_range) and remember a
+    fingerprint of the readings in the window, which is also the window the
+    prompt's glucose context is built from. A matching fingerprint is a
+    hit served from memory or MongoDB without an LLM call. When the data has
+    changed, the previous insight is returned right away (stale) while a new
+    one is generated in the background.
+    """
+
+    def __init__(self):
+        self._memory = LRUCache(
+            max_entries=1024, ttl_seconds=settings.INSIGHTS_CACHE_TTL_SECONDS, max_bytes=8 * 1024 * 1024
+        )
+        self._refreshes: Dict[Tuple[str, str, str], asyncio.Task] = {}
+
+    async def fingerprint(self, user_id: str, time_range: str) -> str:
+        """Hash of the readings an insight for this window is generated from"""
+        window = await glucose_access.get_window(user_id, TIME_RANGE_HOURS[time_range])
+        readings = [(point['ts'], point['mgdl']) for point in window['data']]
+        payload = json.dumps([window['source'], readings], separators=(',', ':')).encode('utf-8')
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    async def _lookup(self, key: Tuple[str, str, str]) -> Optional[Dict[str, Any]]:
+        entry = self._memory.get(key)
+        if entry is None:
+            entry = await get_cached_insight(*key)
+            if entry is not None:
+                self._memory.set(key, entry)
+        return entry
+
+    async def _generate(self, key: Tuple[str, str, str], fingerprint: str) -> Dict[str, Any]:
+        user_id, analysis_type, time_range = key
+        result = await chat_service.get_chat_response(
+            message=ANALYSIS_PROMPTS[analysis_type],
+            context=f"Please analyze my glucose data for the last {time_range}",
+            user_id=user_id,
+            context_hours=TIME_RANGE_HOURS[time_range]
+        )
+        if result["success"]:
+            entry = {
+                "user_id": user_id,
+                "analysis_type": analysis_type,
+                "time_range": time_range,
+                "fingerprint": fingerprint,
+                "insights": result["response"],
+                "model": result["model"],
+                "usage": result["usage"],
+                "created_at": datetime.utcnow()
+            }
+            self._memory.set(key, entry)
+            await save_cached_insight(entry)
+        return result
+
+    def _refresh(self, key: Tuple[str, str, str], fingerprint: str) -> asyncio.Task:
+        """Generate an insight, sharing one LLM call between concurrent requests for the same key"""
+        task = self._refreshes.get(key)
+        if task is None:
+            task = asyncio.create_task(self._generate(key, fingerprint))
+            self._refreshes[key] = task
+            task.add_done_callback(lambda _: self._refreshes.pop(key, None))
+        return task
+
+    async def get_insights(self, analysis_type: str, time_range: str, user_id: str) -> Dict[str, Any]:
+        """Insights for the window: {'success', 'insights', 'model', 'usage', 'cached', 'stale'} or an error"""
+        key = (user_id, analysis_type, time_range)
+        fingerprint = await self.fingerprint(user_id, time_range)
+
+        entry = await self._lookup(key)
+        if entry is not None:
+            stale = entry["fingerprint"] != fingerprint
+            if stale:
+                # New readings since this was generated: answer now, regenerate in the background
+                self._refresh(key, fingerprint)
+            return {
+                "success": True,
+                "insights": entry["insights"],
+                "model": entry["model"],
+                "usage": entry["usage"],
+                "cached": True,
+                "stale": stale
+            }
+
+        # Shielded so a disconnecting client doesn't cancel a generation others may be waiting on
+        result = await asyncio.shield(self._refresh(key, fingerprint))
+        if not result["success"]:
+            return {"success": False, "error": result["error"]}
+        return {
+            "success": True,
+            "insights": result["response"],
+            "model": result["model"],
+            "usage": result["usage"],
+            "cached": False,
+            "stale": False
+        }
+
+    async def drain(self):
+        """Wait for background regenerations to finish"""
+        while self._refreshes:
+            await asyncio.gather(*list(self._refreshes.values()), return_exceptions=True)
+
+
+glucose_insights_service = GlucoseInsightsService()
@@ -1,114 +1,481 @@
-import json
+import asyncio
+import hashlib
 import os
-from datetime import datetime, timedelta, timezone
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
 from typing import List, Dict, Any, Optional
 from pathlib import Path
 
-class RealDataService:
-    def __init__(self):
-        # The CSV file is in the root directory, not in diabetes-tracker-starter
-        self.data_file = Path(__file__).parent.parent.parent.parent.parent / "csvjson.json"
-        self._cached_data = None
-        self._last_load = None
+import numpy as np
+
+from app.db import settings
+from app.services.cache import LRUCache
+from app.services.downsample import downsample_indices
+from app.services.glucose_agp import compute_agp
+from app.services.dexcom_export import ExportCursor, load_egv_columns, read_tail_fingerprint
+from app.services.glucose_snapshot import Snapshot, file_sha256, load_snapshot, save_snapshot, snapshot_path
+from app.services.glucose_store import GlucoseSeries, to_epoch_seconds
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, so run a single worker there
+    fcntl = None
+
+DEFAULT_USER_ID = "default_user"
+_SAFE_USER_ID = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+
+
+@contextmanager
+def _file_lock(path: Path):
+    """Hold an exclusive lock on `path` shared by every worker process"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a+b") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _file_version(path: Path) -> Optional[tuple]:
+    """Identifies one version of a file that is only ever replaced atomically"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _unseen(stored: GlucoseSeries, readings: GlucoseSeries) -> GlucoseSeries:
+    """The readings whose timestamp isn't in `stored`, one per timestamp"""
+    _, first = np.unique(readings.ts, return_index=True)
+    if len(first) < len(readings):
+        readings = readings.take(first)
+    if len(stored.ts) and len(readings):
+        # Both sides are sorted, so a binary search per new reading finds the duplicates
+        positions = np.minimum(np.searchsorted(stored.ts, readings.ts), len(stored.ts) - 1)
+        readings = readings.take(np.flatnonzero(stored.ts[positions] != readings.ts))
+    return readings
+
+class ExportSource:
+    """One Dexcom Clarity export on disk, parsed into a cached columnar series"""
+    
+    def __init__(self, data_file: Path):
+        self.data_file = data_file
+        self._series: GlucoseSeries = GlucoseSeries.empty()
+        # (size, mtime_ns) of the export when last ingested, plus where parsing stopped
+        self._file_stat = None
+        self._cursor = ExportCursor()
+        self._tail = b""
+        self._source_hash = b""
+        self._snapshot_checked = False
+        self._ingest_lock = threading.Lock()
+    
+    def changed(self) -> bool:
+        """Whether load() has anything to ingest; one stat call, cheap enough for the event loop"""
+        try:
+            st = os.stat(self.data_file)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            return True  # let load() report it
+        return not self._snapshot_checked or (st.st_size, st.st_mtime_ns) != self._file_stat
+    
+    def current(self) -> GlucoseSeries:
+        """The series as of the last load(), without touching the disk"""
+        return self._series
+    
+    def load(self) -> GlucoseSeries:
+        """Return the cached series, re-ingesting only when the export changed on disk
+        
+        Ingesting parses and hashes the export and rewrites its snapshot, so
+        it blocks; async code goes through RealDataService.refresh(), which
+        runs it in a worker thread. Concurrent calls are serialized.
+        """
+        with self._ingest_lock:
+            return self._load()
     
-    def _load_data(self) -> List[Dict[str, Any]]:
-        """Load and cache the CSV data"""
-        # Cache data for 5 minutes to avoid repeated file reads
-        if self._cached_data and self._last_load and (datetime.now() - self._last_load).seconds < 300:
-            return self._cached_data
+    def _load(self) -> GlucoseSeries:
+        try:
+            st = os.stat(self.data_file)
+        except FileNotFoundError:
+            return self._series
+        except OSError as e:
+            print(f"Error loading real data: {e}")
+            return self._series
+        
+        if not self._snapshot_checked:
+            self._snapshot_checked = True
+            self._restore_snapshot()
+        
+        file_stat = (st.st_size, st.st_mtime_ns)
+        if file_stat == self._file_stat:
+            return self._series
         
         try:
-            print(f"Attempting to load data from: {self.data_file}")
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
-                self._cached_data = data
-                self._last_load = datetime.now()
-                print(f"Successfully loaded {len(data)} entries from CSV")
-                return data
+            source_hash = None
+            if self._file_stat and st.st_size == self._file_stat[0]:
+                source_hash = file_sha256(self.data_file)
+                if source_hash == self._source_hash:
+                    # Touched or copied but byte-for-byte identical; keep the parsed columns
+                    self._file_stat = file_stat
+                    self._save_snapshot()
+                    return self._series
+            
+            if self._can_append(st.st_size):
+                print(f"Export grew, parsing appended data from byte {self._cursor.offset}")
+                ts, mgdl = load_egv_columns(self.data_file, self._cursor)
+                self._series = self._series.extend(ts, mgdl, "real_dexcom")
+            else:
+                print(f"Attempting to load data from: {self.data_file}")
+                self._cursor = ExportCursor()
+                ts, mgdl = load_egv_columns(self.data_file, self._cursor)
+                self._series = GlucoseSeries.from_columns(ts, mgdl, "real_dexcom")
+            self._tail = read_tail_fingerprint(self.data_file, self._cursor.offset)
+            self._file_stat = file_stat
+            # Same-size rewrites were already hashed above; hash each version of the file once
+            self._source_hash = source_hash or file_sha256(self.data_file)
+            print(f"Successfully loaded {len(self._series)} glucose readings from CSV")
+            self._save_snapshot()
         except Exception as e:
             print(f"Error loading real data: {e}")
-            return []
+            # Force a full re-ingest next time rather than trusting a partial parse
+            self._file_stat = None
+            self._cursor = ExportCursor()
+        return self._series
     
-    def _filter_glucose_data(self, data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Filter only EGV (glucose) events and clean the data"""
-        glucose_data = []
-        
-        for entry in data:
-            if entry.get("Event Type") == "EGV":
-                timestamp_str = entry.get("Timestamp (YYYY-MM-DDThh:mm:ss)")
-                glucose_value = entry.get("Glucose Value (mg/dL)")
-                
-                if timestamp_str and glucose_value and glucose_value != "":
-                    try:
-                        # Parse timestamp
-                        timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-                        
-                        glucose_data.append({
-                            "ts": timestamp.isoformat(),
-                            "mgdl": int(glucose_value),
-                            "trend": "stable",  # We could calculate this from rate of change if available
-                            "trendRate": None,
-                            "source": "real_dexcom"
-                        })
-                    except (ValueError, TypeError) as e:
-                        print(f"Error parsing entry {entry.get('Index')}: {e}")
-                        continue
-        
-        # Sort by timestamp
-        glucose_data.sort(key=lambda x: x["ts"])
-        return glucose_data
-    
-    def get_glucose_data(self, hours: int = 24) -> List[Dict[str, Any]]:
-        """Get glucose data for the specified time range"""
-        data = self._load_data()
-        if not data:
-            return []
+    def _restore_snapshot(self):
+        """Adopt the on-disk binary snapshot, if any, instead of re-parsing the export"""
+        snapshot = load_snapshot(snapshot_path(self.data_file))
+        if snapshot is None:
+            return
         
-        glucose_data = self._filter_glucose_data(data)
-        if not glucose_data:
-            return []
+        self._series = snapshot.series
+        self._file_stat = (snapshot.source_size, snapshot.source_mtime_ns)
+        self._cursor = ExportCursor(snapshot.cursor_offset)
+        self._tail = snapshot.tail
+        self._source_hash = snapshot.source_hash
+        print(f"Mapped {len(self._series)} glucose readings from snapshot")
+    
+    def _save_snapshot(self):
+        """Persist the parsed columns next to the export for other workers and restarts"""
+        try:
+            save_snapshot(snapshot_path(self.data_file), Snapshot(
+                series=self._series,
+                source_size=self._file_stat[0],
+                source_mtime_ns=self._file_stat[1],
+                source_hash=self._source_hash,
+                cursor_offset=self._cursor.offset,
+                tail=self._tail,
+            ))
+        except Exception as e:
+            print(f"Could not write glucose snapshot: {e}")
+    
+    def _can_append(self, size: int) -> bool:
+        """Whether the export only grew since the last ingest, so just the tail needs parsing"""
+        if self._file_stat is None or size <= self._file_stat[0] or not self._cursor.offset:
+            return False
+        return read_tail_fingerprint(self.data_file, self._cursor.offset) == self._tail
+    
+class UserShard:
+    """All glucose history held for one user: their export plus synced readings
+    
+    Every worker process holds its own copy of the synced readings, and each
+    syncs readings the others may not have seen, so the snapshot on disk is
+    the union: writes merge in what is already there under a file lock, and
+    refresh_synced() picks up what other workers wrote.
+    """
+    
+    def __init__(self, export_file: Path, synced_file: Path):
+        self.export = ExportSource(export_file)
+        self.synced_file = synced_file
+        self._disk_version = _file_version(synced_file)
+        snapshot = load_snapshot(synced_file)
+        self.synced = snapshot.series if snapshot else GlucoseSeries.empty()
+        self._save_lock = threading.Lock()
+        self._combined = GlucoseSeries.empty()
+        self._combined_from = None
+    
+    def series(self) -> GlucoseSeries:
+        """Export and synced readings as one sorted series, rebuilt only when either changes
         
-        # Calculate the cutoff time
-        if glucose_data:
-            latest_time = datetime.fromisoformat(glucose_data[-1]["ts"].replace('Z', '+00:00'))
-            cutoff_time = latest_time - timedelta(hours=hours)
-            
-            # Filter data within the time range
-            filtered_data = [
-                entry for entry in glucose_data
-                if datetime.fromisoformat(entry["ts"].replace('Z', '+00:00')) >= cutoff_time
-            ]
-            
-            return filtered_data
+        Uses the export as last loaded; RealDataService.refresh() picks up changes.
+        """
+        export_series = self.export.current()
+        parts = (export_series, self.synced)
+        if self._combined_from is None or any(a is not b for a, b in zip(parts, self._combined_from)):
+            self._combined = export_series.merge(self.synced)
+            self._combined_from = parts
+        return self._combined
+    
+    def add_readings(self, readings: GlucoseSeries) -> int:
+        """Merge newly synced readings in memory; write_synced() persists them
         
-        return []
+        Readings whose timestamp is already stored, or repeated within the
+        batch, are skipped, so overlapping syncs and backfills are idempotent.
+        Returns how many were added.
+        """
+        readings = _unseen(self.synced, readings)
+        if not len(readings):
+            return 0
+        self.synced = self.synced.merge(readings)
+        return len(readings)
+    
+    def adopt(self, stored: GlucoseSeries):
+        """Take in a snapshot's readings (the union just written, or another worker's save)"""
+        self.add_readings(stored)
+        if len(self.synced) == len(stored):
+            # Nothing in memory beyond what is on disk; share its columns
+            self.synced = stored
     
-    def get_data_summary(self) -> Dict[str, Any]:
-        """Get summary statistics about the available data"""
-        data = self._load_data()
-        glucose_data = self._filter_glucose_data(data)
+    def disk_changed(self) -> bool:
+        """Whether the snapshot was replaced since this shard last read or wrote it"""
+        return _file_version(self.synced_file) != self._disk_version
+    
+    def read_synced(self) -> GlucoseSeries:
+        """The readings currently in the snapshot; pass them to adopt() on the event loop"""
+        with self._save_lock:
+            self._disk_version = _file_version(self.synced_file)
+            snapshot = load_snapshot(self.synced_file)
+        return snapshot.series if snapshot else GlucoseSeries.empty()
+    
+    def write_synced(self, series: GlucoseSeries) -> GlucoseSeries:
+        """Write `series` plus whatever is already in the snapshot; returns the union written
+        
+        Blocking; runs in a worker thread. The file lock makes read-merge-write
+        atomic across worker processes, so no worker overwrites readings
+        another one saved.
+        """
+        self.synced_file.parent.mkdir(parents=True, exist_ok=True)
+        with self._save_lock, _file_lock(self.synced_file.with_suffix(".lock")):
+            snapshot = load_snapshot(self.synced_file)
+            if snapshot is not None:
+                series = series.merge(_unseen(series, snapshot.series))
+            save_snapshot(self.synced_file, Snapshot(
+                series=series,
+                source_size=0,
+                source_mtime_ns=0,
+                source_hash=bytes(32),
+                cursor_offset=0,
+                tail=b"",
+            ))
+            self._disk_version = _file_version(self.synced_file)
+        return series
+
+class RealDataService:
+    """Per-user glucose history with lazy loading and LRU eviction of in-memory shards
+    
+    Each user's export lives at <data_dir>/<user>/csvjson.json. The demo
+    user keeps reading the legacy export in the project root.
+    """
+    
+    def __init__(self, data_dir: Optional[Path] = None, max_shards: int = 256):
+        # The CSV file is in the root directory, not in diabetes-tracker-starter
+        self.data_file = Path(__file__).parent.parent.parent.parent.parent / "csvjson.json"
+        self.data_dir = data_dir or Path(__file__).parent.parent.parent / "data" / "users"
+        self.max_shards = max_shards
+        self._shards: "OrderedDict[str, UserShard]" = OrderedDict()
+        # AGP results per (user, window, bins), tagged with the series version they came from
+        self._agp_cache = LRUCache(max_entries=512)
+    
+    def _user_dir(self, user_id: str) -> Path:
+        # Never let a user id escape the data directory
+        if _SAFE_USER_ID.match(user_id) and user_id not in (".", ".."):
+            name = user_id
+        else:
+            name = hashlib.sha256(user_id.encode("utf-8")).hexdigest()
+        return self.data_dir / name
+    
+    def _shard(self, user_id: str) -> UserShard:
+        shard = self._shards.get(user_id)
+        if shard is not None:
+            self._shards.move_to_end(user_id)
+            return shard
+        
+        user_dir = self._user_dir(user_id)
+        export_file = self.data_file if user_id == DEFAULT_USER_ID else user_dir / "csvjson.json"
+        shard = UserShard(export_file, user_dir / "synced.snap")
+        self._shards[user_id] = shard
+        while len(self._shards) > self.max_shards:
+            evicted, _ = self._shards.popitem(last=False)
+            print(f"Evicted glucose history for user {evicted} from memory")
+        return shard
+    
+    async def refresh(self, user_id: str = DEFAULT_USER_ID):
+        """Ingest the user's export and other workers' synced readings if they changed on disk
+        
+        Parsing, hashing and snapshotting run in a worker thread so a large
+        export doesn't stall the event loop. Async entry points call this
+        before the (synchronous) query methods, which only read what was
+        already loaded.
+        """
+        shard = self._shard(user_id)
+        if shard.export.changed():
+            await asyncio.to_thread(shard.export.load)
+        if shard.disk_changed():
+            # Another worker saved synced readings this one hasn't seen
+            shard.adopt(await asyncio.to_thread(shard.read_synced))
+    
+    def _load_data(self, user_id: str = DEFAULT_USER_ID) -> GlucoseSeries:
+        """A user's glucose history: their export as of the last refresh() plus synced readings"""
+        return self._shard(user_id).series()
+    
+    def get_data_version(self, user_id: str = DEFAULT_USER_ID):
+        """(fingerprint, latest epoch second) of a user's history
         
-        if not glucose_data:
+        The fingerprint is content-based (count, first/last timestamp, value
+        total) so every worker process derives the same one for the same data.
+        """
+        series = self._load_data(user_id)
+        if not len(series):
+            return (0,), None
+        stats = series.stats()
+        fingerprint = (stats["count"], int(series.ts[0]), series.latest_ts, round(stats["mean"] * stats["count"]))
+        return fingerprint, series.latest_ts
+    
+    def has_synced_readings(self, user_id: str) -> bool:
+        """Whether any readings synced from the Dexcom API are stored for the user"""
+        return len(self._shard(user_id).synced) > 0
+    
+    async def add_readings(self, user_id: str, readings: GlucoseSeries) -> int:
+        """Store readings synced from the Dexcom API for a user; returns how many were new
+        
+        The merge happens in memory right away; the snapshot is written in a
+        worker thread so large histories don't block the event loop, and
+        whatever other workers had saved comes back merged in.
+        """
+        shard = self._shard(user_id)
+        added = shard.add_readings(readings)
+        if added:
+            shard.adopt(await asyncio.to_thread(shard.write_synced, shard.synced))
+        return added
+    
+    def _resolve_window(self, series: GlucoseSeries, hours: int, start: Optional[datetime], end: Optional[datetime]):
+        """Resolve a query to [lo, hi) indices into the series
+
+        With no explicit bounds the window is the last `hours` hours up to and
+        including the latest reading.
+        """
+        if start is None and end is None:
+            return series.window(series.latest_ts - hours * 3600)
+        
+        end_s = to_epoch_seconds(end) if end is not None else None
+        if start is not None:
+            start_s = to_epoch_seconds(start)
+        else:
+            start_s = end_s - hours * 3600
+        return series.window(start_s, end_s)
+    
+    def get_glucose_data(self, hours: int = 24, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                         user_id: str = DEFAULT_USER_ID, max_points: Optional[int] = None,
+                         method: str = "lttb") -> List[Dict[str, Any]]:
+        """Get a user's glucose data for the specified time range or explicit [start, end) window
+        
+        With max_points the window is downsampled server-side before any
+        per-point objects are built.
+        """
+        series = self._load_data(user_id)
+        if not len(series):
+            return []
+        
+        lo, hi = self._resolve_window(series, hours, start, end)
+        if max_points is not None and hi - lo > max_points:
+            indices = downsample_indices(series.ts[lo:hi], series.mgdl[lo:hi], max_points, method)
+            return series.take(lo + indices).to_points()
+        return series.to_points(lo, hi)
+    
+    def get_window_stats(self, hours: int = 24, user_id: str = DEFAULT_USER_ID,
+                         latest: int = 5) -> Optional[Dict[str, Any]]:
+        """Stats for a user's last `hours` of readings without materializing the window
+
+        Returns {'stats', 'start', 'end', 'latest'} (stats from the prefix sums,
+        first/last timestamp, the last `latest` points) or None when empty.
+        """
+        series = self._load_data(user_id)
+        if not len(series):
+            return None
+        lo, hi = self._resolve_window(series, hours, None, None)
+        if hi <= lo:
+            return None
+        return {
+            "stats": series.stats(lo, hi),
+            "start": series.format_timestamps(lo, lo + 1)[0],
+            "end": series.format_timestamps(hi - 1, hi)[0],
+            "latest": series.to_points(max(lo, hi - latest), hi)
+        }
+    
+    def get_data_summary(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                         user_id: str = DEFAULT_USER_ID) -> Dict[str, Any]:
+        """Get summary statistics about a user's data, optionally limited to [start, end)"""
+        series = self._load_data(user_id)
+        lo, hi = (0, len(series))
+        if len(series) and (start is not None or end is not None):
+            lo, hi = self._resolve_window(series, 24, start, end)
+        
+        if hi <= lo:
             return {
                 "total_readings": 0,
                 "date_range": None,
                 "avg_glucose": 0,
+                "sd_glucose": 0,
                 "min_glucose": 0,
-                "max_glucose": 0
+                "max_glucose": 0,
+                "time_in_range": None
             }
         
-        glucose_values = [entry["mgdl"] for entry in glucose_data]
-        timestamps = [entry["ts"] for entry in glucose_data]
+        stats = series.stats(lo, hi)
         
         return {
-            "total_readings": len(glucose_data),
+            "total_readings": stats["count"],
             "date_range": {
-                "start": timestamps[0],
-                "end": timestamps[-1]
+                "start": series.format_timestamps(lo, lo + 1)[0],
+                "end": series.format_timestamps(hi - 1, hi)[0]
             },
-            "avg_glucose": round(sum(glucose_values) / len(glucose_values), 1),
-            "min_glucose": min(glucose_values),
-            "max_glucose": max(glucose_values)
+            "avg_glucose": round(stats["mean"], 1),
+            "sd_glucose": round(stats["sd"], 1),
+            "min_glucose": stats["min"],
+            "max_glucose": stats["max"],
+            "time_in_range": {
+                "low": stats["low"],
+                "normal": stats["normal"],
+                "high": stats["high"]
+            }
+        }
+
+    def get_agp(self, days: int = 14, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                bins: int = 288, user_id: str = DEFAULT_USER_ID) -> Dict[str, Any]:
+        """Ambulatory Glucose Profile: 5/25/50/75/95th percentiles per time-of-day bin
+        
+        Results are cached per (user, window, bins) until the user's history changes.
+        """
+        series = self._load_data(user_id)
+        cache_key = (user_id, days, start, end, bins)
+        cached = self._agp_cache.get(cache_key, version=series.version)
+        if cached is not None:
+            return cached
+        
+        lo, hi = (0, 0)
+        if len(series):
+            lo, hi = self._resolve_window(series, days * 24, start, end)
+        
+        agp = {
+            "total_readings": hi - lo,
+            "date_range": {
+                "start": series.format_timestamps(lo, lo + 1)[0],
+                "end": series.format_timestamps(hi - 1, hi)[0]
+            } if hi > lo else None,
+            "bin_minutes": 1440 // bins,
+            "bins": compute_agp(series.ts[lo:hi], series.mgdl[lo:hi], bins)
         }
+        self._agp_cache.set(cache_key, agp, version=series.version)
+        return agp
 
-real_data_service = RealDataService()
+real_data_service = RealDataService(
+    data_dir=Path(settings.GLUCOSE_DATA_DIR) if settings.GLUCOSE_DATA_DIR else None,
+    max_shards=settings.GLUCOSE_MAX_SHARDS
+)
@@ -0,0 +1,217 @@
+import re
+from typing import List, Tuple
+
+# Medical advice the chat must never pass on, matched case-insensitively
+DANGEROUS_PATTERNS = [
+    r'\b(?:take|give|inject|administer|use)\s+\d+\s*(?:units?|iu|iu\'s)\s+insulin\b',
+    r'\b(?:increase|decrease|adjust|change|modify)\s+(?:your\s+)?insulin\s+(?:dose|dosage|amount)\b',
+    r'\b(?:stop|start|discontinue|begin)\s+(?:taking|using)\s+(?:insulin|medication|medicine)\b',
+    r'\b(?:you\s+should|you\s+must|you\s+need\s+to)\s+(?:take|give|inject)\s+insulin\b',
+    r'\b(?:prescribe|prescription)\s+(?:of\s+)?(?:insulin|medication)\b',
+    r'\b(?:emergency|urgent|immediate|right\s+now)\s+(?:insulin|medication|treatment)\b'
+]
+
+# Plain substrings, matched against the lowercased text
+DANGEROUS_PHRASES = [
+    "take insulin", "give insulin", "inject insulin", "insulin dose",
+    "prescription", "you should take insulin", "you must take insulin", "you need to take insulin"
+]
+
+# Both lists run case-sensitively on text.lower(), which only differs from the
+# original case-insensitive checks for these three characters; text containing
+# one goes through the slower exact alternation instead
+_CASE_EXCEPTIONS = "\u0130\u0131\u017f"  # İ ı ſ
+_PATTERNS = re.compile("|".join(DANGEROUS_PATTERNS))
+_PHRASES = re.compile("|".join(re.escape(phrase) for phrase in DANGEROUS_PHRASES))
+_LOWERCASE_ALIASES = {"k": "\u212a"}  # KELVIN SIGN lowercases to 'k'
+_EXACT = re.compile("|".join(
+    [f"(?i:{pattern})" for pattern in DANGEROUS_PATTERNS]
+    + ["".join(f"[{c}{c.upper()}{_LOWERCASE_ALIASES.get(c, '')}]" if c.isalpha() else re.escape(c) for c in phrase)
+       for phrase in DANGEROUS_PHRASES]
+))
+
+# Every pattern and phrase contains one of these keywords, so the lists only
+# need to run on the few words around each occurrence. A new pattern must keep
+# this true; tests/test_response_postprocess.py checks every way each can match.
+_KEYWORDS = ("insulin", "medic", "treatment", "prescri")
+# Most words a match reaches before its keyword ("you need to take insulin")
+# and after it ("prescribe of insulin"), with one to spare
+_WORDS_BEFORE_KEYWORD = 5
+_WORDS_AFTER_KEYWORD = 4
+_FOLLOWING_WORDS = re.compile(r'(?:\s*\S+){0,%d}' % _WORDS_AFTER_KEYWORD)
+# Most whitespace-separated words any match spans, plus one
+_DANGEROUS_MATCH_WORDS = 6
+
+
+def _matches_around(lowered: str, pos: int, start: int, end: int) -> bool:
+    """Whether a match starting at or after `pos` includes the keyword at lowered[start:end]"""
+    before = lowered[pos:start].rsplit(None, _WORDS_BEFORE_KEYWORD)
+    start = pos + (len(before[0]) if len(before) > _WORDS_BEFORE_KEYWORD else 0)
+    # Ends on whitespace or the end of the text, so a trailing \b behaves as on the whole reply
+    end = _FOLLOWING_WORDS.match(lowered, end).end()
+    return bool(_PATTERNS.search(lowered, start, end) or _PHRASES.search(lowered, start, end))
+
+
+def contains_dangerous_content(text: str, pos: int = 0) -> bool:
+    """Whether a dangerous pattern or phrase starts at or after `pos`"""
+    if any(char in text for char in _CASE_EXCEPTIONS):
+        return _EXACT.search(text, pos) is not None
+
+    lowered = text.lower()
+    for keyword in _KEYWORDS:
+        found = lowered.find(keyword, pos)
+        while found >= 0:
+            if _matches_around(lowered, pos, found, found + len(keyword)):
+                return True
+            found = lowered.find(keyword, found + 1)
+    return False
+
+
+def dangerous_scan_start(text: str) -> int:
+    """Earliest position a dangerous match that later text could complete may start at
+
+    Matches span a handful of words, so one still being streamed starts
+    within the last few words of `text`.
+    """
+    parts = text.rsplit(None, _DANGEROUS_MATCH_WORDS)
+    return len(parts[0]) if len(parts) > _DANGEROUS_MATCH_WORDS else 0
+
+
+# Markdown cleanup, in order. Line stages never match across a line break;
+# links may; spacing stages only touch whitespace, '#' and '-'.
+#
+# These stay separate compiled substitutions rather than one tokenizing pass.
+# Each stage sees the previous one's output (removing bold exposes italics,
+# header removal creates the blank lines the spacing stages collapse), so a
+# tokenizer would have to replay that order to give identical output. Each
+# substitution loops in C, while even splitting a 2 KB reply into markdown tokens
+# with one regex (before any rewriting) costs about as much as all nine passes.
+# The chunked cleaner still makes a single pass over the reply: every
+# character goes through each stage once.
+_LINE_STAGES = [
+    (re.compile(r'\*\*(.*?)\*\*'), r'\1'),                  # bold
+    (re.compile(r'\*(.*?)\*'), r'\1'),                      # italic
+    (re.compile(r'^#{1,6}\s+', re.MULTILINE), ''),          # headers
+    (re.compile(r'\n\s*#{1,6}\s+'), '\n'),                  # indented headers
+    (re.compile(r'`(.*?)`'), r'\1'),                        # inline code
+]
+_LINK = re.compile(r'\[([^\]]+)\]\([^)]+\)')
+_SPACING_STAGES = [
+    # Collapsing any blank-line run to one break up front also covers the
+    # separate three-newline pass: list items swallow the whitespace either way
+    (re.compile(r'\n\s*\n'), '\n\n'),                       # paragraph breaks
+    (re.compile(r'\n\s*-\s*'), '\n- '),                     # list items
+    (re.compile(r'^\s*#{1,6}\s*$', re.MULTILINE), ''),      # stray header markers
+]
+
+
+def _apply(stages: List[Tuple[re.Pattern, str]], text: str) -> str:
+    for pattern, replacement in stages:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _line_cut(text: str) -> int:
+    """End of the prefix the line stages can clean without seeing more text
+
+    A cut right after a line break, before a character none of them remove
+    or treat as header/whitespace, can't split a match.
+    """
+    i = text.rfind('\n', 0, len(text) - 1)
+    while i >= 0:
+        following = text[i + 1]
+        if not following.isspace() and following not in '*#':
+            return i + 1
+        i = text.rfind('\n', 0, i)
+    return 0
+
+
+def _link_cut(text: str) -> int:
+    """End of the prefix whose link matches can't change with more text: the first undecided '['"""
+    i = 0
+    while True:
+        start = text.find('[', i)
+        if start < 0:
+            return len(text)
+        close = text.find(']', start + 1)
+        if close < 0 or close + 1 >= len(text):
+            return start
+        if close > start + 1 and text[close + 1] == '(':
+            end = text.find(')', close + 2)
+            if end < 0:
+                return start
+            if end > close + 2:
+                i = end + 1
+                continue
+        i = start + 1
+
+
+def _is_spacing_boundary(char: str) -> bool:
+    return not char.isspace() and char not in '#-'
+
+
+def _spacing_cut(text: str) -> int:
+    """End of the prefix the spacing stages can clean without seeing more text
+
+    They only match whitespace, '#' and '-', so a cut between two other
+    characters can't split a match or move a line start.
+    """
+    i = len(text) - 1
+    while i > 0:
+        if _is_spacing_boundary(text[i]) and _is_spacing_boundary(text[i - 1]):
+            return i
+        i -= 1
+    return 0
+
+
+def clean_markdown(text: str) -> str:
+    """Strip markdown from a complete reply (bold, italics, headers, code, links) and tidy spacing"""
+    return _apply(_SPACING_STAGES, _LINK.sub(r'\1', _apply(_LINE_STAGES, text))).strip()
+
+
+class MarkdownCleaner:
+    """clean_markdown() over a reply that arrives in chunks
+
+    Each stage keeps back only the tail it can't decide without more text
+    and cleans everything before it once, so output is final when returned
+    and feed() + ... + finish() equals clean_markdown() of the whole reply.
+    """
+
+    def __init__(self):
+        self._lines = ""
+        self._links = ""
+        self._spacing = ""
+        self._started = False
+
+    def feed(self, text: str) -> str:
+        self._lines += text
+        cut = _line_cut(self._lines)
+        if not cut:
+            return ""
+        settled, self._lines = self._lines[:cut], self._lines[cut:]
+        self._links += _apply(_LINE_STAGES, settled)
+
+        cut = _link_cut(self._links)
+        if not cut:
+            return ""
+        settled, self._links = self._links[:cut], self._links[cut:]
+        self._spacing += _LINK.sub(r'\1', settled)
+
+        cut = _spacing_cut(self._spacing)
+        if not cut:
+            return ""
+        settled, self._spacing = self._spacing[:cut], self._spacing[cut:]
+        return self._output(_apply(_SPACING_STAGES, settled))
+
+    def finish(self) -> str:
+        """Clean whatever is still held back; the cleaner is done after this"""
+        text = self._spacing + _LINK.sub(r'\1', self._links + _apply(_LINE_STAGES, self._lines))
+        self._lines = self._links = self._spacing = ""
+        return self._output(_apply(_SPACING_STAGES, text)).rstrip()
+
+    def _output(self, text: str) -> str:
+        # Leading whitespace of the reply is stripped; chunks end on a non-space until finish()
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        return text
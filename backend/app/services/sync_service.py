@@ -0,0 +1,238 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
+
+import numpy as np
+
+from app.db import (
+    settings, get_sync_state, save_sync_state, save_glucose_readings, get_glucose_readings,
+    save_backfill_plan, mark_backfill_chunk_done
+)
+from app.services.dexcom_egvs import EgvColumns, decode_egvs
+from app.services.dexcom_service import dexcom_service
+from app.services.glucose_store import GlucoseSeries, parse_timestamps
+from app.services.real_data_service import real_data_service
+
+# Dexcom CGMs produce a reading every 5 minutes; polling faster only finds nothing new
+SYNC_INTERVAL_SECONDS = 300
+# How far back the first sync for a user reaches when there is no high-water mark yet
+INITIAL_SYNC_HOURS = 24
+DEXCOM_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+# Widest startDate..endDate span the v2 egvs endpoint accepts in one request
+BACKFILL_CHUNK_DAYS = 90
+_EPOCH = datetime(1970, 1, 1)
+
+
+class GlucoseSyncService:
+    """Incrementally copies new Dexcom EGVs into local storage
+
+    Each user has a high-water mark (epoch seconds of the newest stored
+    reading); a sync only asks Dexcom for readings after it, upserts them
+    into the glucose collection and merges them into the local glucose store
+    that /glucose reads from.
+    """
+
+    def __init__(self):
+        self._last_sync: Dict[str, float] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._hydrated: Set[str] = set()
+        self._backfills: Dict[str, asyncio.Task] = {}
+        # One writer per user at a time: glucose has no unique index to catch a racing duplicate
+        self._store_locks: Dict[str, asyncio.Lock] = {}
+
+    def schedule_sync(self, user_id: str):
+        """Start a background sync if the user's data is stale and none is running"""
+        if user_id in self._tasks:
+            return
+        last_sync = self._last_sync.get(user_id)
+        if last_sync is not None and time.monotonic() - last_sync < SYNC_INTERVAL_SECONDS:
+            return
+
+        self._last_sync[user_id] = time.monotonic()
+        task = asyncio.create_task(self.sync_user(user_id))
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(user_id, None))
+
+    async def _hydrate(self, user_id: str, state: dict):
+        """Reload previously synced readings from MongoDB when the local store has none"""
+        if user_id in self._hydrated:
+            return
+        self._hydrated.add(user_id)
+        if not state or real_data_service.has_synced_readings(user_id):
+            return
+
+        stored = await get_glucose_readings(user_id)
+        if stored:
+            ts = [int((doc["local_ts"] - _EPOCH).total_seconds()) for doc in stored]
+            await real_data_service.add_readings(user_id, GlucoseSeries.from_columns(ts, [doc["mgdl"] for doc in stored], "dexcom"))
+            print(f"Restored {len(stored)} synced readings for user {user_id} from MongoDB")
+
+    async def _store_egvs(self, user_id: str, columns: EgvColumns, after: Optional[int] = None) -> int:
+        """Persist decoded Dexcom EGVs (optionally only those newer than `after`)
+
+        Readings go to MongoDB in bulk and to the local glucose store, then the
+        high-water mark advances; returns how many readings were new to the
+        local store. Stores for one user are serialized, so a sync and a
+        backfill chunk covering the same readings can't both insert them.
+        """
+        keep = columns.ts > after if after is not None else np.ones(len(columns.ts), dtype=bool)
+        if not keep.any():
+            return 0
+        ts, local_ts, mgdl = columns.ts[keep], columns.local_ts[keep], columns.mgdl[keep]
+        rates = columns.trend_rate[keep].tolist()
+
+        readings = [
+            {"ts": stamp, "local_ts": local, "mgdl": value, "trend": trend, "trendRate": rate if rate == rate else None}
+            for stamp, local, value, trend, rate in zip(
+                ts.astype("datetime64[s]").tolist(), local_ts.astype("datetime64[s]").tolist(),
+                mgdl.tolist(), columns.trend[keep].tolist(), rates
+            )
+        ]
+        async with self._store_locks.setdefault(user_id, asyncio.Lock()):
+            await save_glucose_readings(user_id, readings)
+            # The store is on the wall-clock axis of Clarity exports; the mark stays in UTC like Dexcom's request dates
+            added = await real_data_service.add_readings(user_id, GlucoseSeries.from_columns(local_ts, mgdl, "dexcom"))
+            await save_sync_state(user_id, int(ts[-1]))
+        return added
+
+    async def sync_user(self, user_id: str) -> int:
+        """Fetch and store EGVs newer than the user's high-water mark; returns how many were added
+
+        A gap wider than one egvs request allows (e.g. after reconnecting a
+        long-disconnected account) is fetched in BACKFILL_CHUNK_DAYS pieces,
+        oldest first, so the mark advances with each piece and a failure
+        resumes where it stopped.
+        """
+        try:
+            state = await get_sync_state(user_id)
+            await self._hydrate(user_id, state)
+            if state and state.get("backfill") and not state["backfill"].get("completed_at"):
+                self.schedule_backfill(user_id)
+
+            # Whole seconds: the request dates have no fraction, so a sub-second window would be empty
+            now = datetime.utcnow().replace(microsecond=0)
+            high_water_mark = state.get("last_ts") if state else None
+            if high_water_mark is not None:
+                start = _EPOCH + timedelta(seconds=high_water_mark + 1)
+            else:
+                start = now - timedelta(hours=INITIAL_SYNC_HOURS)
+
+            added = 0
+            while start < now:
+                end = min(start + timedelta(days=BACKFILL_CHUNK_DAYS), now)
+                response = await dexcom_service.get_glucose_data(
+                    user_id,
+                    start_date=start.strftime(DEXCOM_DATE_FORMAT),
+                    end_date=end.strftime(DEXCOM_DATE_FORMAT)
+                )
+                added += await self._store_egvs(user_id, decode_egvs(response), after=high_water_mark)
+                start = end
+            if added:
+                print(f"✅ Synced {added} new glucose readings for user {user_id}")
+            return added
+
+        except Exception as e:
+            print(f"❌ Glucose sync failed for user {user_id}: {type(e).__name__}: {str(e)}")
+            return 0
+
+    def schedule_backfill(self, user_id: str):
+        """Start (or resume) the user's historical backfill in the background"""
+        if user_id in self._backfills:
+            return
+        task = asyncio.create_task(self.backfill_user(user_id))
+        self._backfills[user_id] = task
+        task.add_done_callback(lambda _: self._backfills.pop(user_id, None))
+
+    async def drain(self):
+        """Wait for every running sync and backfill to finish"""
+        while self._tasks or self._backfills:
+            await asyncio.gather(*self._tasks.values(), *self._backfills.values(), return_exceptions=True)
+
+    def is_backfilling(self, user_id: str) -> bool:
+        return user_id in self._backfills
+
+    async def _plan_backfill(self, user_id: str) -> Optional[dict]:
+        """Split the user's full Dexcom EGV range into request-sized chunks"""
+        access_token = await dexcom_service.get_valid_access_token(user_id)
+        if not access_token:
+            raise Exception(f"No valid access token available for user: {user_id}")
+        data_range = await dexcom_service.get_data_range(access_token)
+        egvs = data_range.get("egvs") or {}
+        start_time = (egvs.get("start") or {}).get("systemTime")
+        end_time = (egvs.get("end") or {}).get("systemTime")
+        # A user without EGV history gets a dataRange with no start/end
+        if not start_time or not end_time:
+            return None
+        bounds, valid = parse_timestamps([start_time, end_time])
+        if not valid.all() or bounds[1] < bounds[0]:
+            return None
+
+        start_ts, end_ts = int(bounds[0]), int(bounds[1]) + 1
+        chunk_seconds = BACKFILL_CHUNK_DAYS * 86400
+        plan = {
+            "start_ts": start_ts,
+            "end_ts": end_ts,
+            "chunk_seconds": chunk_seconds,
+            "chunks": max(1, -(-(end_ts - start_ts) // chunk_seconds)),
+            "done": [],
+            "started_at": datetime.utcnow()
+        }
+        await save_backfill_plan(user_id, plan)
+        return plan
+
+    async def backfill_user(self, user_id: str) -> int:
+        """Copy the user's whole Dexcom history into local storage; returns how many readings were added
+
+        The range reported by dataRange is split into 90-day chunks that are
+        fetched concurrently (bounded by DEXCOM_BACKFILL_CONCURRENCY), newest
+        first, and each chunk is stored as soon as it arrives. Finished chunks
+        are recorded in the sync state, so an interrupted backfill resumes
+        with only the missing chunks.
+        """
+        try:
+            state = await get_sync_state(user_id)
+            plan = state.get("backfill") if state else None
+            if plan and plan.get("completed_at"):
+                return 0
+            if not plan:
+                plan = await self._plan_backfill(user_id)
+                if not plan:
+                    print(f"No Dexcom EGV history to backfill for user {user_id}")
+                    return 0
+
+            done = set(plan["done"])
+            pending = [i for i in reversed(range(plan["chunks"])) if i not in done]
+            remaining = len(pending)
+            semaphore = asyncio.Semaphore(max(1, settings.DEXCOM_BACKFILL_CONCURRENCY))
+            print(f"🔄 Backfilling {remaining}/{plan['chunks']} chunks of Dexcom history for user {user_id}")
+
+            async def fetch_chunk(index: int) -> int:
+                nonlocal remaining
+                chunk_start = plan["start_ts"] + index * plan["chunk_seconds"]
+                chunk_end = min(chunk_start + plan["chunk_seconds"], plan["end_ts"])
+                async with semaphore:
+                    response = await dexcom_service.get_glucose_data(
+                        user_id,
+                        start_date=(_EPOCH + timedelta(seconds=chunk_start)).strftime(DEXCOM_DATE_FORMAT),
+                        end_date=(_EPOCH + timedelta(seconds=chunk_end)).strftime(DEXCOM_DATE_FORMAT)
+                    )
+                added = await self._store_egvs(user_id, decode_egvs(response))
+                remaining -= 1
+                await mark_backfill_chunk_done(user_id, index, completed=remaining == 0)
+                return added
+
+            results = await asyncio.gather(*(fetch_chunk(i) for i in pending), return_exceptions=True)
+            failures = [r for r in results if isinstance(r, Exception)]
+            added = sum(r for r in results if not isinstance(r, Exception))
+            if failures:
+                print(f"⚠️ Backfill for user {user_id} stored {added} readings; {len(failures)} chunks failed and will be retried: {failures[0]}")
+            else:
+                print(f"✅ Backfilled {added} glucose readings for user {user_id}")
+            return added
+
+        except Exception as e:
+            print(f"❌ Glucose backfill failed for user {user_id}: {type(e).__name__}: {str(e)}")
+            return 0
+
+glucose_sync_service = GlucoseSyncService()
@@ -0,0 +1,134 @@
+import asyncio
+import heapq
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.db import settings, get_token_expiries
+from app.services.dexcom_service import dexcom_service
+
+# Tokens saved by other workers are picked up by re-reading the store this often
+RESCAN_INTERVAL_SECONDS = 300
+# A failed early refresh is retried after this long (while the old token lasts)
+RETRY_DELAY_SECONDS = 60
+
+
+class TokenRefreshScheduler:
+    """Refreshes Dexcom access tokens shortly before they expire
+
+    A min-heap of (refresh_at, user_id) ordered by each token's expires_at
+    minus TOKEN_REFRESH_MARGIN_SECONDS (and a random jitter, so tokens issued
+    together don't refresh together) drives a single background loop.
+    Refreshes run with bounded concurrency through DexcomService, so request
+    handlers keep using the cached token and never wait on the OAuth server.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, str]] = []
+        # user_id -> refresh_at of its live heap entry; other entries are stale
+        self._scheduled: Dict[str, datetime] = {}
+        self._in_flight: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._next_rescan = datetime.min
+
+    async def start(self):
+        """Start the refresh loop (called from the app lifespan)"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._semaphore = asyncio.Semaphore(max(1, settings.TOKEN_REFRESH_CONCURRENCY))
+            self._task = asyncio.create_task(self._run())
+            print("Token refresh scheduler started")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def track(self, user_id: str, expires_at: Optional[datetime]):
+        """Schedule a refresh ahead of expires_at (replacing any earlier schedule for the user)"""
+        if expires_at is None:
+            return
+        refresh_at = expires_at - timedelta(
+            seconds=settings.TOKEN_REFRESH_MARGIN_SECONDS + random.uniform(0, settings.TOKEN_REFRESH_JITTER_SECONDS)
+        )
+        self._push(user_id, refresh_at)
+
+    def forget(self, user_id: str):
+        """Stop refreshing a user's token (e.g. after disconnect)"""
+        self._scheduled.pop(user_id, None)
+
+    def _push(self, user_id: str, refresh_at: datetime):
+        self._scheduled[user_id] = refresh_at
+        heapq.heappush(self._heap, (refresh_at, user_id))
+        if self._wakeup is not None and self._heap[0][1] == user_id:
+            self._wakeup.set()
+
+    async def _rescan(self):
+        for token in await get_token_expiries():
+            user_id = token["user_id"]
+            if user_id not in self._scheduled and user_id not in self._in_flight:
+                self.track(user_id, token.get("expires_at"))
+        self._next_rescan = datetime.utcnow() + timedelta(seconds=RESCAN_INTERVAL_SECONDS)
+
+    async def _run(self):
+        while True:
+            try:
+                now = datetime.utcnow()
+                if now >= self._next_rescan:
+                    await self._rescan()
+
+                while self._heap and self._heap[0][0] <= now:
+                    refresh_at, user_id = heapq.heappop(self._heap)
+                    if self._scheduled.get(user_id) != refresh_at:
+                        continue  # superseded or forgotten
+                    del self._scheduled[user_id]
+                    self._in_flight.add(user_id)
+                    asyncio.create_task(self._refresh(user_id))
+
+                wake_at = self._next_rescan
+                if self._heap:
+                    wake_at = min(wake_at, self._heap[0][0])
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), max(0.0, (wake_at - datetime.utcnow()).total_seconds()))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Token refresh scheduler error: {type(e).__name__}: {str(e)}")
+                await asyncio.sleep(RETRY_DELAY_SECONDS)
+
+    async def _refresh(self, user_id: str):
+        # Entries fire up to margin + jitter early; anything in that horizon is due
+        refresh_before = datetime.utcnow() + timedelta(
+            seconds=settings.TOKEN_REFRESH_MARGIN_SECONDS + settings.TOKEN_REFRESH_JITTER_SECONDS
+        )
+        try:
+            async with self._semaphore:
+                expires_at = await dexcom_service.refresh_if_expiring(user_id, refresh_before)
+        except Exception as e:
+            print(f"❌ Scheduled token refresh failed for user {user_id}: {type(e).__name__}: {str(e)}")
+            expires_at = None
+        finally:
+            self._in_flight.discard(user_id)
+
+        if user_id in self._scheduled:
+            return  # re-tracked (new tokens saved) while refreshing
+        now = datetime.utcnow()
+        if expires_at is None or expires_at <= now:
+            return  # nothing left to keep alive; the user has to reconnect
+        if expires_at <= refresh_before:
+            # Refresh failed but the current token still works for a while
+            self._push(user_id, min(now + timedelta(seconds=RETRY_DELAY_SECONDS), expires_at))
+        else:
+            self.track(user_id, expires_at)
+
+
+token_refresh_scheduler = TokenRefreshScheduler()
@@ -0,0 +1,53 @@
+import asyncio
+
+from app.services import chat_service as chat_module
+from app.services.chat_service import ChatService
+from app.services.glucose_access import GlucoseSource
+
+
+class FakeAccess:
+    """A real_csv source ahead of the synthetic fallback, counting window loads"""
+
+    def __init__(self):
+        self.csv_version = (1, 1000)
+        self.synthetic_version = (0,)
+        self.loads = 0
+
+    async def sources(self, user_id):
+        return [
+            GlucoseSource("real_csv", "csv", self.csv_version),
+            GlucoseSource("synthetic", "synthetic", self.synthetic_version),
+        ]
+
+    async def get_window_stats(self, user_id, hours, candidates=None):
+        self.loads += 1
+        source = candidates[0]
+        return {
+            "source": source.name, "message": source.message, "version": source.version,
+            "stats": {"count": 2, "mean": 122.5, "min": 120, "max": 125, "low": 0, "normal": 2, "high": 0},
+            "start": "2024-01-01T00:00:00", "end": "2024-01-01T00:05:00",
+            "latest": [{"ts": "2024-01-01T00:00:00", "mgdl": 120}, {"ts": "2024-01-01T00:05:00", "mgdl": 125}]
+        }
+
+def test_context_survives_fallback_version_changes(monkeypatch):
+    access = FakeAccess()
+    monkeypatch.setattr(chat_module, "glucose_access", access)
+    service = ChatService()
+
+    first = asyncio.run(service._get_glucose_context(24, "user"))
+    access.synthetic_version = (300,)
+    assert asyncio.run(service._get_glucose_context(24, "user")) == first
+    assert access.loads == 1
+
+    access.csv_version = (2, 1300)
+    asyncio.run(service._get_glucose_context(24, "user"))
+    assert access.loads == 2
+
+
+def test_context_renders_window_stats(monkeypatch):
+    monkeypatch.setattr(chat_module, "glucose_access", FakeAccess())
+    context = asyncio.run(ChatService()._get_glucose_context(24, "user"))
+    assert "- Data Source: real_csv" in context
+    assert "- Total Readings: 2" in context
+    assert "- Average: 122.5 mg/dL" in context
+    assert "- 00:05: 125 mg/dL" in context
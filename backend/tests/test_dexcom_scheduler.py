@@ -0,0 +1,59 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services.dexcom_scheduler import DexcomRequestScheduler, DexcomUnavailableError
+
+
+def make_scheduler():
+    return DexcomRequestScheduler(rate_per_second=1000, burst=1000, max_retries=0,
+                                  breaker_threshold=2, breaker_reset_seconds=0)
+
+
+def test_cancelled_probe_does_not_leave_the_breaker_stuck_open():
+    responses = []
+
+    async def handler(request):
+        status = responses.pop(0)
+        if status is None:
+            await asyncio.Event().wait()  # hangs until the caller gives up
+        return httpx.Response(status)
+
+    async def scenario():
+        scheduler = make_scheduler()
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            responses.extend([503, 503, None, 200])
+            for _ in range(2):
+                await scheduler.send(client, "client", "GET", "https://dexcom.test/egvs")
+            assert scheduler.breaker("client").is_open
+
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(scheduler.send(client, "client", "GET", "https://dexcom.test/egvs"), 0.05)
+
+            response = await scheduler.send(client, "client", "GET", "https://dexcom.test/egvs")
+            assert response.status_code == 200
+            assert not scheduler.breaker("client").is_open
+
+    asyncio.run(scenario())
+
+
+def test_unexpected_probe_error_counts_as_a_failure():
+    async def handler(request):
+        raise RuntimeError("broken transport")
+
+    async def scenario():
+        scheduler = make_scheduler()
+        breaker = scheduler.breaker("client")
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            for _ in range(3):
+                with pytest.raises(RuntimeError):
+                    await scheduler.send(client, "client", "GET", "https://dexcom.test/egvs")
+                assert not breaker._probing
+            assert breaker.is_open
+
+        breaker.reset_seconds = 3600
+        with pytest.raises(DexcomUnavailableError):
+            await scheduler.send(None, "client", "GET", "https://dexcom.test/egvs")
+
+    asyncio.run(scenario())
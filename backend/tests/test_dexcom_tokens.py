@@ -0,0 +1,49 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from app import db
+from app.services.dexcom_service import DexcomService
+
+
+class SlowRefreshDexcom(DexcomService):
+    """Token endpoint stand-in: each refresh waits until the test releases it"""
+
+    def __init__(self):
+        super().__init__()
+        self.refresh_calls = 0
+        self.release = asyncio.Event()
+
+    async def refresh_access_token(self, refresh_token):
+        self.refresh_calls += 1
+        await self.release.wait()
+        return {"access_token": f"access-{self.refresh_calls}", "refresh_token": f"refresh-{self.refresh_calls}",
+                "expires_in": 7200}
+
+
+def test_cancelled_waiter_does_not_start_a_second_refresh(monkeypatch):
+    tokens = {"user": {
+        "user_id": "user", "access_token": "expired", "refresh_token": "refresh-0",
+        "expires_at": datetime.utcnow() - timedelta(minutes=1)
+    }}
+    monkeypatch.setattr(db, "fallback_tokens", tokens)
+
+    async def scenario():
+        service = SlowRefreshDexcom()
+        first = asyncio.create_task(service.get_valid_access_token("user"))
+        while not service.refresh_calls:
+            await asyncio.sleep(0)
+
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        assert "user" in service._refreshes
+
+        second = asyncio.create_task(service.get_valid_access_token("user"))
+        await asyncio.sleep(0)
+        service.release.set()
+        token = await second
+
+        assert token == "access-1"
+        assert service.refresh_calls == 1
+        assert service._refreshes == {}
+
+    asyncio.run(scenario())
@@ -0,0 +1,53 @@
+import asyncio
+import json
+import threading
+
+from app.services import real_data_service as real_data_module
+from app.services.real_data_service import RealDataService
+
+
+def write_export(path, values):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    rows = [
+        {"Event Type": "EGV", "Timestamp (YYYY-MM-DDThh:mm:ss)": f"2024-01-01T00:{5 * i:02d}:00",
+         "Glucose Value (mg/dL)": value}
+        for i, value in enumerate(values)
+    ]
+    path.write_text(json.dumps(rows))
+
+
+def test_export_is_ingested_off_the_event_loop_and_hashed_once(monkeypatch, tmp_path):
+    threads, hashes = [], []
+    load_egv_columns, file_sha256 = real_data_module.load_egv_columns, real_data_module.file_sha256
+
+    def recording_load(*args):
+        threads.append(threading.current_thread())
+        return load_egv_columns(*args)
+
+    def recording_hash(path):
+        hashes.append(path)
+        return file_sha256(path)
+
+    monkeypatch.setattr(real_data_module, "load_egv_columns", recording_load)
+    monkeypatch.setattr(real_data_module, "file_sha256", recording_hash)
+    service = RealDataService(data_dir=tmp_path)
+    write_export(tmp_path / "user" / "csvjson.json", [100, 110, 120])
+
+    # Queries only read what the last refresh loaded
+    assert service.get_data_summary(user_id="user")["total_readings"] == 0
+    assert threads == []
+
+    asyncio.run(service.refresh("user"))
+    assert service.get_data_summary(user_id="user")["total_readings"] == 3
+    assert threads and threading.main_thread() not in threads
+    assert len(hashes) == 1
+
+    # Unchanged on disk: nothing to ingest
+    asyncio.run(service.refresh("user"))
+    assert len(threads) == 1
+
+    # Rewritten in place at the same size: hashed once to detect the change, not again after parsing
+    write_export(tmp_path / "user" / "csvjson.json", [101, 111, 121])
+    asyncio.run(service.refresh("user"))
+    assert service.get_data_summary(user_id="user")["avg_glucose"] == 111
+    assert len(hashes) == 2
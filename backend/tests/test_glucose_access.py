@@ -0,0 +1,36 @@
+import asyncio
+
+import numpy as np
+
+from app.services.glucose_access import GlucoseSource, glucose_access
+from app.services.glucose_aggregates import summarize_values
+from app.services.glucose_store import GlucoseSeries
+from app.services.real_data_service import real_data_service
+
+
+def test_window_stats_for_stored_readings_match_the_window(monkeypatch, tmp_path):
+    monkeypatch.setattr(real_data_service, "data_dir", tmp_path)
+    rng = np.random.default_rng(0)
+    ts = 1704067200 + np.arange(600) * 300
+    asyncio.run(real_data_service.add_readings(
+        "stats_user", GlucoseSeries.from_columns(ts, rng.integers(50, 300, 600), "dexcom")
+    ))
+    source = GlucoseSource("dexcom", "synced", real_data_service.get_data_version("stats_user"))
+
+    for hours in (3, 24, 1000):
+        summary = glucose_access.window_stats(source, "stats_user", hours)
+        points = glucose_access.load(source, "stats_user", hours)
+        expected = summarize_values([point["mgdl"] for point in points])
+        assert summary["stats"].keys() == expected.keys()
+        for key, value in expected.items():
+            assert abs(summary["stats"][key] - value) < 1e-9
+        assert summary["start"] == points[0]["ts"]
+        assert summary["end"] == points[-1]["ts"]
+        assert summary["latest"] == points[-5:]
+
+
+def test_window_stats_for_generated_data():
+    source = GlucoseSource("synthetic", "generated", (None,))
+    summary = glucose_access.window_stats(source, "anyone", 6)
+    assert summary["stats"]["count"] == len(glucose_access.load(source, "anyone", 6))
+    assert len(summary["latest"]) == 5
@@ -0,0 +1,16 @@
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+client = TestClient(app)
+
+
+def test_window_with_mixed_offsets_is_compared_as_utc():
+    response = client.get("/glucose", params={"start": "2024-01-02T00:00:00Z", "end": "2024-01-01T00:00:00"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "end must be after start"
+
+
+def test_window_with_mixed_offsets_is_accepted():
+    response = client.get("/glucose", params={"start": "2024-01-02T00:00:00Z", "end": "2024-01-03T00:00:00"})
+    assert response.status_code == 200
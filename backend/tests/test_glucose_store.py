@@ -0,0 +1,65 @@
+import asyncio
+
+import numpy as np
+
+from app.services.glucose_store import GlucoseSeries, parse_timestamps
+from app.services.real_data_service import RealDataService, UserShard
+
+
+def test_parse_timestamps_fast_path():
+    seconds, valid = parse_timestamps(["2024-01-01T00:00:00", "2024-01-01T00:05:00"])
+    assert valid.all()
+    assert seconds.tolist() == [1704067200, 1704067500]
+
+
+def test_parse_timestamps_rejects_missing_values():
+    seconds, valid = parse_timestamps(["2024-01-01T00:00:00", None, "", "NaT"])
+    assert valid.tolist() == [True, False, False, False]
+    assert seconds[0] == 1704067200
+    assert not np.any(seconds == np.iinfo(np.int64).min)
+
+
+def test_parse_timestamps_fallback_keeps_good_rows():
+    seconds, valid = parse_timestamps(["2024-01-01T00:00:00Z", None, "not a time"])
+    assert valid.tolist() == [True, False, False]
+    assert seconds[0] == 1704067200
+
+
+def test_merge_inserts_older_readings_in_order():
+    held = GlucoseSeries.from_columns([300, 600, 900], [100, 110, 120], "dexcom")
+    merged = held.merge(GlucoseSeries.from_columns([0, 600, 750], [90, 111, 115], "real_dexcom"))
+    assert merged.ts.tolist() == [0, 300, 600, 600, 750, 900]
+    # Readings already held stay ahead of new ones at the same timestamp
+    assert merged.mgdl.tolist() == [90, 100, 110, 111, 115, 120]
+
+
+def test_shard_skips_stored_readings_and_saves_snapshot(tmp_path):
+    shard = UserShard(tmp_path / "csvjson.json", tmp_path / "synced.snap")
+    assert shard.add_readings(GlucoseSeries.from_columns([600, 900], [110, 120], "dexcom")) == 2
+    # An older backfill chunk overlapping what is stored
+    assert shard.add_readings(GlucoseSeries.from_columns([0, 300, 600], [90, 100, 110], "dexcom")) == 2
+    shard.write_synced(shard.synced)
+
+    reloaded = UserShard(tmp_path / "csvjson.json", tmp_path / "synced.snap")
+    assert reloaded.synced.ts.tolist() == [0, 300, 600, 900]
+    assert reloaded.synced.mgdl.tolist() == [90, 100, 110, 120]
+
+
+def test_shard_keeps_one_reading_per_timestamp_in_a_batch(tmp_path):
+    shard = UserShard(tmp_path / "csvjson.json", tmp_path / "synced.snap")
+    assert shard.add_readings(GlucoseSeries.from_columns([300, 0, 300, 0], [100, 90, 100, 90], "dexcom")) == 2
+    assert shard.synced.ts.tolist() == [0, 300]
+
+
+def test_workers_sharing_a_data_dir_keep_each_others_readings(tmp_path):
+    first, second = RealDataService(data_dir=tmp_path), RealDataService(data_dir=tmp_path)
+    second._shard("user")  # both hold the shard before either writes
+
+    start = 1704067200
+    asyncio.run(first.add_readings("user", GlucoseSeries.from_columns(start + np.arange(10) * 300, [100] * 10, "dexcom")))
+    asyncio.run(second.add_readings("user", GlucoseSeries.from_columns(start + np.arange(10, 12) * 300, [150] * 2, "dexcom")))
+
+    assert len(UserShard(tmp_path / "user" / "csvjson.json", tmp_path / "user" / "synced.snap").synced) == 12
+    assert len(second._shard("user").synced) == 12
+    asyncio.run(first.refresh("user"))
+    assert len(first._shard("user").synced) == 12
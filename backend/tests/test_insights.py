@@ -0,0 +1,58 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services import insights_service as insights_module
+from app.services.insights_service import GlucoseInsightsService
+
+
+class FakeAccess:
+    def __init__(self):
+        self.hours = []
+
+    async def get_window(self, user_id, hours):
+        self.hours.append(hours)
+        return {"source": "real_csv", "data": [{"ts": "2024-01-01T00:00:00", "mgdl": 120}]}
+
+
+class FakeChat:
+    def __init__(self):
+        self.context_hours = []
+
+    async def get_chat_response(self, message, context="", user_id="default_user", context_hours=24):
+        self.context_hours.append(context_hours)
+        return {"success": True, "response": "insight", "model": "test", "usage": {}}
+
+
+async def _no_cached_insight(*key):
+    return None
+
+
+async def _discard_insight(entry):
+    pass
+
+
+def test_fingerprint_covers_the_window_the_prompt_uses(monkeypatch):
+    access, chat = FakeAccess(), FakeChat()
+    monkeypatch.setattr(insights_module, "glucose_access", access)
+    monkeypatch.setattr(insights_module, "chat_service", chat)
+    monkeypatch.setattr(insights_module, "get_cached_insight", _no_cached_insight)
+    monkeypatch.setattr(insights_module, "save_cached_insight", _discard_insight)
+
+    result = asyncio.run(GlucoseInsightsService().get_insights("general", "6h", "user"))
+    assert result["success"]
+    assert access.hours == [6]
+    assert chat.context_hours == [6]
+
+
+def test_unknown_time_range_is_rejected():
+    response = TestClient(app).post("/chat/glucose-insights", json={"time_range": "48h"})
+    assert response.status_code == 400
+    assert "Invalid time_range" in response.json()["detail"]
+
+
+def test_unknown_analysis_type_is_rejected():
+    response = TestClient(app).post("/chat/glucose-insights", json={"analysis_type": "general "})
+    assert response.status_code == 400
+    assert "Invalid analysis_type" in response.json()["detail"]
@@ -0,0 +1,81 @@
+import itertools
+
+import pytest
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+from app.services import response_postprocess as postprocess
+from app.services.response_postprocess import DANGEROUS_PATTERNS, DANGEROUS_PHRASES, contains_dangerous_content
+
+_CLASS_SAMPLES = {sre_parse.CATEGORY_SPACE: " ", sre_parse.CATEGORY_DIGIT: "0"}
+
+
+def sample_paths(items) -> list:
+    """One representative string for every way through a parsed pattern
+
+    Literals stay as they are, \\s becomes a space and \\d a digit; repeats of
+    those are sampled at their minimum and at one, which doesn't change how
+    many whitespace-separated words a match spans.
+    """
+    paths = [""]
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            options = [chr(av)]
+        elif op is sre_parse.AT:
+            options = [""]
+        elif op is sre_parse.IN:
+            assert len(av) == 1 and av[0][0] is sre_parse.CATEGORY, f"unsupported class {av}"
+            options = [_CLASS_SAMPLES[av[0][1]]]
+        elif op is sre_parse.SUBPATTERN:
+            options = sample_paths(av[-1])
+        elif op is sre_parse.BRANCH:
+            options = [path for branch in av[1] for path in sample_paths(branch)]
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            low, high, body = av
+            body_paths = sample_paths(body)
+            if high is sre_parse.MAXREPEAT:
+                assert body_paths in ([" "], ["0"]), f"unbounded repeat of {body}"
+                counts = {low, max(low, 1)}
+            else:
+                counts = range(low, high + 1)
+            options = [
+                "".join(parts) for count in counts for parts in itertools.product(body_paths, repeat=count)
+            ]
+        else:
+            raise AssertionError(f"unsupported pattern element {op}")
+        paths = [path + option for path in paths for option in options]
+    return paths
+
+
+def all_samples():
+    for pattern in DANGEROUS_PATTERNS:
+        for sample in sample_paths(sre_parse.parse(pattern)):
+            yield pattern, sample
+    for phrase in DANGEROUS_PHRASES:
+        yield phrase, phrase
+
+
+def fits_keyword_window(sample: str) -> bool:
+    for keyword in postprocess._KEYWORDS:
+        start = sample.find(keyword)
+        while start >= 0:
+            end = start + len(keyword)
+            before = len(sample[:start].split())
+            after = len(sample[end:].split())
+            if before <= postprocess._WORDS_BEFORE_KEYWORD and after <= postprocess._WORDS_AFTER_KEYWORD:
+                return True
+            start = sample.find(keyword, start + 1)
+    return False
+
+
+@pytest.mark.parametrize("source,sample", list(all_samples()))
+def test_every_match_is_found_from_a_keyword(source, sample):
+    # The safety scan only runs the patterns around _KEYWORDS, so every way a
+    # pattern or phrase can match has to contain one close enough to its ends
+    assert fits_keyword_window(sample), f"{source!r} can match {sample!r} away from any keyword"
+    assert len(sample.split()) < postprocess._DANGEROUS_MATCH_WORDS
+    assert contains_dangerous_content(sample)
+    assert contains_dangerous_content(sample.upper())
@@ -0,0 +1,205 @@
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app import db
+from app.services import sync_service as sync_module
+from app.services.dexcom_egvs import decode_egvs
+from app.services.sync_service import GlucoseSyncService
+
+
+# Three 90-day chunks starting 2024-01-01, 2024-03-31 and 2024-06-29
+HALF_YEAR = {"egvs": {"start": {"systemTime": "2024-01-01T00:00:00"}, "end": {"systemTime": "2024-07-01T00:00:00"}}}
+
+
+def epoch(value: str) -> int:
+    return int((datetime.fromisoformat(value) - datetime(1970, 1, 1)).total_seconds())
+
+
+class FakeDexcom:
+    """Stands in for dexcom_service: a fixed dataRange and one EGV at the start of each requested chunk"""
+
+    def __init__(self, data_range, failing=()):
+        self.data_range = data_range
+        self.failing = set(failing)
+        self.requests = []
+
+    async def get_valid_access_token(self, user_id):
+        return "token"
+
+    async def get_data_range(self, access_token):
+        return self.data_range
+
+    async def get_glucose_data(self, user_id, start_date=None, end_date=None):
+        self.requests.append((start_date, end_date))
+        if start_date in self.failing:
+            raise Exception(f"egvs request starting {start_date} failed")
+        return {"egvs": [{"systemTime": start_date, "value": 120}]}
+
+
+class FakeSyncStateCollection:
+    """Applies the $max/$set updates save_sync_state sends the way MongoDB does"""
+
+    def __init__(self):
+        self.docs = {}
+
+    async def update_one(self, query, update, upsert=False):
+        doc = self.docs.setdefault(query["user_id"], dict(query))
+        for field, value in update.get("$max", {}).items():
+            doc[field] = max(value, doc.get(field, value))
+        doc.update(update.get("$set", {}))
+
+    async def find_one(self, query):
+        return self.docs.get(query["user_id"])
+
+
+class FakeGlucoseCollection:
+    """A time-series glucose collection: no unique index, and every call yields to the loop"""
+
+    def __init__(self):
+        self.docs = []
+
+    def find(self, query, projection=None):
+        collection = self
+
+        class Cursor:
+            async def to_list(self, length=None):
+                await asyncio.sleep(0)
+                span = query["ts"]
+                return [{"ts": doc["ts"]} for doc in collection.docs
+                        if doc["user_id"] == query["user_id"] and span["$gte"] <= doc["ts"] <= span["$lte"]]
+
+        return Cursor()
+
+    async def insert_many(self, documents, ordered=True):
+        await asyncio.sleep(0)
+        self.docs.extend(documents)
+        return SimpleNamespace(inserted_ids=[None] * len(documents))
+
+
+@pytest.fixture
+def fallback_state(monkeypatch, tmp_path):
+    state = {}
+    monkeypatch.setattr(db, "fallback_sync_state", state)
+    monkeypatch.setattr(sync_module.real_data_service, "data_dir", tmp_path)
+    monkeypatch.setattr(sync_module.real_data_service, "_shards", OrderedDict())
+    return state
+
+
+def use_dexcom(monkeypatch, fake):
+    monkeypatch.setattr(sync_module, "dexcom_service", fake)
+    return fake
+
+
+@pytest.mark.parametrize("data_range", [
+    {},
+    {"egvs": None},
+    {"egvs": {}},
+    {"egvs": {"start": {"systemTime": None}, "end": {"systemTime": None}}},
+    {"egvs": {"start": {"systemTime": ""}, "end": {"systemTime": "2024-01-01T00:00:00"}}},
+])
+def test_empty_data_range_saves_no_plan(monkeypatch, fallback_state, data_range):
+    fake = use_dexcom(monkeypatch, FakeDexcom(data_range))
+
+    added = asyncio.run(GlucoseSyncService().backfill_user("user"))
+
+    assert added == 0
+    assert "user" not in fallback_state
+    assert fake.requests == []
+
+
+def test_backfill_resumes_with_the_failed_chunk(monkeypatch, fallback_state):
+    fake = use_dexcom(monkeypatch, FakeDexcom(HALF_YEAR, failing={"2024-03-31T00:00:00"}))
+
+    assert asyncio.run(GlucoseSyncService().backfill_user("user")) == 2
+    plan = fallback_state["user"]["backfill"]
+    assert plan["chunks"] == 3
+    assert sorted(plan["done"]) == [0, 2]
+    assert "completed_at" not in plan
+
+    fake.failing.clear()
+    fake.requests.clear()
+    assert asyncio.run(GlucoseSyncService().backfill_user("user")) == 1
+    assert [start for start, _ in fake.requests] == ["2024-03-31T00:00:00"]
+    assert sorted(plan["done"]) == [0, 1, 2]
+    assert plan["completed_at"]
+
+
+def test_older_chunks_do_not_rewind_the_high_water_mark(monkeypatch, fallback_state):
+    use_dexcom(monkeypatch, FakeDexcom(HALF_YEAR))
+
+    # Chunks are stored newest first, so the older ones arrive after the mark is at its final value
+    assert asyncio.run(GlucoseSyncService().backfill_user("user")) == 3
+    assert fallback_state["user"]["last_ts"] == epoch("2024-06-29T00:00:00")
+
+
+@pytest.mark.parametrize("use_mongo", [True, False])
+def test_high_water_mark_only_moves_forward(monkeypatch, fallback_state, use_mongo):
+    if use_mongo:
+        monkeypatch.setattr(db, "mongo_available", True)
+        monkeypatch.setattr(db, "sync_state_collection", FakeSyncStateCollection())
+
+    async def save_out_of_order():
+        for last_ts in (1000, 3000, 2000):
+            await db.save_sync_state("user", last_ts)
+        return await db.get_sync_state("user")
+
+    assert asyncio.run(save_out_of_order())["last_ts"] == 3000
+
+
+def test_overlapping_stores_insert_each_reading_once(monkeypatch, fallback_state):
+    collection = FakeGlucoseCollection()
+    monkeypatch.setattr(db, "mongo_available", True)
+    monkeypatch.setattr(db, "glucose_collection", collection)
+    egvs = decode_egvs({"egvs": [
+        {"systemTime": f"2024-01-01T{hour:02d}:00:00", "value": 100 + hour} for hour in range(24)
+    ]})
+    service = GlucoseSyncService()
+
+    async def sync_and_backfill_together():
+        return await asyncio.gather(service._store_egvs("user", egvs), service._store_egvs("user", egvs))
+
+    assert sorted(asyncio.run(sync_and_backfill_together())) == [0, 24]
+    assert len(collection.docs) == 24
+
+
+def test_sync_after_a_long_gap_is_split_into_request_sized_pieces(monkeypatch, fallback_state):
+    fake = use_dexcom(monkeypatch, FakeDexcom({}))
+    gap_start = datetime.utcnow() - timedelta(days=200)
+    fallback_state["user"] = {"user_id": "user", "last_ts": epoch(gap_start.strftime("%Y-%m-%dT%H:%M:%S"))}
+
+    assert asyncio.run(GlucoseSyncService().sync_user("user")) == 3
+    assert len(fake.requests) == 3
+    for (start, end), (next_start, _) in zip(fake.requests, fake.requests[1:] + [(None, None)]):
+        assert 0 < epoch(end) - epoch(start) <= sync_module.BACKFILL_CHUNK_DAYS * 86400
+        assert next_start in (end, None)
+    assert fallback_state["user"]["last_ts"] == epoch(fake.requests[-1][0])
+
+
+def test_synced_readings_share_the_exports_wall_clock_axis(monkeypatch, fallback_state):
+    egvs = decode_egvs({"egvs": [
+        {"systemTime": "2024-01-01T15:00:00Z", "displayTime": "2024-01-01T10:00:00-05:00", "value": 110},
+        {"systemTime": "2024-01-01T15:05:00", "displayTime": "2024-01-01T10:05:00", "value": 115},
+        {"systemTime": "2024-01-01T15:10:00", "value": 120},
+    ]})
+    assert egvs.ts.tolist() == [epoch("2024-01-01T15:00:00"), epoch("2024-01-01T15:05:00"), epoch("2024-01-01T15:10:00")]
+    assert egvs.local_ts.tolist() == [epoch("2024-01-01T10:00:00"), epoch("2024-01-01T10:05:00"), epoch("2024-01-01T15:10:00")]
+
+    asyncio.run(GlucoseSyncService()._store_egvs("user", egvs))
+    points = sync_module.real_data_service.get_glucose_data(hours=24, user_id="user")
+    assert [point["ts"] for point in points[:2]] == ["2024-01-01T10:00:00", "2024-01-01T10:05:00"]
+    # Request windows keep using systemTime
+    assert fallback_state["user"]["last_ts"] == epoch("2024-01-01T15:10:00")
+
+
+def test_agp_bins_synced_readings_by_local_time_of_day(monkeypatch, fallback_state):
+    egvs = decode_egvs({"egvs": [
+        {"systemTime": "2024-01-01T15:00:00Z", "displayTime": "2024-01-01T10:00:00-05:00", "value": 110},
+    ]})
+    asyncio.run(GlucoseSyncService()._store_egvs("user", egvs))
+
+    profile = sync_module.real_data_service.get_agp(days=1, bins=24, user_id="user")["bins"]
+    assert [entry["minute"] for entry in profile if entry["count"]] == [10 * 60]
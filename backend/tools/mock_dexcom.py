@@ -0,0 +1,263 @@
+"""Local stand-in for the Dexcom v2 API, for offline sync and load testing
+
+Serves the endpoints DexcomService uses (OAuth login/token, users/self,
+dataRange and egvs) with synthetic, deterministic CGM history per user and
+configurable latency, 5xx error rate and 429 rate limiting.
+
+    cd backend
+    python -m tools.mock_dexcom --port 8100 --history-days 365 --latency-ms 80
+    DEXCOM_BASE_URL=http://localhost:8100 uvicorn app.main:app --port 8000
+
+Any authorization code is accepted; the code (e.g. "user42") names the
+simulated Dexcom account, so each distinct code gets its own history.
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import secrets
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlencode
+
+import numpy as np
+from fastapi import FastAPI, Header, Query, Request
+from fastapi.responses import JSONResponse, RedirectResponse
+
+DEXCOM_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+READING_INTERVAL_SECONDS = 300
+_EPOCH = datetime(1970, 1, 1)
+# Dexcom arrow boundaries in mg/dL per minute, matching app.services.glucose_trends
+_TREND_BINS = np.array([-3.0, -2.0, -1.0, 1.0, 2.0, 3.0])
+_TREND_NAMES = np.array(["doubleDown", "singleDown", "fortyFiveDown", "flat", "fortyFiveUp", "singleUp", "doubleUp"])
+
+
+@dataclass
+class MockConfig:
+    latency_ms: float = 50.0
+    latency_jitter_ms: float = 20.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after_seconds: int = 1
+    history_days: int = 90
+    token_ttl_seconds: int = 7200
+    # "ms" (epoch milliseconds, what transform_dexcom_data reads) or "iso" (v2 strings)
+    system_time_format: str = "ms"
+    seed: int = 0
+
+
+def synthetic_egvs(account: str, start_ts: int, end_ts: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Readings on the 5-minute grid in [start_ts, end_ts]: (epoch seconds, mg/dL, mg/dL/min)
+
+    Values depend only on the account and the timestamp, so overlapping
+    requests always agree.
+    """
+    first = -(-start_ts // READING_INTERVAL_SECONDS) * READING_INTERVAL_SECONDS
+    ts = np.arange(first, end_ts + 1, READING_INTERVAL_SECONDS, dtype=np.int64)
+    phase = int.from_bytes(hashlib.sha256(f"{seed}:{account}".encode()).digest()[:4], "little") / 2**32 * 2 * np.pi
+
+    def curve(t: np.ndarray) -> np.ndarray:
+        t = t.astype(np.float64)
+        daily = 45 * np.sin(2 * np.pi * t / 86400 + phase)
+        meals = 25 * np.sin(2 * np.pi * t / 14400 + 3 * phase)
+        noise = ((t // READING_INTERVAL_SECONDS * 2654435761 + seed) % 1000) / 1000 * 12 - 6
+        return 135 + daily + meals + noise
+
+    values = np.clip(np.round(curve(ts)), 40, 400)
+    previous = np.clip(np.round(curve(ts - READING_INTERVAL_SECONDS)), 40, 400)
+    rate = (values - previous) / (READING_INTERVAL_SECONDS / 60)
+    return ts, values.astype(np.int64), rate
+
+
+def create_app(config: MockConfig) -> FastAPI:
+    app = FastAPI(title="Mock Dexcom API")
+    # access/refresh token -> (account, expires_at)
+    access_tokens: Dict[str, Tuple[str, datetime]] = {}
+    refresh_tokens: Dict[str, str] = {}
+    stats: Counter = Counter()
+
+    async def simulate(endpoint: str) -> Optional[JSONResponse]:
+        """Apply latency and injected faults; returns the fault response, if any"""
+        stats[endpoint] += 1
+        delay = random.gauss(config.latency_ms, config.latency_jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        roll = random.random()
+        if roll < config.rate_limit_rate:
+            stats["429"] += 1
+            return JSONResponse(
+                {"errors": [{"code": "TooManyRequests", "message": "Rate limit exceeded"}]},
+                status_code=429,
+                headers={"Retry-After": str(config.retry_after_seconds)}
+            )
+        if roll < config.rate_limit_rate + config.error_rate:
+            stats["5xx"] += 1
+            return JSONResponse({"errors": [{"code": "InternalError"}]}, status_code=500)
+        return None
+
+    def authorize(authorization: Optional[str]) -> Optional[str]:
+        token = (authorization or "").removeprefix("Bearer ").strip()
+        entry = access_tokens.get(token)
+        if entry is None or entry[1] <= datetime.utcnow():
+            return None
+        return entry[0]
+
+    def issue_tokens(account: str) -> dict:
+        access_token, refresh_token = secrets.token_urlsafe(24), secrets.token_urlsafe(24)
+        access_tokens[access_token] = (account, datetime.utcnow() + timedelta(seconds=config.token_ttl_seconds))
+        refresh_tokens[refresh_token] = account
+        return {
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "expires_in": config.token_ttl_seconds,
+            "token_type": "Bearer"
+        }
+
+    def history_bounds() -> Tuple[int, int]:
+        """Every account's history ends now and spans history_days"""
+        end = int((datetime.utcnow() - _EPOCH).total_seconds())
+        return end - config.history_days * 86400, end
+
+    def render_time(seconds: np.ndarray) -> list:
+        if config.system_time_format == "iso":
+            return [(_EPOCH + timedelta(seconds=s)).strftime(DEXCOM_DATE_FORMAT) for s in seconds.tolist()]
+        return (seconds * 1000).tolist()
+
+    def unauthorized() -> JSONResponse:
+        return JSONResponse({"errors": [{"code": "Unauthorized"}]}, status_code=401)
+
+    @app.get("/v2/oauth2/login")
+    async def login(redirect_uri: str, state: Optional[str] = None, client_id: str = ""):
+        params = {"code": f"mock-{secrets.token_hex(6)}"}
+        if state:
+            params["state"] = state
+        return RedirectResponse(f"{redirect_uri}?{urlencode(params)}")
+
+    @app.post("/v2/oauth2/token")
+    async def token(request: Request):
+        fault = await simulate("token")
+        if fault is not None:
+            return fault
+        # Parsed by hand so the mock doesn't need python-multipart for Form()
+        form = {key: values[0] for key, values in parse_qs((await request.body()).decode()).items()}
+        grant_type, code, refresh_token = form.get("grant_type"), form.get("code"), form.get("refresh_token")
+        if grant_type == "authorization_code" and code:
+            return issue_tokens(code)
+        if grant_type == "refresh_token" and refresh_token in refresh_tokens:
+            return issue_tokens(refresh_tokens.pop(refresh_token))
+        return JSONResponse({"error": "invalid_grant"}, status_code=400)
+
+    @app.get("/v2/users/self")
+    async def user_info(authorization: Optional[str] = Header(None)):
+        fault = await simulate("users/self")
+        if fault is not None:
+            return fault
+        account = authorize(authorization)
+        if account is None:
+            return unauthorized()
+        return {"userId": hashlib.sha256(account.encode()).hexdigest()[:32], "username": account}
+
+    @app.get("/v2/users/self/dataRange")
+    async def data_range(authorization: Optional[str] = Header(None)):
+        fault = await simulate("dataRange")
+        if fault is not None:
+            return fault
+        account = authorize(authorization)
+        if account is None:
+            return unauthorized()
+        start, end = history_bounds()
+        # dataRange reports ISO strings even where egvs carry epoch milliseconds
+        bounds = {
+            key: {
+                "systemTime": (_EPOCH + timedelta(seconds=value)).strftime(DEXCOM_DATE_FORMAT),
+                "displayTime": (_EPOCH + timedelta(seconds=value)).strftime(DEXCOM_DATE_FORMAT)
+            }
+            for key, value in (("start", start), ("end", end))
+        }
+        return {"calibrations": bounds, "egvs": bounds, "events": bounds}
+
+    @app.get("/v2/users/self/egvs")
+    async def egvs(startDate: str = Query(...), endDate: str = Query(...), authorization: Optional[str] = Header(None)):
+        fault = await simulate("egvs")
+        if fault is not None:
+            return fault
+        account = authorize(authorization)
+        if account is None:
+            return unauthorized()
+        try:
+            start = int((datetime.strptime(startDate, DEXCOM_DATE_FORMAT) - _EPOCH).total_seconds())
+            end = int((datetime.strptime(endDate, DEXCOM_DATE_FORMAT) - _EPOCH).total_seconds())
+        except ValueError:
+            return JSONResponse({"errors": [{"code": "InvalidArgument", "message": "Bad date format"}]}, status_code=400)
+        if end <= start or end - start > 90 * 86400:
+            return JSONResponse({"errors": [{"code": "InvalidArgument", "message": "Date range must be 1s..90 days"}]}, status_code=400)
+
+        history_start, history_end = history_bounds()
+        ts, values, rates = synthetic_egvs(account, max(start, history_start), min(end, history_end), config.seed)
+        stats["egvs_returned"] += len(ts)
+        trends = _TREND_NAMES[np.digitize(rates, _TREND_BINS)].tolist()
+        times = render_time(ts)
+        return {
+            "unit": "mg/dL",
+            "rateUnit": "mg/dL/min",
+            "egvs": [
+                {
+                    "systemTime": t,
+                    "displayTime": t,
+                    "value": value,
+                    "realtimeValue": value,
+                    "smoothedValue": None,
+                    "status": None,
+                    "trend": trend,
+                    "trendRate": round(rate, 1)
+                }
+                for t, value, trend, rate in zip(times, values.tolist(), trends, rates.tolist())
+            ]
+        }
+
+    @app.get("/mock/stats")
+    async def mock_stats():
+        return dict(stats)
+
+    return app
+
+
+def parse_args(argv=None) -> Tuple[argparse.Namespace, MockConfig]:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=MockConfig.latency_ms)
+    parser.add_argument("--latency-jitter-ms", type=float, default=MockConfig.latency_jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=MockConfig.error_rate, help="fraction of calls answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=MockConfig.rate_limit_rate, help="fraction of calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=MockConfig.retry_after_seconds, help="Retry-After seconds on 429s")
+    parser.add_argument("--history-days", type=int, default=MockConfig.history_days)
+    parser.add_argument("--token-ttl", type=int, default=MockConfig.token_ttl_seconds)
+    parser.add_argument("--system-time-format", choices=("ms", "iso"), default=MockConfig.system_time_format)
+    parser.add_argument("--seed", type=int, default=MockConfig.seed)
+    args = parser.parse_args(argv)
+    config = MockConfig(
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after_seconds=args.retry_after,
+        history_days=args.history_days,
+        token_ttl_seconds=args.token_ttl,
+        system_time_format=args.system_time_format,
+        seed=args.seed
+    )
+    return args, config
+
+
+def main(argv=None):
+    import uvicorn
+
+    args, config = parse_args(argv)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
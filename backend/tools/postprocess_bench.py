@@ -0,0 +1,294 @@
+"""Check the chat reply post-processing against the original implementation and time both
+
+The reference functions below are frozen copies of the markdown cleanup and
+safety check ChatService ran before app/services/response_postprocess.py
+replaced them. Every case in the conformance corpus (hand-written edge
+cases plus seeded random replies) must give identical results through
+clean_markdown(), contains_dangerous_content() and, fed in random chunks,
+through the streaming filter. The Unicode assumptions the new code relies
+on are checked over every code point. Exits non-zero on any mismatch.
+
+    cd backend
+    python -m tools.postprocess_bench
+    python -m tools.postprocess_bench --fuzz 100000 --seed 7 --repeat 500
+"""
+import argparse
+import random
+import re
+import sys
+import timeit
+from typing import Callable, List, Tuple
+
+from app.services.chat_service import SAFE_ALTERNATIVE_RESPONSE, StreamingResponseFilter
+from app.services.response_postprocess import (
+    DANGEROUS_PATTERNS, DANGEROUS_PHRASES, _CASE_EXCEPTIONS, _LOWERCASE_ALIASES,
+    MarkdownCleaner, clean_markdown, contains_dangerous_content
+)
+
+
+def reference_clean(text: str) -> str:
+    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
+    text = re.sub(r'\*(.*?)\*', r'\1', text)
+    text = re.sub(r'^#{1,6}\s+', '', text, flags=re.MULTILINE)
+    text = re.sub(r'\n\s*#{1,6}\s+', '\n', text, flags=re.MULTILINE)
+    text = re.sub(r'`(.*?)`', r'\1', text)
+    text = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', text)
+    text = re.sub(r'\n\s*\n\s*\n', '\n\n', text)
+    text = re.sub(r'\n\s*-\s*', '\n- ', text)
+    text = re.sub(r'\n\s*\n', '\n\n', text)
+    text = re.sub(r'^\s*#{1,6}\s*$', '', text, flags=re.MULTILINE)
+    return text.strip()
+
+
+_REFERENCE_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in [
+    r'\b(?:take|give|inject|administer|use)\s+\d+\s*(?:units?|iu|iu\'s)\s+insulin\b',
+    r'\b(?:increase|decrease|adjust|change|modify)\s+(?:your\s+)?insulin\s+(?:dose|dosage|amount)\b',
+    r'\b(?:stop|start|discontinue|begin)\s+(?:taking|using)\s+(?:insulin|medication|medicine)\b',
+    r'\b(?:you\s+should|you\s+must|you\s+need\s+to)\s+(?:take|give|inject)\s+insulin\b',
+    r'\b(?:prescribe|prescription)\s+(?:of\s+)?(?:insulin|medication)\b',
+    r'\b(?:emergency|urgent|immediate|right\s+now)\s+(?:insulin|medication|treatment)\b'
+]]
+_REFERENCE_PHRASES = [
+    "take insulin", "give insulin", "inject insulin", "insulin dose",
+    "prescription", "you should take insulin", "you must take insulin", "you need to take insulin"
+]
+
+
+def reference_is_dangerous(text: str) -> bool:
+    text_lower = text.lower()
+    if any(pattern.search(text) for pattern in _REFERENCE_PATTERNS):
+        return True
+    return any(phrase in text_lower for phrase in _REFERENCE_PHRASES)
+
+
+def reference_reply(text: str) -> str:
+    """What the non-streaming chat path returned for a raw completion"""
+    cleaned = reference_clean(text)
+    return SAFE_ALTERNATIVE_RESPONSE if reference_is_dangerous(cleaned) else cleaned
+
+
+SAMPLE_REPLY = (
+    "## Overview\n\nYour **average** glucose over the last 24 hours was *118 mg/dL*, which is within the "
+    "target range.\n\n### Patterns\n\n- Morning readings tend to rise after breakfast\n  - Peak around "
+    "`165 mg/dL` at 9:00\n- Overnight levels are stable\n\nSee [ADA guidelines](https://diabetes.org) for "
+    "more. Talk to your care team about insulin and medication timing.\n\n"
+) * 6
+
+CORPUS = [
+    "",
+    "   \n\n  ",
+    "Short answer.",
+    SAMPLE_REPLY,
+    "**bold** and *italic* and `code` and ***both***",
+    "**unterminated bold\nnext line**",
+    "* list item\n* another * with star",
+    "2 * 3 = 6 and 4 * 5 = 20",
+    "# Title\n## Sub\n###### Six\n####### Seven\n#NoSpace",
+    "text\n   ## indented header\n#\n  #  \n",
+    "[link](http://x) [no url]() [](empty) [nested [a](b)](c) [open](paren",
+    "line\n\n\n\nmany blanks\n \n \t\n end",
+    "- a\n-b\n  -   c\n\n\n- d\n--- rule",
+    "trailing spaces   \n\n",
+    "\xa0non-breaking\xa0\n\u2028line separator\u3000ideographic space",
+    "Take 5 units insulin now.",
+    "take 5 UNITS INSULIN",
+    "give 10iu insulin",
+    "use 3 iu's insulin",
+    "take 5 units insulina",
+    "Increase your insulin dose",
+    "adjust insulin dosage today",
+    "Stop taking medication",
+    "begin using medicine",
+    "You should take insulin",
+    "you   need\tto\ninject insulin",
+    "prescribe of insulin",
+    "Emergency treatment",
+    "right now medication",
+    "retake insulin",
+    "nonprescription",
+    "insulin doses vary",
+    "ta\u212ae insulin",
+    "take \u0130nsulin",
+    "take \u0131nsulin",
+    "take in\u017fulin",
+    "use 5 units \u0130nsulin",
+    "medication and treatment options are worth discussing with your doctor",
+    "**You should** take insulin",
+    "`insulin` dose",
+    "[take](x) insulin",
+    "## you must take insulin",
+]
+
+_FUZZ_TOKENS = [
+    "*", "**", "`", "#", "##", " ", "  ", "\n", "\n\n", "\t", "-", "[", "]", "(", ")", "[a](b)", "x", "word",
+    "take", "Take", "5", "units", "iu", "insulin", "INSULIN", "dose", "your", "you", "should", "need", "to",
+    "stop", "taking", "medication", "prescribe", "prescription", "of", "urgent", "treatment", "right", "now",
+    "\xa0", "\u212a", "\u0130", "\u0131", "\u017f",
+]
+
+
+def random_reply(rng: random.Random) -> str:
+    return "".join(rng.choice(_FUZZ_TOKENS) for _ in range(rng.randint(0, 80)))
+
+
+def stream(text: str, rng: random.Random) -> str:
+    """Feed `text` through the streaming filter in random deltas; return what the client ends up showing"""
+    text_filter = StreamingResponseFilter()
+    shown = ""
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 8)
+        shown += text_filter.feed(text[i:i + size])
+        i += size
+    event, rest = text_filter.finish()
+    return rest if event == "replace" else shown + rest
+
+
+def check_case(text: str, rng: random.Random) -> List[str]:
+    failures = []
+    if clean_markdown(text) != reference_clean(text):
+        failures.append("clean_markdown")
+    if contains_dangerous_content(text) != reference_is_dangerous(text):
+        failures.append("contains_dangerous_content")
+
+    cleaner = MarkdownCleaner()
+    cleaned = ""
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 8)
+        cleaned += cleaner.feed(text[i:i + size])
+        i += size
+    if cleaned + cleaner.finish() != reference_clean(text):
+        failures.append("MarkdownCleaner")
+
+    if stream(text, rng) != reference_reply(text):
+        failures.append("StreamingResponseFilter")
+    return failures
+
+
+def check_unicode() -> List[str]:
+    """Code points that break an assumption the new implementation relies on"""
+    failures = []
+    space = re.compile(r'\s')
+    word = re.compile(r'\w')
+    digit = re.compile(r'\d')
+    pattern_chars = set("".join(DANGEROUS_PATTERNS).replace("\\", "")) | set("".join(DANGEROUS_PHRASES))
+    letters = {char for char in pattern_chars if char.isascii() and char.isalpha()}
+    literals = {char for char in pattern_chars if char.isascii() and not char.isalnum() and char not in " \\"}
+    caseless = {letter: re.compile(letter, re.IGNORECASE) for letter in letters}
+    any_letter = re.compile(f"[{''.join(sorted(letters))}]", re.IGNORECASE)
+
+    for code in range(sys.maxunicode + 1):
+        char = chr(code)
+        # Cut points use str.isspace() where the cleanup regexes use \s
+        if char.isspace() != bool(space.match(char)):
+            failures.append(f"U+{code:04X}: isspace() disagrees with \\s")
+        if char in _CASE_EXCEPTIONS:
+            continue
+        lowered = char.lower()
+        # Patterns run on text.lower() instead of case-insensitively on the text
+        if len(lowered) != 1:
+            failures.append(f"U+{code:04X}: lower() changes length")
+            continue
+        for rx in (space, word, digit):
+            if bool(rx.match(char)) != bool(rx.match(lowered)):
+                failures.append(f"U+{code:04X}: lower() changes {rx.pattern}")
+        if lowered in literals and char != lowered:
+            failures.append(f"U+{code:04X}: lowercases to {lowered!r}")
+        if not any_letter.match(char) and lowered not in letters:
+            continue
+        for letter, rx in caseless.items():
+            if bool(rx.match(char)) != (lowered == letter):
+                failures.append(f"U+{code:04X}: lower() and IGNORECASE disagree on {letter!r}")
+            # The exact fallback matches phrases with these classes
+            in_class = char in letter + letter.upper() + _LOWERCASE_ALIASES.get(letter, "")
+            if in_class != (lowered == letter):
+                failures.append(f"U+{code:04X}: phrase class for {letter!r} is wrong")
+    return failures
+
+
+def time_per_call(function: Callable[[], object], repeat: int) -> float:
+    """Best of three runs, in microseconds per call"""
+    return min(timeit.repeat(function, number=repeat, repeat=3)) / repeat * 1e6
+
+
+def benchmark(repeat: int) -> List[Tuple[str, float, float]]:
+    texts = [
+        ("reply", SAMPLE_REPLY),
+        ("reply without keywords", SAMPLE_REPLY.replace("insulin and medication", "meal")),
+    ]
+    results = []
+    for name, text in texts:
+        results.append((
+            f"clean ({name})",
+            time_per_call(lambda: reference_clean(text), repeat),
+            time_per_call(lambda: clean_markdown(text), repeat)
+        ))
+        cleaned = reference_clean(text)
+        results.append((
+            f"safety check ({name})",
+            time_per_call(lambda: reference_is_dangerous(cleaned), repeat),
+            time_per_call(lambda: contains_dangerous_content(cleaned), repeat)
+        ))
+        results.append((
+            f"clean + check ({name})",
+            time_per_call(lambda: reference_reply(text), repeat),
+            time_per_call(lambda: contains_dangerous_content(clean_markdown(text)), repeat)
+        ))
+
+    # Streaming with the reference functions means rerunning both over everything received on each delta
+    deltas = [SAMPLE_REPLY[i:i + 4] for i in range(0, len(SAMPLE_REPLY), 4)]
+
+    def reference_stream():
+        raw = ""
+        for delta in deltas:
+            raw += delta
+            reference_is_dangerous(reference_clean(raw))
+
+    def new_stream():
+        text_filter = StreamingResponseFilter()
+        for delta in deltas:
+            text_filter.feed(delta)
+        text_filter.finish()
+
+    stream_repeat = max(1, repeat // 50)
+    results.append((
+        f"stream, {len(deltas)} deltas",
+        time_per_call(reference_stream, stream_repeat),
+        time_per_call(new_stream, stream_repeat)
+    ))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--fuzz", type=int, default=20000, help="random replies to check")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1000, help="calls per timing run")
+    parser.add_argument("--skip-unicode", action="store_true", help="skip the scan over every code point")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    failures = []
+    cases = CORPUS + [random_reply(rng) for _ in range(args.fuzz)]
+    for text in cases:
+        failures.extend(f"{name}: {text!r}" for name in check_case(text, rng))
+    print(f"conformance: {len(cases)} cases, {len(failures)} mismatches")
+
+    if not args.skip_unicode:
+        unicode_failures = check_unicode()
+        print(f"unicode: {len(unicode_failures)} code points break an assumption")
+        failures.extend(unicode_failures)
+
+    for failure in failures[:20]:
+        print(f"  {failure}")
+    if failures:
+        sys.exit(1)
+
+    print(f"\n{'':<42}{'reference us':>14}{'new us':>10}{'speedup':>9}")
+    for name, reference_us, new_us in benchmark(args.repeat):
+        print(f"{name:<42}{reference_us:>14.1f}{new_us:>10.1f}{reference_us / new_us:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Drive simulated users through connect, backfill and polling against a mock Dexcom API
+
+Runs the backend app in-process (through httpx's ASGI transport, with its
+lifespan) and points DexcomService at tools/mock_dexcom.py, started on a
+local port unless --dexcom-url names one already running. Each user
+connects (OAuth state + token exchange), waits for the historical backfill
+to finish and then polls /glucose. Reports per-phase throughput and
+p50/p95/p99 latencies.
+
+    cd backend
+    python -m tools.sync_load_test --users 50 --history-days 180 --polls 20
+    python -m tools.sync_load_test --users 20 --rate-limit-rate 0.05 --error-rate 0.02
+
+Synced readings go to a temporary data directory; tokens and sync state go
+to MongoDB if MONGO_URI is configured, otherwise to the in-memory fallback.
+The built-in mock shares the event loop with the app, so its JSON rendering
+shows up in the app's latencies; run tools/mock_dexcom.py separately and pass
+--dexcom-url to measure the app alone.
+"""
+import argparse
+import asyncio
+import socket
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+
+from tools.mock_dexcom import MockConfig, create_app as create_mock_app
+
+
+class PhaseStats:
+    """Latencies and outcomes of one phase across all users"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.first_start: Optional[float] = None
+        self.last_end: Optional[float] = None
+
+    def record(self, started: float, ok: bool = True):
+        ended = time.perf_counter()
+        self.latencies.append(ended - started)
+        if not ok:
+            self.errors += 1
+        self.first_start = started if self.first_start is None else min(self.first_start, started)
+        self.last_end = ended if self.last_end is None else max(self.last_end, ended)
+
+    def summary(self) -> Dict[str, float]:
+        if not self.latencies:
+            return {"count": 0}
+        latencies_ms = np.asarray(self.latencies) * 1000
+        p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+        elapsed = max(self.last_end - self.first_start, 1e-9)
+        return {
+            "count": len(self.latencies),
+            "errors": self.errors,
+            "per_second": len(self.latencies) / elapsed,
+            "p50_ms": p50,
+            "p95_ms": p95,
+            "p99_ms": p99,
+            "max_ms": latencies_ms.max()
+        }
+
+
+async def run_user(client: httpx.AsyncClient, user_id: str, args, stats: Dict[str, PhaseStats]):
+    # Connect: OAuth state, then the token exchange the frontend performs after the redirect
+    started = time.perf_counter()
+    try:
+        state = (await client.get("/dexcom/connect", params={"user_id": user_id})).json()["state"]
+        result = (await client.post("/dexcom/exchange-token", json={"code": user_id, "state": state, "user_id": user_id})).json()
+        ok = bool(result.get("success"))
+    except Exception:
+        ok = False
+    stats["connect"].record(started, ok)
+    if not ok:
+        return
+
+    # Backfill: runs in the background after the exchange; wait for it to settle
+    started = time.perf_counter()
+    deadline = started + args.backfill_timeout
+    while True:
+        status = (await client.get(f"/dexcom/backfill/{user_id}")).json()["status"]
+        if status != "running" or time.perf_counter() > deadline:
+            break
+        await asyncio.sleep(0.05)
+    stats["backfill"].record(started, status == "completed")
+
+    # Polling: the dashboard refetching /glucose
+    for _ in range(args.polls):
+        started = time.perf_counter()
+        try:
+            response = await client.get("/glucose", params={"user_id": user_id, "range": args.range})
+            ok = response.status_code == 200 and response.json().get("source") == "dexcom"
+        except Exception:
+            ok = False
+        stats["poll"].record(started, ok)
+        if args.poll_interval:
+            await asyncio.sleep(args.poll_interval)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_mock(config: MockConfig):
+    import uvicorn
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(create_mock_app(config), host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task, f"http://127.0.0.1:{port}"
+
+
+async def main_async(args):
+    from app.main import app, lifespan
+    from app.services.dexcom_service import dexcom_service
+    from app.services.real_data_service import real_data_service
+    from app.services.sync_service import glucose_sync_service
+
+    mock = None
+    dexcom_url = args.dexcom_url
+    if not dexcom_url:
+        mock = await start_mock(MockConfig(
+            latency_ms=args.latency_ms,
+            latency_jitter_ms=args.latency_jitter_ms,
+            error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate,
+            history_days=args.history_days
+        ))
+        dexcom_url = mock[2]
+    dexcom_service.base_url = dexcom_url
+
+    data_dir = tempfile.TemporaryDirectory(prefix="dialog-loadtest-")
+    real_data_service.data_dir = Path(data_dir.name)
+    stats: Dict[str, PhaseStats] = defaultdict(PhaseStats)
+
+    try:
+        async with lifespan(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://backend", timeout=None) as client:
+                started = time.perf_counter()
+
+                async def staggered(i: int):
+                    await asyncio.sleep(i * args.ramp)
+                    await run_user(client, f"loadtest_user_{i}", args, stats)
+
+                await asyncio.gather(*(staggered(i) for i in range(args.users)))
+                elapsed = time.perf_counter() - started
+                # Polls kick off background syncs; let them finish before the mock goes away
+                await glucose_sync_service.drain()
+
+            async with httpx.AsyncClient(base_url=dexcom_url) as mock_client:
+                mock_stats = (await mock_client.get("/mock/stats")).json() if mock else {}
+    finally:
+        if mock:
+            mock[0].should_exit = True
+            await mock[1]
+        data_dir.cleanup()
+
+    print(f"\n{args.users} users in {elapsed:.2f}s against {dexcom_url}")
+    print(f"{'phase':<10}{'count':>8}{'errors':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for phase in ("connect", "backfill", "poll"):
+        summary = stats[phase].summary()
+        if not summary["count"]:
+            print(f"{phase:<10}{0:>8}")
+            continue
+        print(
+            f"{phase:<10}{summary['count']:>8}{summary['errors']:>8}{summary['per_second']:>10.1f}"
+            f"{summary['p50_ms']:>10.1f}{summary['p95_ms']:>10.1f}{summary['p99_ms']:>10.1f}{summary['max_ms']:>10.1f}"
+        )
+    if mock_stats:
+        print("mock Dexcom calls: " + ", ".join(f"{key}={value}" for key, value in sorted(mock_stats.items())))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds between user starts")
+    parser.add_argument("--polls", type=int, default=10, help="/glucose requests per user after backfill")
+    parser.add_argument("--poll-interval", type=float, default=0.0)
+    parser.add_argument("--range", default="24h", help="/glucose range each poll asks for")
+    parser.add_argument("--backfill-timeout", type=float, default=120.0)
+    parser.add_argument("--dexcom-url", default="", help="use a running mock instead of starting one")
+    parser.add_argument("--history-days", type=int, default=MockConfig.history_days)
+    parser.add_argument("--latency-ms", type=float, default=MockConfig.latency_ms)
+    parser.add_argument("--latency-jitter-ms", type=float, default=MockConfig.latency_jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    asyncio.run(main_async(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ import {
 } from "recharts";
 import { format } from "date-fns";
 import { TrendingUp, Activity } from "lucide-react";
+import type { GlucoseRange } from "../../hooks/useGlucoseQuery";
 
 type Point = { ts: string; mgdl: number; trend?: string; trendRate?: number };
 
@@ -21,11 +22,14 @@ export default function GlucoseLine({
 }: {
   data: Point[];
   showTargetRange?: boolean;
-  timeRange?: "3h" | "6h" | "12h" | "24h";
+  timeRange?: GlucoseRange;
 }) {
+  // Multi-day ranges label the axis by date, shorter ones by time of day
+  const axisFormat = timeRange?.endsWith("d") ? "MMM d" : "hh:mm a";
+
   // Transform data for the chart
   const chartData = data.map((point) => ({
-    time: format(new Date(point.ts), "hh:mm a"),
+    time: format(new Date(point.ts), axisFormat),
     glucose: point.mgdl,
     fullTime: format(new Date(point.ts), "PPpp"),
     trend: point.trend || "stable",
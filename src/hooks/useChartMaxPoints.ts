@@ -0,0 +1,33 @@
+import { useEffect, useRef, useState } from "react";
+
+// One point per 2px is as much as a line chart can show
+const PIXELS_PER_POINT = 2;
+// Widths are rounded to this step so resizing doesn't refetch on every pixel
+const WIDTH_STEP = 200;
+const MIN_POINTS = 100;
+
+function pointsForWidth(width: number) {
+  const stepped = Math.max(WIDTH_STEP, Math.round(width / WIDTH_STEP) * WIDTH_STEP);
+  return Math.max(MIN_POINTS, Math.round(stepped / PIXELS_PER_POINT));
+}
+
+// Measure a chart container and return how many points to ask /glucose for
+export function useChartMaxPoints<T extends HTMLElement>() {
+  const ref = useRef<T>(null);
+  const [maxPoints, setMaxPoints] = useState(() =>
+    pointsForWidth(typeof window === "undefined" ? 800 : window.innerWidth)
+  );
+
+  useEffect(() => {
+    const element = ref.current;
+    if (!element) return;
+
+    const update = () => setMaxPoints(pointsForWidth(element.clientWidth));
+    update();
+    const observer = new ResizeObserver(update);
+    observer.observe(element);
+    return () => observer.disconnect();
+  }, []);
+
+  return { ref, maxPoints };
+}
@@ -17,29 +17,38 @@ interface GlucoseResponse {
   message?: string;
 }
 
+// Ranges the /glucose endpoint serves; the multi-day ones should be requested with maxPoints
+export type GlucoseRange = "3h" | "6h" | "12h" | "24h" | "7d" | "14d" | "30d" | "90d";
+
 // Cache for storing data by range
 const dataCache = new Map<string, GlucoseResponse>();
 
 export function useGlucoseQuery({
   range,
+  maxPoints,
 }: {
-  range: "3h" | "6h" | "12h" | "24h";
+  range: GlucoseRange;
+  // Ask the server to downsample the window to at most this many points
+  maxPoints?: number;
 }) {
   const queryClient = useQueryClient();
+  const cacheKey = maxPoints ? `${range}:${maxPoints}` : range;
 
   return useQuery({
-    queryKey: ["glucose", range],
+    queryKey: maxPoints ? ["glucose", range, maxPoints] : ["glucose", range],
     queryFn: async (): Promise<GlucoseResponse> => {
-      const { data } = await axios.get(`${API}/glucose`, { params: { range } });
+      const { data } = await axios.get(`${API}/glucose`, {
+        params: { range, max_points: maxPoints },
+      });
 
       // Cache the data
-      dataCache.set(range, data);
+      dataCache.set(cacheKey, data);
 
       return data;
     },
     // Use cached data immediately if available for the exact same range
     initialData: () => {
-      const cached = dataCache.get(range);
+      const cached = dataCache.get(cacheKey);
       return cached || undefined;
     },
     // Keep data fresh for 2 minutes (shorter to ensure different ranges get fresh data)
@@ -55,10 +64,12 @@ export function useGlucoseQuery({
 // Helper hook to get just the glucose data array
 export function useGlucoseData({
   range,
+  maxPoints,
 }: {
-  range: "3h" | "6h" | "12h" | "24h";
+  range: GlucoseRange;
+  maxPoints?: number;
 }) {
-  const query = useGlucoseQuery({ range });
+  const query = useGlucoseQuery({ range, maxPoints });
 
   return {
     ...query,
@@ -71,17 +82,19 @@ export function useGlucoseData({
 export function usePrefetchGlucoseData() {
   const queryClient = useQueryClient();
 
-  const prefetchAll = () => {
-    const ranges: ("3h" | "6h" | "12h" | "24h")[] = ["3h", "6h", "12h", "24h"];
+  // Pass the same maxPoints the chart will ask for so the prefetched entries get used
+  const prefetchAll = (maxPoints?: number) => {
+    const ranges: GlucoseRange[] = ["3h", "6h", "12h", "24h"];
 
     ranges.forEach((range) => {
+      const cacheKey = maxPoints ? `${range}:${maxPoints}` : range;
       queryClient.prefetchQuery({
-        queryKey: ["glucose", range],
+        queryKey: maxPoints ? ["glucose", range, maxPoints] : ["glucose", range],
         queryFn: async (): Promise<GlucoseResponse> => {
           const { data } = await axios.get(`${API}/glucose`, {
-            params: { range },
+            params: { range, max_points: maxPoints },
           });
-          dataCache.set(range, data);
+          dataCache.set(cacheKey, data);
           return data;
         },
         staleTime: 5 * 60 * 1000,
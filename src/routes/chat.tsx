@@ -34,13 +34,13 @@ export default function Chat() {
   );
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const messagesContainerRef = useRef<HTMLDivElement>(null);
-  const streamIntervalRef = useRef<number | null>(null);
+  const abortControllerRef = useRef<AbortController | null>(null);
 
   // Function to stop streaming
   const stopStreaming = () => {
-    if (streamIntervalRef.current) {
-      clearInterval(streamIntervalRef.current);
-      streamIntervalRef.current = null;
+    if (abortControllerRef.current) {
+      abortControllerRef.current.abort();
+      abortControllerRef.current = null;
     }
 
     // Mark the current streaming message as complete
@@ -59,56 +59,52 @@ export default function Chat() {
   // Cleanup on unmount
   useEffect(() => {
     return () => {
-      if (streamIntervalRef.current) {
-        clearInterval(streamIntervalRef.current);
-      }
+      abortControllerRef.current?.abort();
     };
   }, []);
 
-  // Function to simulate streaming effect
-  const streamMessage = (fullContent: string, messageId: string) => {
-    const words = fullContent.split(" ");
-    let currentIndex = 0;
-
-    console.log(
-      "Starting to stream message:",
-      messageId,
-      "Words:",
-      words.length
+  const updateMessage = (messageId: string, update: (msg: Message) => Message) => {
+    setMessages((prev) =>
+      prev.map((msg) => (msg.id === messageId ? update(msg) : msg))
     );
+  };
 
-    // Small delay before starting to stream
-    setTimeout(() => {
-      const streamInterval = setInterval(() => {
-        if (currentIndex < words.length) {
-          setMessages((prev) =>
-            prev.map((msg) =>
-              msg.id === messageId
-                ? {
-                    ...msg,
-                    content: words.slice(0, currentIndex + 1).join(" "),
-                    isStreaming: true,
-                  }
-                : msg
-            )
-          );
-          currentIndex++;
-        } else {
-          console.log("Finished streaming message:", messageId);
-          setMessages((prev) =>
-            prev.map((msg) =>
-              msg.id === messageId ? { ...msg, isStreaming: false } : msg
-            )
-          );
-          clearInterval(streamInterval);
-          setStreamingMessageId(null);
-          setIsLoading(false);
+  // Read server-sent events from /chat/stream into the assistant message
+  const readStream = async (response: Response, messageId: string) => {
+    const reader = response.body!.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+        const rawEvent = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        let event = "message";
+        let data = "";
+        for (const line of rawEvent.split("\n")) {
+          if (line.startsWith("event: ")) event = line.slice(7);
+          else if (line.startsWith("data: ")) data += line.slice(6);
         }
-      }, 30); // Faster streaming for better effect
-
-      // Store the interval reference for stopping
-      streamIntervalRef.current = streamInterval;
-    }, 300); // Initial delay to show typing indicator
+        const payload = data ? JSON.parse(data) : {};
+
+        if (event === "delta") {
+          updateMessage(messageId, (msg) => ({
+            ...msg,
+            content: msg.content + payload.text,
+          }));
+        } else if (event === "replace") {
+          updateMessage(messageId, (msg) => ({ ...msg, content: payload.text }));
+        } else if (event === "error") {
+          throw new Error(payload.error || "Failed to get response");
+        }
+      }
+    }
   };
 
   const sendMessage = async () => {
@@ -125,8 +121,18 @@ export default function Chat() {
     setInputMessage("");
     setIsLoading(true);
 
+    const assistantMessage: Message = {
+      id: (Date.now() + 1).toString(),
+      content: "",
+      role: "assistant",
+      timestamp: new Date(),
+      isStreaming: true,
+    };
+    const controller = new AbortController();
+    abortControllerRef.current = controller;
+
     try {
-      const response = await fetch("http://localhost:8000/chat", {
+      const response = await fetch("http://localhost:8000/chat/stream", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -135,37 +141,40 @@ export default function Chat() {
           message: inputMessage,
           user_id: "default_user",
         }),
+        signal: controller.signal,
       });
 
-      const data = await response.json();
-
-      if (data.success) {
-        const assistantMessage: Message = {
-          id: (Date.now() + 1).toString(),
-          content: "",
-          role: "assistant",
-          timestamp: new Date(),
-          isStreaming: true,
-        };
+      if (!response.ok || !response.body) {
+        throw new Error("Failed to get response");
+      }
 
-        setMessages((prev) => [...prev, assistantMessage]);
-        setStreamingMessageId(assistantMessage.id); // Set the ID for stopping
+      setMessages((prev) => [...prev, assistantMessage]);
+      setStreamingMessageId(assistantMessage.id); // Set the ID for stopping
 
-        // Start streaming the response
-        streamMessage(data.response, assistantMessage.id);
-      } else {
-        throw new Error(data.error || "Failed to get response");
-      }
+      await readStream(response, assistantMessage.id);
     } catch (error) {
-      const errorMessage: Message = {
-        id: (Date.now() + 1).toString(),
-        content:
-          "I'm sorry, I'm having trouble processing your request right now. Please try again later.",
-        role: "assistant",
-        timestamp: new Date(),
-      };
-      setMessages((prev) => [...prev, errorMessage]);
+      if (!controller.signal.aborted) {
+        const errorContent =
+          "I'm sorry, I'm having trouble processing your request right now. Please try again later.";
+        setMessages((prev) =>
+          prev.some((msg) => msg.id === assistantMessage.id)
+            ? prev.map((msg) =>
+                msg.id === assistantMessage.id
+                  ? { ...msg, content: errorContent }
+                  : msg
+              )
+            : [
+                ...prev,
+                { ...assistantMessage, content: errorContent, isStreaming: false },
+              ]
+        );
+      }
     } finally {
+      updateMessage(assistantMessage.id, (msg) => ({ ...msg, isStreaming: false }));
+      if (abortControllerRef.current === controller) {
+        abortControllerRef.current = null;
+      }
+      setStreamingMessageId(null);
       setIsLoading(false);
     }
   };
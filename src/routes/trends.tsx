@@ -2,7 +2,9 @@ import { useState, useEffect, useCallback } from "react";
 import {
   useGlucoseData,
   usePrefetchGlucoseData,
+  type GlucoseRange,
 } from "../hooks/useGlucoseQuery";
+import { useChartMaxPoints } from "../hooks/useChartMaxPoints";
 import GlucoseLine from "../components/charts/GlucoseLine";
 import {
   TrendingUp,
@@ -15,12 +17,14 @@ import {
 } from "lucide-react";
 
 export default function Trends() {
-  const [selectedRange, setSelectedRange] = useState<
-    "3h" | "6h" | "12h" | "24h"
-  >("24h");
+  const [selectedRange, setSelectedRange] = useState<GlucoseRange>("24h");
+
+  // Size the request to the chart so multi-day ranges come back downsampled
+  const { ref: chartRef, maxPoints } = useChartMaxPoints<HTMLDivElement>();
 
   const { data, isLoading, error, dataSource, isFetching } = useGlucoseData({
     range: selectedRange,
+    maxPoints,
   });
 
   // Prefetch all ranges for seamless transitions
@@ -28,8 +32,8 @@ export default function Trends() {
 
   // Use useCallback to prevent infinite re-renders
   const handlePrefetch = useCallback(() => {
-    prefetchAll();
-  }, [prefetchAll]);
+    prefetchAll(maxPoints);
+  }, [prefetchAll, maxPoints]);
 
   useEffect(() => {
     // Prefetch all ranges when component mounts (only once)
@@ -41,6 +45,10 @@ export default function Trends() {
     { value: "6h", label: "6 Hours", icon: Clock },
     { value: "12h", label: "12 Hours", icon: Clock },
     { value: "24h", label: "24 Hours", icon: Clock },
+    { value: "7d", label: "7 Days", icon: Clock },
+    { value: "14d", label: "14 Days", icon: Clock },
+    { value: "30d", label: "30 Days", icon: Clock },
+    { value: "90d", label: "90 Days", icon: Clock },
   ];
 
   // Show cached data immediately, only show loading for initial load
@@ -155,7 +163,7 @@ export default function Trends() {
                 <button
                   key={range.value}
                   onClick={() =>
-                    setSelectedRange(range.value as "3h" | "6h" | "12h" | "24h")
+                    setSelectedRange(range.value as GlucoseRange)
                   }
                   className={`flex items-center gap-1.5 px-3 py-1.5 rounded-md border text-xs font-medium transition-all duration-200 ${
                     isSelected
@@ -184,15 +192,19 @@ export default function Trends() {
             {selectedRange === "6h" && "Half-day glucose trends and variations"}
             {selectedRange === "12h" && "Daily glucose patterns and cycles"}
             {selectedRange === "24h" && "Full day glucose overview and trends"}
+            {selectedRange === "7d" && "Weekly glucose patterns and trends"}
+            {selectedRange === "14d" && "Two-week glucose overview"}
+            {selectedRange === "30d" && "Monthly glucose overview and trends"}
+            {selectedRange === "90d" && "Three-month glucose overview"}
           </p>
         </div>
-        <div className="p-6">
+        <div className="p-6" ref={chartRef}>
           {showLoading ? (
             <div className="flex items-center justify-center h-64">
               <div className="animate-spin rounded-full h-12 w-12 border-b-2 border-blue-600"></div>
             </div>
           ) : (
-            <GlucoseLine data={data} />
+            <GlucoseLine data={data} timeRange={selectedRange} />
           )}
         </div>
       </div>